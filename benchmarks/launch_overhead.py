@@ -0,0 +1,79 @@
+'''
+Microbenchmark comparing the two ways mooq can launch consumer callbacks.
+
+- create_task: wraps each coroutine and awaits a launched future per message,
+  one event loop round trip per message.
+- start_task: schedules each coroutine directly and yields once per batch.
+
+Memory is reported as the peak traced memory divided by the number of
+callbacks in flight at once, which is the batch size.
+
+Usage::
+
+    python -m benchmarks.launch_overhead [num_messages] [batch_size]
+'''
+
+import asyncio
+import sys
+import time
+import tracemalloc
+
+from mooq import base
+
+
+async def callback(resp):
+    pass
+
+
+async def with_create_task(loop, num_messages, batch_size):
+    for i in range(num_messages):
+        _, launched = base.create_task(callback(i), loop)
+        await launched
+
+    await asyncio.sleep(0)
+
+
+async def with_start_task(loop, num_messages, batch_size):
+    for i in range(num_messages):
+        base.start_task(callback(i), loop)
+        if (i + 1) % batch_size == 0:
+            await asyncio.sleep(0)
+
+    await asyncio.sleep(0)
+
+
+def measure(func, num_messages, batch_size):
+    loop = asyncio.new_event_loop()
+    try:
+        start = time.perf_counter()
+        loop.run_until_complete(func(loop, num_messages, batch_size))
+        elapsed = time.perf_counter() - start
+
+        tracemalloc.start()
+        loop.run_until_complete(func(loop, num_messages, batch_size))
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    finally:
+        loop.close()
+
+    return elapsed, peak
+
+
+def main():
+    num_messages = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    batch_size = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+
+    print("{} messages".format(num_messages))
+    runs = [
+        (with_create_task, 1),
+        (with_start_task, 1),
+        (with_start_task, batch_size),
+    ]
+    for func, size in runs:
+        elapsed, peak = measure(func, num_messages, size)
+        print("{:<18} batch {:<5} {:8.2f} us/msg {:8.0f} bytes/task in flight".format(
+            func.__name__, size, elapsed / num_messages * 1e6, peak / size))
+
+
+if __name__ == "__main__":
+    main()
@@ -6,10 +6,20 @@ mooq is a asyncio compatible library for interacting with RabbitMQ AMQP broker.
 from .__version__ import __version__
 
 from .base import ExchangeNotFound, ConsumerQueueNotFound, ConsumeTimeout, \
-    NothingToConsume, BadExchange, BrokerInternalError
+    NothingToConsume, BadExchange, BrokerInternalError, PublishNacked, \
+    PublisherClosed
+
+from .base import BufferedPublisher, ChannelPool, RawMessage
+
+from . import serializers, compression
 
 from .in_memory import InMemoryBroker, InMemoryConnection, InMemoryChannel
 
-from .rabbit import RabbitMQBroker, RabbitMQConnection, RabbitMQChannel
+from .rabbit import RabbitMQBroker, RabbitMQConnection, RabbitMQChannel, \
+    RabbitMQAsyncioConnection, RabbitMQAsyncioChannel
+
+from .pooled import PooledConnection, PooledChannel
 
 from .connect import connect
+
+from .workers import WorkerPool, WorkerStats
@@ -5,7 +5,11 @@ Base classes, helper functions and custom exceptions for mooq
 
 import threading
 import asyncio
-from functools import wraps
+import concurrent.futures
+from collections import deque, namedtuple
+from functools import partial, wraps
+
+from . import serializers, compression as compressors
 
 
 class ExchangeNotFound(Exception):
@@ -32,9 +36,25 @@ class BrokerInternalError(Exception):
     pass
 
 
+class PublishNacked(Exception):
+    pass
+
+
+class PublisherClosed(Exception):
+    pass
+
+
 broker_registry = {}
 
 
+#: What a consumer registered with ``raw=True`` is passed for each message.
+#: ``body`` is the message body exactly as received, without decoding,
+#: decompressing or copying. ``content_encoding`` is the name of the
+#: compression used, or None. ``delivery_tag`` is None for the in memory broker.
+RawMessage = namedtuple("RawMessage", ["body", "exchange", "routing_key",
+                                       "delivery_tag", "content_type", "content_encoding"])
+
+
 def create_task(coro_obj, loop):
     '''
     wrapper for creating a task that can be used for waiting
@@ -58,6 +78,276 @@ def create_task(coro_obj, loop):
     return loop.create_task(task_wrapper(coro_obj, launched)), launched
 
 
+def start_task(coro_obj, loop):
+    '''
+    Lightweight alternative to :func:`create_task` for when there is no
+    need to wait until the coroutine has started.
+
+    The coroutine object is scheduled directly, without a wrapper
+    coroutine or a launched future. Tasks started before the caller
+    next yields to the event loop will have started by the time the
+    caller resumes.
+
+    :param coro_obj: coroutine object to schedule
+    :param loop: event loop
+    :returns: the task object
+
+    .. note:: must only be called from within the thread
+        where the event loop resides
+    '''
+    return loop.create_task(coro_obj)
+
+
+class Consumer(object):
+    '''
+    Runs the callback of a registered consumer, keeping track of
+    how many callbacks are in flight.
+    '''
+
+    def __init__(self, callback, *, loop, max_concurrency=None, key=None):
+        '''
+        :param callback: the callback to run for each message
+        :param loop: event loop
+        :param max_concurrency: the maximum number of callbacks that
+            may run at once. A value of None means no limit.
+        :param key: If given, a function returning the key of a message.
+            The callbacks of messages with the same key run one at a time,
+            in the order the messages were received. Messages waiting for
+            an earlier message with the same key don't take up one of the
+            ``max_concurrency`` callbacks, but at most ``max_concurrency``
+            of them may wait at once.
+        :type callback: coroutine
+        :type max_concurrency: int|None
+        :type key: function|None
+        '''
+        self.callback = callback
+        self.loop = loop
+        self.max_concurrency = max_concurrency
+        self.key = key
+        self.in_flight = 0
+        self.waiting = 0
+        self._resume_listeners = []
+        self._waiting_by_key = {}
+
+    @property
+    def saturated(self):
+        '''
+        True if the maximum number of callbacks are running, or the
+        maximum number of messages are waiting for an earlier message
+        with the same key
+        '''
+        if self.max_concurrency is None:
+            return False
+
+        return self.in_flight >= self.max_concurrency or self.waiting >= self.max_concurrency
+
+    @property
+    def capacity(self):
+        '''
+        the number of messages that can be run before the
+        consumer is saturated, or None if there is no limit
+        '''
+        if self.max_concurrency is None:
+            return None
+
+        return max(self.max_concurrency - max(self.in_flight, self.waiting), 0)
+
+    def add_resume_listener(self, func):
+        '''
+        Add a function to call whenever a saturated consumer
+        finishes a callback.
+
+        :param func: function taking no arguments
+        '''
+        self._resume_listeners.append(func)
+
+    def run(self, resp):
+        '''
+        Schedule the callback for a message
+
+        :param resp: the message dictionary to pass to the callback
+        :returns: the task running the callback, as returned by :func:`start_task`.
+            For a message that waits for an earlier message with the same key,
+            a future that becomes done like that task once the callback has run.
+            If the key of the message can't be found, the error is reported
+            to the event loop's exception handler and the returned future
+            is cancelled.
+
+        .. note:: must only be called from within the thread
+            where the event loop resides
+        '''
+        if self.key is None:
+            return self._start(resp)
+
+        try:
+            key = self.key(resp)
+        except Exception as e:
+            self.loop.call_exception_handler({
+                "message": "dropping message whose order key couldn't be found",
+                "exception": e,
+            })
+            fut = self.loop.create_future()
+            fut.cancel()
+            return fut
+
+        waiting = self._waiting_by_key.get(key)
+        if waiting is not None:
+            fut = self.loop.create_future()
+            waiting.append((resp, fut))
+            self.waiting += 1
+            return fut
+
+        self._waiting_by_key[key] = deque()
+        return self._start(resp, key)
+
+    def _start(self, resp, key=None):
+        task = start_task(self.callback(resp), self.loop)
+        self.in_flight += 1
+        task.add_done_callback(partial(self._on_done, key))
+        return task
+
+    def _on_done(self, key, task):
+        was_saturated = self.saturated
+        self.in_flight -= 1
+        if self.key is not None:
+            self._start_next(key)
+
+        if was_saturated:
+            for func in self._resume_listeners:
+                func()
+
+    def _start_next(self, key):
+        # the next message with the key takes the slot of the one that finished
+        waiting = self._waiting_by_key[key]
+        if not waiting:
+            del self._waiting_by_key[key]
+            return
+
+        resp, fut = waiting.popleft()
+        self.waiting -= 1
+        self._start(resp, key).add_done_callback(partial(_copy_outcome, fut))
+
+
+def _copy_outcome(fut, task):
+    if fut.done():
+        return
+
+    if task.cancelled():
+        fut.cancel()
+    elif task.exception() is not None:
+        fut.set_exception(task.exception())
+    else:
+        fut.set_result(task.result())
+
+
+def pick_callback(callback, batch_callback):
+    '''
+    Choose between the callback arguments of a consumer.
+
+    :returns: a two element tuple where the first element is the
+        callback to run and the second is True if it is run with
+        a list of messages
+    :raises ValueError: unless exactly one of the arguments is given
+    '''
+    if (callback is None) == (batch_callback is None):
+        raise ValueError("a consumer needs exactly one of callback and batch_callback")
+
+    if batch_callback is not None:
+        return batch_callback, True
+
+    return callback, False
+
+
+def routing_key_of(resp):
+    '''
+    The default key for ordered consumption.
+
+    :param resp: a message dictionary or a :data:`RawMessage`
+    :returns: the routing key of the message
+    '''
+    if isinstance(resp, RawMessage):
+        return resp.routing_key
+
+    return resp["routing_key"]
+
+
+def pick_order_key(ordered, order_key, batch):
+    '''
+    Choose the key function of a consumer.
+
+    :returns: the key function, or None if messages aren't ordered
+    :raises ValueError: if ordered messages are asked for with a batch callback
+    '''
+    if not ordered:
+        return None
+
+    if batch:
+        raise ValueError("ordered consumption needs a callback, not a batch_callback")
+
+    return order_key or routing_key_of
+
+
+def decode(body, serializer, content_type=None, content_encoding=None):
+    '''
+    Decompress and decode a received message body.
+
+    :param body: the message body as received
+    :param serializer: the serializer of the receiving channel
+    :param content_type: the content type of the message
+    :param content_encoding: the content encoding of the message
+    :type body: bytes
+    :type serializer: :class:`mooq.serializers.Serializer`
+    :type content_type: str|None
+    :type content_encoding: str|None
+    :returns: the decoded message
+    '''
+    if content_encoding is not None:
+        body = compressors.decompress(body, content_encoding)
+
+    return serializers.for_content_type(content_type, serializer).decode(body)
+
+
+def resp_from_raw(raw, serializer):
+    '''
+    :param raw: a received message
+    :param serializer: the serializer of the receiving channel
+    :type raw: :data:`RawMessage`
+    :type serializer: :class:`mooq.serializers.Serializer`
+    :returns: the dictionary a consumer's callback is passed for the message
+    '''
+    return {
+        "msg": decode(raw.body, serializer, raw.content_type, raw.content_encoding),
+        "routing_key": raw.routing_key,
+    }
+
+
+def _num_workers(executor):
+    '''
+    :returns: the number of workers of a standard library thread or process
+        pool executor, or None for other executors, whose size is unknown
+    '''
+    # the standard library pools keep their size in the private
+    # _max_workers attribute, and have no public way to read it
+    if isinstance(executor, (concurrent.futures.ThreadPoolExecutor, concurrent.futures.ProcessPoolExecutor)):
+        return executor._max_workers
+
+    return None
+
+
+def _run_offloaded(func, serializer, batch, msgs):
+    '''
+    Runs in an executor. Decodes the raw messages, unless ``serializer``
+    is None, and runs the consumer's function with them.
+    '''
+    if serializer is not None:
+        if batch:
+            msgs = [resp_from_raw(raw, serializer) for raw in msgs]
+        else:
+            msgs = resp_from_raw(msgs, serializer)
+
+    return func(msgs)
+
+
 class Broker(object):
     '''
     Base class for a broker. Not to be used directly.
@@ -166,30 +456,81 @@ class Connection(object):
     '''
     Base class for a connection to a broker. Not to be used directly.
     '''
-    def __init__(self, *, host, port):
+    def __init__(self, *, host, port, serializer="json", compression=None):
         '''
         :param host: the hostname of the broker you wish to connect to
         :type host: str
         :param port: the port of the broker you wish to connect to
         :type port: int
+        :param serializer: the default serializer for the connection's channels,
+            as a name or a :class:`mooq.serializers.Serializer` object
+        :type serializer: str|:class:`mooq.serializers.Serializer`
+        :param compression: the default compression for the connection's channels,
+            as a name or a :class:`mooq.compression.Compressor` object. A value of
+            None means messages aren't compressed.
+        :type compression: str|:class:`mooq.compression.Compressor`|None
 
         .. note:: must call :meth:`connect` to actually connect to the broker
         '''
         self.host = host
         self.port = port
+        self.serializer = serializers.get(serializer)
+        self.compressor = compressors.get(compression)
         self.conn_lock = _TimeoutRLock(1)
         self.connected = False
         self.channels = []
         self.loop = asyncio.get_event_loop()
 
-    async def create_channel(self):
+    async def create_channel(self, serializer=None, compression=None):
         '''
         create a channel for multiplexing the connection
 
+        :param serializer: the serializer for the channel, as a name or a
+            :class:`mooq.serializers.Serializer` object. A value of None uses
+            the connection's serializer.
+        :type serializer: str|:class:`mooq.serializers.Serializer`|None
+        :param compression: the compression for the channel, as a name or a
+            :class:`mooq.compression.Compressor` object. A value of None uses
+            the connection's compression.
+        :type compression: str|:class:`mooq.compression.Compressor`|None
         :raises NotImplementedError:
         '''
         raise NotImplementedError
 
+    def create_channel_pool(self, *, max_size=10, strategy="round_robin", serializer=None, compression=None,
+                            max_in_flight=None):
+        '''
+        Create a pool that lends channels of this connection to coroutines.
+
+        Each channel has its own window of messages waiting for the broker's
+        acknowledgement in publisher confirm mode, and a channel error such
+        as publishing to a missing exchange only closes the channel it
+        happened on. So coroutines publishing at the same time on pooled
+        channels don't wait for each other's acknowledgements, and don't
+        fail because of each other's errors.
+
+        :param max_size: the maximum number of channels the pool opens
+        :param strategy: how to pick a channel once every channel is busy
+            and the pool is full. "round_robin" lends the channels in turn
+            and "least_in_flight" lends the channel with the fewest loans.
+        :param serializer: the serializer for the pool's channels. A value of
+            None uses the connection's serializer.
+        :param compression: the compression for the pool's channels. A value
+            of None uses the connection's compression.
+        :param max_in_flight: If given, each channel the pool opens is put in
+            publisher confirm mode with this ``max_in_flight``. See
+            :meth:`Channel.enable_confirms`.
+        :type max_size: int
+        :type strategy: str
+        :type serializer: str|:class:`mooq.serializers.Serializer`|None
+        :type compression: str|:class:`mooq.compression.Compressor`|None
+        :type max_in_flight: int|None
+        :returns: a :class:`ChannelPool` object
+        '''
+        return ChannelPool(self, max_size=max_size, strategy=strategy,
+                           serializer=serializer, compression=compression,
+                           max_in_flight=max_in_flight)
+
     async def connect(self):
         '''
         Connect to the broker
@@ -240,16 +581,25 @@ class Channel(object):
     '''
     Base class for a channel of a connection. Not to be used directly.
     '''
-    def __init__(self, *, internal_chan, loop):
+    def __init__(self, *, internal_chan, loop, serializer="json", compression=None):
         '''
         :param internal_chan: the transport specific channel object to use
         :param loop: the event loop
+        :param serializer: the serializer for published messages, as a name or a
+            :class:`mooq.serializers.Serializer` object
+        :type serializer: str|:class:`mooq.serializers.Serializer`
+        :param compression: how to compress large messages, as a name or a
+            :class:`mooq.compression.Compressor` object. A value of None means
+            messages aren't compressed.
+        :type compression: str|:class:`mooq.compression.Compressor`|None
 
         Typically this class will be instantiated outside the main thread.
         '''
         self._chan = internal_chan
         self.chan_lock = _TimeoutRLock(1)
         self.loop = loop
+        self.serializer = serializers.get(serializer)
+        self.compressor = compressors.get(compression)
 
     async def register_producer(self, *, exchange_name, exchange_type):
         '''
@@ -264,7 +614,10 @@ class Channel(object):
         '''
         raise NotImplementedError
 
-    async def register_consumer(self, queue_name=None, routing_keys=[""], *, exchange_name, exchange_type, callback):
+    async def register_consumer(self, queue_name=None, routing_keys=[""], *, exchange_name, exchange_type,
+                                callback=None, max_concurrency=None, prefetch_count=None, prefetch_size=0,
+                                ack=False, requeue_on_error=False, raw=False, batch_callback=None,
+                                executor=None, ordered=False, order_key=None):
 
         '''
         Register a consumer on the channel.
@@ -277,31 +630,465 @@ class Channel(object):
             meaning it will be deleted once the channel is closed.
         :param callback: The callback to run when a message is placed on the queue that
             matches one of the routing keys
+        :param batch_callback: A callback to use instead of ``callback``, that is
+            run with a list of the messages received together. ``max_concurrency``
+            then limits the number of batches being handled at once.
+            Exactly one of ``callback`` and ``batch_callback`` must be given.
         :param routing_keys: A list of keys to match against. A message will only be sent
             to a consumer if its routing key matches one or more of the routing keys listed
+        :param max_concurrency: The maximum number of callbacks that may run at once.
+            While the limit is reached, no more messages are taken for the consumer.
+            A value of None means no limit.
+        :param prefetch_count: The maximum number of unacknowledged messages the
+            broker sends the consumer. Only applies if ``ack`` is True. A value of
+            None means no limit.
+        :param prefetch_size: The maximum total size in bytes of unacknowledged
+            messages the broker sends the consumer. 0 means no limit.
+        :param ack: If True, each message is acknowledged once its callback finishes,
+            or rejected if the callback raised. Messages whose callbacks haven't
+            finished are redelivered if the consumer goes away. If False, messages
+            are acknowledged as soon as they are sent to the consumer.
+        :param requeue_on_error: If True, a message whose callback raised is
+            put back on the queue rather than rejected. Only applies if ``ack``
+            is True.
+        :param raw: If True, the callback is passed a :class:`RawMessage` holding
+            the undecoded message body and its delivery details, instead of a
+            dictionary with the decoded message.
+        :param ordered: If True, the callbacks of messages with the same key run
+            one at a time, in the order the messages were received, while
+            messages with different keys are handled in parallel. Messages
+            waiting behind an earlier message with the same key don't count
+            towards ``max_concurrency``, but no more than ``max_concurrency``
+            messages may wait at once. Can't be used with ``batch_callback``.
+        :param order_key: the function giving the key of a message for ``ordered``.
+            A message whose key can't be found is reported to the event loop's
+            exception handler and dropped, or rejected if ``ack`` is True.
+            It is passed what the callback is passed, or the :class:`RawMessage`
+            if an ``executor`` is given. A value of None uses the routing key.
+        :param executor: If given, the callback is a plain function rather than
+            a coroutine, and is run in this executor along with the decoding of
+            its messages. Its return value or exception is passed back to the
+            event loop. Unless ``max_concurrency`` is given, it is set to the
+            number of workers of a :class:`concurrent.futures.ThreadPoolExecutor`
+            or :class:`concurrent.futures.ProcessPoolExecutor`, so that messages
+            wait in the channel rather than in the executor's queue. The size of
+            other executors is unknown, so without ``max_concurrency`` their
+            callbacks aren't limited. A process pool executor needs a callback
+            that can be pickled.
 
         :type exchange_name: str
         :type exchange_type: str
         :type queue_name: str|None
         :type callback: coroutine
         :type routing_keys: [str,]
+        :type max_concurrency: int|None
+        :type prefetch_count: int|None
+        :type prefetch_size: int
+        :type ack: bool
+        :type requeue_on_error: bool
+        :type raw: bool
+        :type batch_callback: coroutine
+        :type executor: :class:`concurrent.futures.Executor`|None
+        :type ordered: bool
+        :type order_key: function|None
 
         '''
         raise NotImplementedError
 
-    async def publish(self, *, exchange_name, msg, routing_key=''):
+    async def publish(self, *, exchange_name, msg, routing_key='', wait=True):
         '''
         Publish a message on the channel.
 
         :param exchange_name: The name of the exchange to send the message to
         :param msg: The message to send
         :param routing_key: The routing key to associated the message with
+        :param wait: If True, wait until the publish completes. If False,
+            return as soon as the message is sent.
         :type exchange_name: str
         :type msg: str
         :type routing_key: str
+        :type wait: bool
+        :returns: None if ``wait`` is True, otherwise a confirmation future
+            that becomes done once the publish completes
+        '''
+        raise NotImplementedError
+
+    async def publish_many(self, *, exchange_name, messages, wait=True):
+        '''
+        Publish several messages on the channel in one go.
+
+        :param exchange_name: The name of the exchange to send the messages to
+        :param messages: The messages to send, as ``(msg, routing_key)`` pairs
+        :param wait: If True, wait until the publishes complete. If False,
+            return as soon as the messages are sent.
+        :type exchange_name: str
+        :type messages: iterable of (str, str)
+        :type wait: bool
+        :returns: None if ``wait`` is True, otherwise a confirmation future
+            that becomes done once every publish completes
+        '''
+        raise NotImplementedError
+
+    async def enable_confirms(self, *, max_in_flight=1000):
+        '''
+        Put the channel in publisher confirm mode. Publishes then complete
+        once the broker acknowledges the message.
+
+        :param max_in_flight: the maximum number of published messages that
+            may wait for the broker's acknowledgement at once. Further publishes
+            wait until an acknowledgement arrives.
+        :type max_in_flight: int
         '''
         raise NotImplementedError
 
+    def _offload(self, func, executor, *, raw, batch, max_concurrency):
+        '''
+        Make a consumer callback that runs ``func`` in ``executor``.
+
+        :returns: a three element tuple of the callback, which must be
+            passed raw messages, the value of ``raw`` to register the
+            consumer with and the consumer's maximum concurrency
+        :raises ValueError: if ``func`` is a coroutine function
+        '''
+        if asyncio.iscoroutinefunction(func):
+            raise ValueError("a callback run in an executor must be a plain function")
+
+        run = partial(_run_offloaded, func, None if raw else self.serializer, batch)
+
+        async def callback(msgs):
+            return await self.loop.run_in_executor(executor, run, msgs)
+
+        if max_concurrency is None:
+            max_concurrency = _num_workers(executor)
+
+        return callback, True, max_concurrency
+
+    def _encode(self, msg):
+        '''
+        :returns: a two element tuple of the message body and its content
+            encoding, which is None if the body isn't compressed
+        '''
+        if isinstance(msg, _Encoded):
+            body = msg.body
+        else:
+            body = self.serializer.encode(msg)
+
+        if self.compressor is None or len(body) < self.compressor.min_size:
+            return body, None
+
+        return self.compressor.compress(body), self.compressor.name
+
+    def _decode(self, body, content_type=None, content_encoding=None):
+        return decode(body, self.serializer, content_type, content_encoding)
+
+    def create_buffered_publisher(self, *, linger=0.005, max_batch_count=100, max_batch_bytes=None):
+        '''
+        Create a publisher that buffers messages and sends them on this
+        channel in batches using :meth:`publish_many`.
+
+        :param linger: the maximum number of seconds a message waits
+            in the buffer before being sent
+        :param max_batch_count: send the buffer once it holds this many messages
+        :param max_batch_bytes: send the buffer once its messages reach this
+            many bytes. A value of None means no byte limit.
+        :type linger: float
+        :type max_batch_count: int
+        :type max_batch_bytes: int|None
+        :returns: a :class:`BufferedPublisher` object
+        '''
+        return BufferedPublisher(self, linger=linger, max_batch_count=max_batch_count,
+                                 max_batch_bytes=max_batch_bytes)
+
+
+class BufferedPublisher(object):
+    '''
+    Buffers messages published from any number of coroutines and sends
+    them in batches, once a count, byte or time threshold is reached or
+    the publisher is closed.
+
+    Create one with :meth:`Channel.create_buffered_publisher`.
+    '''
+
+    def __init__(self, chan, *, linger, max_batch_count, max_batch_bytes):
+        '''
+        :param chan: the channel to publish on
+        :type chan: :class:`Channel`
+
+        See :meth:`Channel.create_buffered_publisher` for the other parameters.
+        '''
+        self.chan = chan
+        self.loop = chan.loop
+        self.linger = linger
+        self.max_batch_count = max_batch_count
+        self.max_batch_bytes = max_batch_bytes
+        self._buffer = {}
+        self._count = 0
+        self._bytes = 0
+        self._timer = None
+        self._last_flush = None
+        self._closed = False
+
+    def publish(self, *, exchange_name, msg, routing_key=''):
+        '''
+        Add a message to the buffer.
+
+        :param exchange_name: The name of the exchange to send the message to
+        :param msg: The message to send
+        :param routing_key: The routing key to associated the message with
+        :type exchange_name: str
+        :type msg: str
+        :type routing_key: str
+        :returns: a future that becomes done once the batch holding the
+            message has been published. Awaiting on it raises any error
+            from publishing the batch.
+        :raises PublisherClosed: if the publisher has been closed
+
+        The messages of a batch are published together, so an error
+        publishing any one of them, such as the broker nacking it in
+        publisher confirm mode, is raised by the futures of every message
+        in the batch, including messages the broker accepted.
+
+        .. note:: must only be called from within the thread
+            where the event loop resides
+        '''
+        if self._closed:
+            raise PublisherClosed("publisher closed")
+
+        if self.max_batch_bytes is not None:
+            # encode now to measure the message, and keep the body so
+            # publish_many doesn't encode it again
+            body = self.chan.serializer.encode(msg)
+            self._bytes += len(body)
+            msg = _Encoded(body)
+
+        fut = self.loop.create_future()
+        self._buffer.setdefault(exchange_name, []).append((msg, routing_key, fut))
+        self._count += 1
+
+        if self._batch_full():
+            self._start_flush()
+        elif self._timer is None:
+            self._timer = self.loop.call_later(self.linger, self._start_flush)
+
+        return fut
+
+    async def flush(self):
+        '''
+        Send any buffered messages and wait until every batch
+        has been published.
+        '''
+        if self._buffer:
+            self._start_flush()
+
+        if self._last_flush is not None:
+            await asyncio.wait([self._last_flush])
+
+    async def close(self):
+        '''
+        Send any buffered messages and wait until every batch
+        has been published. Messages can't be published afterwards.
+        '''
+        self._closed = True
+        await self.flush()
+
+    def _batch_full(self):
+        if self._count >= self.max_batch_count:
+            return True
+
+        if self.max_batch_bytes is not None and self._bytes >= self.max_batch_bytes:
+            return True
+
+        return False
+
+    def _start_flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        batch = self._buffer
+        self._buffer = {}
+        self._count = 0
+        self._bytes = 0
+        self._last_flush = start_task(self._flush(batch, self._last_flush), self.loop)
+
+    async def _flush(self, batch, previous):
+        # keep batches in the order they were started
+        if previous is not None:
+            await asyncio.wait([previous])
+
+        for exchange_name, items in batch.items():
+            try:
+                await self.chan.publish_many(exchange_name=exchange_name,
+                                             messages=[(msg, routing_key) for msg, routing_key, _ in items])
+            except Exception as e:
+                for _, _, fut in items:
+                    if not fut.done():
+                        fut.set_exception(e)
+            else:
+                for _, _, fut in items:
+                    if not fut.done():
+                        fut.set_result(None)
+
+
+class ChannelPool(object):
+    '''
+    Lends the channels of a connection to coroutines. Channels are opened
+    as they are needed, up to a limit, and reused once they are returned.
+
+    An idle channel is lent if there is one. Otherwise a new channel is
+    opened, unless the pool is full, in which case a busy channel is
+    shared according to the pool's strategy.
+
+    Create one with :meth:`Connection.create_channel_pool`.
+    '''
+
+    STRATEGIES = ("round_robin", "least_in_flight")
+
+    def __init__(self, conn, *, max_size, strategy, serializer, compression, max_in_flight=None):
+        '''
+        :param conn: the connection to open channels on
+        :type conn: :class:`Connection`
+
+        See :meth:`Connection.create_channel_pool` for the other parameters.
+        '''
+        if max_size < 1:
+            raise ValueError("max_size must be at least 1")
+
+        if strategy not in self.STRATEGIES:
+            raise ValueError("unknown strategy {!r}. Must be one of {}".format(
+                strategy, ", ".join(self.STRATEGIES)))
+
+        self.conn = conn
+        self.max_size = max_size
+        self.strategy = strategy
+        self.serializer = serializer
+        self.compression = compression
+        self.max_in_flight = max_in_flight
+        self.channels = []
+        self._in_flight = {}
+        self._next = 0
+        self._grow_lock = asyncio.Lock()
+
+    def in_flight(self, chan):
+        '''
+        :param chan: a channel of the pool
+        :returns: the number of loans of the channel that haven't been returned
+        :rtype: int
+        '''
+        return self._in_flight[chan]
+
+    async def acquire(self):
+        '''
+        Borrow a channel from the pool. Must be returned with :meth:`release`.
+
+        :returns: a :class:`Channel` object
+        '''
+        chan = self._pick()
+        if chan is None:
+            async with self._grow_lock:
+                chan = self._pick()
+                if chan is None:
+                    chan = await self.conn.create_channel(self.serializer, self.compression)
+                    if self.max_in_flight is not None:
+                        await chan.enable_confirms(max_in_flight=self.max_in_flight)
+                    self.channels.append(chan)
+                    self._in_flight[chan] = 0
+
+        self._in_flight[chan] += 1
+        return chan
+
+    def release(self, chan):
+        '''
+        Return a channel borrowed with :meth:`acquire`.
+
+        :param chan: the borrowed channel
+        :type chan: :class:`Channel`
+        '''
+        self._in_flight[chan] -= 1
+
+    def channel(self):
+        '''
+        Borrow a channel for the duration of an ``async with`` block::
+
+            async with pool.channel() as chan:
+                await chan.publish(exchange_name="log", msg="hello")
+
+        :returns: an asynchronous context manager that gives a :class:`Channel` object
+        '''
+        return _Loan(self)
+
+    async def publish(self, *, exchange_name, msg, routing_key='', wait=True):
+        '''
+        Publish a message on a channel borrowed from the pool.
+
+        Takes the same parameters as :meth:`Channel.publish`.
+        '''
+        async with self.channel() as chan:
+            return await chan.publish(exchange_name=exchange_name, msg=msg, routing_key=routing_key,
+                                      wait=wait)
+
+    async def publish_many(self, *, exchange_name, messages, wait=True):
+        '''
+        Publish several messages on a channel borrowed from the pool.
+
+        Takes the same parameters as :meth:`Channel.publish_many`.
+        '''
+        async with self.channel() as chan:
+            return await chan.publish_many(exchange_name=exchange_name, messages=messages, wait=wait)
+
+    def _pick(self):
+        '''
+        :returns: the channel to lend, or None if a new channel should be opened
+        '''
+        num_channels = len(self.channels)
+        if self.strategy == "least_in_flight":
+            if num_channels:
+                chan = min(self.channels, key=self._in_flight.__getitem__)
+                if self._in_flight[chan] == 0 or num_channels >= self.max_size:
+                    return chan
+
+            return None
+
+        for i in range(num_channels):
+            chan = self.channels[(self._next + i) % num_channels]
+            if self._in_flight[chan] == 0:
+                self._next = (self._next + i + 1) % num_channels
+                return chan
+
+        if num_channels < self.max_size:
+            return None
+
+        chan = self.channels[self._next]
+        self._next = (self._next + 1) % num_channels
+        return chan
+
+
+class _Loan(object):
+    '''
+    Asynchronous context manager for a channel borrowed from a :class:`ChannelPool`
+    '''
+    def __init__(self, pool):
+        self.pool = pool
+        self.chan = None
+
+    async def __aenter__(self):
+        self.chan = await self.pool.acquire()
+        return self.chan
+
+    async def __aexit__(self, exc_type, exc_value, tb):
+        self.pool.release(self.chan)
+
+
+class _Encoded(object):
+    '''
+    A message that has already been encoded with the serializer of the
+    channel it is published on
+    '''
+    __slots__ = ("body",)
+
+    def __init__(self, body):
+        self.body = body
+
 
 class _TimeoutRLock(object):
     '''
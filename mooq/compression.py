@@ -0,0 +1,170 @@
+'''
+Compressors shrink large message bodies before they are published.
+
+Compression is selected per connection or per channel, either by name
+(``"zlib"``, ``"lz4"`` or ``"zstd"``) or by passing a :class:`Compressor`
+object. ``"lz4"`` and ``"zstd"`` are only available if the lz4 and zstandard
+packages are installed.
+
+Only bodies of at least ``min_size`` bytes are compressed. The compressor's
+name is recorded as the content encoding of each compressed message, and
+consumers decompress messages automatically.
+
+'''
+
+import zlib
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+class Compressor(object):
+    '''
+    Base class for a compressor. Not to be used directly.
+    '''
+
+    #: the name used to select the compressor, recorded as the
+    #: content encoding of each compressed message
+    name = None
+
+    def __init__(self, *, min_size=1024, level=None):
+        '''
+        :param min_size: only compress message bodies of at least this many bytes
+        :param level: the compression level. A value of None uses the
+            library's default level.
+        :type min_size: int
+        :type level: int|None
+        '''
+        self.min_size = min_size
+        self.level = level
+
+    def compress(self, body):
+        '''
+        :param body: an encoded message
+        :type body: bytes
+        :rtype: bytes
+        '''
+        raise NotImplementedError
+
+    def decompress(self, body):
+        '''
+        :param body: a compressed message
+        :type body: bytes
+        :rtype: bytes
+        '''
+        raise NotImplementedError
+
+
+class ZlibCompressor(Compressor):
+    '''
+    Compresses with the standard library's zlib module
+    '''
+    name = "zlib"
+
+    def compress(self, body):
+        level = zlib.Z_DEFAULT_COMPRESSION if self.level is None else self.level
+        return zlib.compress(body, level)
+
+    def decompress(self, body):
+        return zlib.decompress(body)
+
+
+class LZ4Compressor(Compressor):
+    '''
+    Compresses with the LZ4 frame format. Requires the lz4 package.
+    '''
+    name = "lz4"
+
+    def compress(self, body):
+        return lz4.frame.compress(body, compression_level=self.level or 0)
+
+    def decompress(self, body):
+        return lz4.frame.decompress(body)
+
+
+class ZstdCompressor(Compressor):
+    '''
+    Compresses with Zstandard. Requires the zstandard package.
+    '''
+    name = "zstd"
+
+    def compress(self, body):
+        # zstandard compressor objects can't be shared between threads
+        level = 3 if self.level is None else self.level
+        return zstandard.ZstdCompressor(level=level).compress(body)
+
+    def decompress(self, body):
+        return zstandard.ZstdDecompressor().decompress(body)
+
+
+_by_name = {}
+_builtin_names = {ZlibCompressor.name, LZ4Compressor.name, ZstdCompressor.name}
+
+
+def register(compressor):
+    '''
+    Make a compressor selectable by name, and available for decompressing
+    received messages with its content encoding.
+
+    :param compressor: the compressor to register
+    :type compressor: :class:`Compressor`
+    '''
+    _by_name[compressor.name] = compressor
+
+
+def get(compression):
+    '''
+    :param compression: the name of a registered compressor, a compressor
+        object or None
+    :type compression: str|:class:`Compressor`|None
+    :returns: a :class:`Compressor` object, or None if ``compression`` is None
+    :raises ValueError: if no compressor is registered with the name
+    '''
+    if compression is None or isinstance(compression, Compressor):
+        return compression
+
+    try:
+        return _by_name[compression]
+    except KeyError:
+        raise ValueError("unknown compression {!r}. Is the package it needs installed?".format(compression))
+
+
+def decompress(body, content_encoding):
+    '''
+    Content encodings that aren't the name of a compressor, such as
+    "utf-8", don't mean the body is compressed, so the body is returned
+    as it is.
+
+    :param body: a received message body
+    :param content_encoding: the content encoding of the message
+    :type body: bytes
+    :type content_encoding: str
+    :returns: the decompressed body
+    :raises ValueError: if the content encoding is the name of one of the
+        built in compressors, but the package it needs isn't installed
+    '''
+    try:
+        compressor = _by_name[content_encoding]
+    except KeyError:
+        if content_encoding in _builtin_names:
+            raise ValueError("can't decompress a message with content encoding {!r}. "
+                             "Is the package it needs installed?".format(content_encoding))
+        return body
+
+    return compressor.decompress(body)
+
+
+register(ZlibCompressor())
+
+if lz4 is not None:
+    register(LZ4Compressor())
+
+if zstandard is not None:
+    register(ZstdCompressor())
@@ -1,8 +1,10 @@
 from .in_memory import InMemoryConnection
-from .rabbit import RabbitMQConnection
+from .rabbit import RabbitMQConnection, RabbitMQAsyncioConnection
+from .pooled import PooledConnection
 
 
-async def connect(host="localhost", port=5672, broker="rabbit"):
+async def connect(host="localhost", port=5672, broker="rabbit", transport="blocking", serializer="json",
+                  compression=None, pool_size=None, hash_routing=False):
     '''
     Create a connection object and then connect to a broker
 
@@ -14,18 +16,58 @@ async def connect(host="localhost", port=5672, broker="rabbit"):
         for a RabbitMQ broker and "in_memory" for an broker that resides in memory
         (useful for unit testing)
     :type broker: str
-    :return: :class:`InMemoryConnection` or :class:`RabbitMQConnection` object
+    :param transport: how a "rabbit" broker is talked to. Use "blocking" to
+        run pika's blocking connection on a dedicated I/O thread per connection,
+        or "asyncio" to run pika's asyncio adapter on the event loop. Ignored for
+        other broker types.
+    :type transport: str
+    :param serializer: the default serializer for the connection's channels,
+        as a name such as "json", "raw", "pickle", "msgpack" or "orjson", or a
+        :class:`mooq.serializers.Serializer` object
+    :type serializer: str|:class:`mooq.serializers.Serializer`
+    :param compression: the default compression for the connection's channels,
+        as a name such as "zlib", "lz4" or "zstd", or a
+        :class:`mooq.compression.Compressor` object. A value of None means
+        messages aren't compressed.
+    :type compression: str|:class:`mooq.compression.Compressor`|None
+    :param pool_size: If given, open this many connections to the broker and
+        return a :class:`PooledConnection` that spreads channels and publishes
+        across them. A value of None opens a single connection.
+    :type pool_size: int|None
+    :param hash_routing: Only used with ``pool_size``. If True, each message is
+        published on a connection picked by consistent hashing of its routing
+        key, so messages with the same routing key keep their order.
+    :type hash_routing: bool
+    :return: :class:`InMemoryConnection`, :class:`RabbitMQConnection`,
+        :class:`RabbitMQAsyncioConnection` or :class:`PooledConnection` object
+
+    :raises ValueError: if ``hash_routing`` is given without ``pool_size``
 
     .. todo:: raises BrokerConnectionError if cannot connect to the broker
 
     '''
 
     if broker == "in_memory":
-        conn = InMemoryConnection(host=host, port=port)
-    elif broker == "rabbit":
-        conn = RabbitMQConnection(host=host, port=port)
+        conn_class = InMemoryConnection
+    elif broker == "rabbit" and transport == "blocking":
+        conn_class = RabbitMQConnection
+    elif broker == "rabbit" and transport == "asyncio":
+        conn_class = RabbitMQAsyncioConnection
     else:
         raise NotImplementedError
 
+    kwargs = dict(host=host, port=port, serializer=serializer, compression=compression)
+    if pool_size is None:
+        if hash_routing:
+            raise ValueError("hash_routing needs a pool_size")
+
+        conn = conn_class(**kwargs)
+    else:
+        if pool_size < 1:
+            raise ValueError("pool_size must be at least 1")
+
+        conn = PooledConnection([conn_class(**kwargs) for _ in range(pool_size)],
+                                hash_routing=hash_routing, **kwargs)
+
     await conn.connect()
     return conn
@@ -1,13 +1,18 @@
-from collections import namedtuple
+from collections import namedtuple, deque
 import queue
 import uuid
 import traceback
-import re
 import asyncio
+from functools import partial
 from . import base
 
 
-InMemoryChannelInternal = namedtuple("InMemoryChannelInternal", ["msg_q", "broker_q"])
+# msg_q is the broker's command queue, shared by every channel.
+# broker_q is the channel's own queue of broker responses.
+# subscribe is called to start dispatching a consumer queue to a callback.
+InMemoryChannelInternal = namedtuple("InMemoryChannelInternal", ["msg_q", "broker_q", "subscribe"])
+
+_Subscription = namedtuple("_Subscription", ["queue", "consumer", "make_resp", "batch"])
 
 
 class InMemoryBroker(base.Broker):
@@ -15,13 +20,48 @@ class InMemoryBroker(base.Broker):
     Implementation of an in memory broker
     '''
 
-    def __init__(self, **kwargs):
+    def __init__(self, *, max_batch_size=None, max_batch_latency=0, **kwargs):
+        '''
+        :param host: the hostname of the broker
+        :type host: str
+        :param port: the port of the broker
+        :type port: int
+        :param max_batch_size: the maximum number of commands to handle
+            per wakeup. A value of None will handle every pending command.
+        :type max_batch_size: int|None
+        :param max_batch_latency: the maximum number of seconds to wait for
+            more commands to arrive before handling a batch that is smaller
+            than ``max_batch_size``. A value of 0 handles pending commands
+            straight away.
+        :type max_batch_latency: float
+
+        Consecutive publish commands within a batch are grouped by exchange
+        and routed together. Messages published to the same exchange keep
+        their order.
+        '''
         super().__init__(**kwargs)
-        self.broker_ctl_q = queue.Queue()
-        self.msg_q = queue.Queue()
+        self.max_batch_size = max_batch_size
+        self.max_batch_latency = max_batch_latency
+        self._wakeup = asyncio.Event()
+        self.broker_ctl_q = _WakeupQueue(self._wakeup)
+        self.msg_q = _WakeupQueue(self._wakeup)
         self.broker_q = queue.Queue()
-        self.exchanges = []
-        self.consumer_queues = []
+        self._exchanges = {}
+        self._consumer_queues = {}
+
+    @property
+    def exchanges(self):
+        '''
+        list of the exchanges declared on the broker
+        '''
+        return list(self._exchanges.values())
+
+    @property
+    def consumer_queues(self):
+        '''
+        list of the consumer queues declared on the broker
+        '''
+        return list(self._consumer_queues.values())
 
     async def close(self):
         '''
@@ -41,43 +81,105 @@ class InMemoryBroker(base.Broker):
 
         self.not_running = self.loop.create_future()
         while True:
-            try:
-                broker_ctl_cmd = self.broker_ctl_q.get(block=False)
-            except queue.Empty:
-                pass
-            else:
-                if broker_ctl_cmd == "close":
-                    self.not_running.set_result(None)
-                    break
+            await self._wakeup.wait()
+            self._wakeup.clear()
+
+            if "close" in self.broker_ctl_q.drain():
+                self.not_running.set_result(None)
+                break
+
+            if self.max_batch_latency and self.msg_q:
+                await self._linger()
+
+            self._handle_batch(self.msg_q.drain(self.max_batch_size))
+
+            if self.msg_q or self.broker_ctl_q:
+                self._wakeup.set()
+                # let other tasks run before handling the next batch
+                await asyncio.sleep(0)
 
+    async def _linger(self):
+        deadline = self.loop.time() + self.max_batch_latency
+        while not self.broker_ctl_q and not self._batch_full():
+            timeout = deadline - self.loop.time()
+            if timeout <= 0:
+                break
+
+            self._wakeup.clear()
             try:
-                msg = self.msg_q.get(block=False)
-            except queue.Empty:
-                pass
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                break
+
+    def _batch_full(self):
+        if self.max_batch_size is None:
+            return False
+
+        return len(self.msg_q) >= self.max_batch_size
+
+    def _handle_batch(self, msgs):
+        publishes = []
+        for msg in msgs:
+            if msg['command'] in ("publish", "publish_many"):
+                publishes.append(msg)
             else:
+                self._handle_publishes(publishes)
+                publishes = []
                 self._handle_msg(msg)
 
-            await asyncio.sleep(0.001)
+        self._handle_publishes(publishes)
+
+    def _handle_publishes(self, msgs):
+        by_exchange = {}
+        for msg in msgs:
+            by_exchange.setdefault(msg['exchange_name'], []).append(msg)
+
+        for exchange_name, exch_msgs in by_exchange.items():
+            try:
+                exch = self._get_exchange(exchange_name)
+            except base.ExchangeNotFound:
+                exch = None
+
+            for msg in exch_msgs:
+                if exch is None:
+                    self._put_error(base.BadExchange, cmd=msg)
+                    continue
+
+                try:
+                    for m, routing_key, content_encoding in _published_messages(msg):
+                        self._route_to_exchange(exch, m, routing_key, msg, content_encoding)
+                except Exception:
+                    tb_str = traceback.format_exc()
+                    self._put_error(base.BrokerInternalError, msg=tb_str, cmd=msg)
+                else:
+                    self._put_done(msg)
 
     def _handle_msg(self, msg):
         try:
             self._command_router(msg)
         except Exception as e:
             tb_str = traceback.format_exc()
-            self._put_error(base.BrokerInternalError, msg=tb_str)
+            self._put_error(base.BrokerInternalError, msg=tb_str, cmd=msg)
+        else:
+            self._put_done(msg)
 
     def _command_router(self, msg):
         if msg['command'] == "publish":
             self._route_message_to_consumer_queues(
                 msg['exchange_name'],
                 msg['msg'],
-                msg['routing_key']
+                msg['routing_key'],
+                msg,
+                msg.get('content_encoding')
             )
 
+        elif msg['command'] == "publish_many":
+            self._handle_publishes([msg])
+
         elif msg['command'] == "register_producer":
-            self._add_exchange(msg['exchange_name'], msg['exchange_type'])
+            self._add_exchange(msg['exchange_name'], msg['exchange_type'], msg)
         elif msg['command'] == "register_consumer":
-            self._add_exchange(msg['exchange_name'], msg['exchange_type'])
+            self._add_exchange(msg['exchange_name'], msg['exchange_type'], msg)
             self._add_consumer_queue(msg['queue_name'])
             exch = self._get_exchange(msg['exchange_name'])
             if msg['exchange_type'] == "fanout":
@@ -85,97 +187,182 @@ class InMemoryBroker(base.Broker):
 
             exch.bind(msg['queue_name'], msg['routing_keys'])
 
-    def _add_exchange(self, name, type_):
+    def _add_exchange(self, name, type_, cmd=None):
         try:
             exch = self._get_exchange(name)
         except base.ExchangeNotFound:
             exch = _InMemoryExchange(name=name, type_=type_)
-            self.exchanges.append(exch)
+            self._exchanges[name] = exch
         else:
             if type_ != exch.type_:
                 msg = ("tried to declare an exchange of type {}"
                      " when it has already been declared of typ {}"
                      "").format(type_, exch.type_)
 
-                self._put_error(base.BadExchange, msg=msg)
+                self._put_error(base.BadExchange, msg=msg, cmd=cmd)
 
-    def _put_error(self, e, msg=""):
-        self.broker_q.put({"response": "error",
-                           "error": e,
-                           "msg": msg}, block=False)
+    def _put_error(self, e, msg="", cmd=None):
+        '''
+        Report an error to the sender of a command.
 
-    def _get_exchange(self, name):
-        for exch in self.exchanges:
-            if exch.name == name:
-                return exch
+        The error is set on the command's reply future if it is still
+        pending, otherwise it is put on the reply queue of the channel
+        that sent the command. Errors for commands without a sender are
+        put on the broker's own response queue.
+        '''
+        if cmd is None:
+            cmd = {}
 
-        raise base.ExchangeNotFound
+        reply = cmd.get('reply')
+        if reply is not None and not reply.done():
+            reply.set_exception(e(msg))
+            return
+
+        reply_q = cmd.get('reply_q', self.broker_q)
+        reply_q.put({"response": "error",
+                     "error": e,
+                     "msg": msg}, block=False)
+
+    def _put_done(self, cmd):
+        reply = cmd.get('reply')
+        if reply is not None and not reply.done():
+            reply.set_result(None)
+
+    def _get_exchange(self, name):
+        try:
+            return self._exchanges[name]
+        except KeyError:
+            raise base.ExchangeNotFound
 
     def _add_consumer_queue(self, name):
         if not self._consumer_queue_exists(name):
             cq = _InMemoryConsumerQueue(name=name)
-            self.consumer_queues.append(cq)
+            self._consumer_queues[name] = cq
 
     def _get_consumer_queue(self, name):
-        for cq in self.consumer_queues:
-            if cq.name == name:
-                return cq
-
-        raise base.ConsumerQueueNotFound
+        try:
+            return self._consumer_queues[name]
+        except KeyError:
+            raise base.ConsumerQueueNotFound
 
     def _consumer_queue_exists(self, name):
-        try:
-            self._get_consumer_queue(name)
-            return True
-        except base.ConsumerQueueNotFound:
-            return False
+        return name in self._consumer_queues
 
-    def _route_message_to_consumer_queues(self, exchange_name, msg, routing_key):
+    def _route_message_to_consumer_queues(self, exchange_name, msg, routing_key, cmd=None,
+                                          content_encoding=None):
         try:
             exch = self._get_exchange(exchange_name)
         except base.ExchangeNotFound:
-            self._put_error(base.BadExchange)
+            exch = None
+
+        self._route_to_exchange(exch, msg, routing_key, cmd, content_encoding)
+
+    def _route_to_exchange(self, exch, msg, routing_key, cmd=None, content_encoding=None):
+        if exch is None:
+            self._put_error(base.BadExchange, cmd=cmd)
         else:
+            # queues only ever read the message dictionary, so it is shared between them
+            msg_dict = {
+                "msg": msg,
+                "routing_key": routing_key,
+                "exchange": exch.name,
+                "content_type": cmd.get('content_type') if cmd is not None else None,
+                "content_encoding": content_encoding,
+            }
             if exch.type_ == "direct":
-                self._route_direct(exch, msg, routing_key)
+                self._route_direct(exch, msg_dict)
             elif exch.type_ == "topic":
-                self._route_topic(exch, msg, routing_key)
+                self._route_topic(exch, msg_dict)
             elif exch.type_ == "fanout":
-                self._route_fanout(exch, msg)
+                msg_dict["routing_key"] = ""
+                self._route_fanout(exch, msg_dict)
             else:
                 raise NotImplementedError
 
-    def _route_direct(self, exch, msg, routing_key):
-        for queue_name, routing_keys in exch.queues.items():
-            if routing_key in routing_keys:
-                cq = self._get_consumer_queue(queue_name)
-                cq.put({"msg": msg, "routing_key": routing_key})
+    def _route_direct(self, exch, msg_dict):
+        for queue_name in exch.direct_bindings.get(msg_dict["routing_key"], ()):
+            cq = self._get_consumer_queue(queue_name)
+            cq.put(msg_dict)
 
-    def _route_topic(self, exch, msg, routing_key):
-        for queue_name, routing_keys in exch.queues.items():
-            for r in routing_keys:
-                pattern = self._regexify(r)
-                if pattern.match(routing_key):
-                    cq = self._get_consumer_queue(queue_name)
-                    cq.put({"msg": msg, "routing_key": routing_key})
+    def _route_topic(self, exch, msg_dict):
+        for queue_name in exch.topic_bindings.match(msg_dict["routing_key"]):
+            cq = self._get_consumer_queue(queue_name)
+            cq.put(msg_dict)
 
-    def _route_fanout(self, exch, msg):
+    def _route_fanout(self, exch, msg_dict):
         for queue_name in exch.queues:
             cq = self._get_consumer_queue(queue_name)
-            cq.put({"msg": msg, "routing_key": ""})
-
-    def _regexify(self, routing_key):
-        splitted = routing_key.split(".")
-        regex_elements = []
-        for k in splitted:
-            if k == "*":
-                regex_elements.append(".+")
-            else:
-                regex_elements.append(k)
+            cq.put(msg_dict)
+
+
+def _published_messages(cmd):
+    '''
+    :returns: the ``(msg, routing_key, content_encoding)`` triples of a
+        publish or publish_many command
+    '''
+    if cmd['command'] == "publish":
+        return ((cmd['msg'], cmd['routing_key'], cmd.get('content_encoding')),)
 
-        regex_str = "\.".join(regex_elements)
+    return cmd['msgs']
 
-        return re.compile(regex_str)
+
+class _WakeupQueue(object):
+    '''
+    FIFO queue that sets an :class:`asyncio.Event` whenever data is added,
+    allowing a consumer to sleep until there is something to do.
+
+    Supports the non blocking subset of the :class:`queue.Queue` interface.
+
+    .. note:: must only be used from within the thread
+        where the event loop resides
+    '''
+    def __init__(self, wakeup):
+        '''
+        :param wakeup: event to set when data is added to the queue
+        :type wakeup: :class:`asyncio.Event`
+        '''
+        self._items = deque()
+        self._wakeup = wakeup
+
+    def __len__(self):
+        return len(self._items)
+
+    def put(self, data, block=False):
+        '''
+        Add data to the queue and wake up the consumer
+
+        :param data: data to add
+        '''
+        self._items.append(data)
+        self._wakeup.set()
+
+    def get(self, block=False):
+        '''
+        Remove and return the oldest item in the queue
+
+        :raises: :class:`queue.Empty` if the queue is empty
+        '''
+        try:
+            return self._items.popleft()
+        except IndexError:
+            raise queue.Empty
+
+    def drain(self, max_items=None):
+        '''
+        Remove and return items from the queue
+
+        :param max_items: the maximum number of items to remove. A value
+            of None will remove every item.
+        :type max_items: int|None
+        :returns: a list of items, oldest first
+        '''
+        if max_items is None or max_items >= len(self._items):
+            items = list(self._items)
+            self._items.clear()
+            return items
+
+        popleft = self._items.popleft
+        return [popleft() for _ in range(max_items)]
 
 
 class _InMemoryExchange(base.Exchange):
@@ -193,6 +380,8 @@ class _InMemoryExchange(base.Exchange):
 
         super().__init__(**kwargs)
         self.queues = {}
+        self.direct_bindings = {}
+        self.topic_bindings = _TopicBindings()
 
     def bind(self, queue_name, routing_keys):
         '''
@@ -205,10 +394,98 @@ class _InMemoryExchange(base.Exchange):
         '''
 
         if queue_name not in self.queues:
-            self.queues[queue_name] = routing_keys
+            self.queues[queue_name] = list(routing_keys)
         else:
             self.queues[queue_name].extend(routing_keys)
 
+        if self.type_ == "direct":
+            for r in routing_keys:
+                self.direct_bindings.setdefault(r, set()).add(queue_name)
+        elif self.type_ == "topic":
+            for r in routing_keys:
+                self.topic_bindings.add(r, queue_name)
+
+
+class _TopicNode(object):
+    __slots__ = ("children", "queues")
+
+    def __init__(self):
+        self.children = {}
+        # an ordered set of queue names
+        self.queues = {}
+
+
+class _TopicBindings(object):
+    '''
+    Trie of topic exchange binding keys, keyed on dot separated words.
+
+    Matching follows RabbitMQ semantics, where ``*`` matches exactly one
+    word and ``#`` matches zero or more words. A binding key must match
+    the whole routing key, and a queue matches at most once however many
+    of its binding keys match.
+    '''
+    def __init__(self):
+        self._root = _TopicNode()
+
+    def add(self, binding_key, queue_name):
+        '''
+        Add a binding
+
+        :param binding_key: the binding key, which may contain wildcards
+        :param queue_name: the name of the queue to route matches to
+        :type binding_key: str
+        :type queue_name: str
+        '''
+        node = self._root
+        for word in binding_key.split("."):
+            child = node.children.get(word)
+            if child is None:
+                child = node.children[word] = _TopicNode()
+            node = child
+
+        node.queues[queue_name] = None
+
+    def match(self, routing_key):
+        '''
+        Find the queues bound with a key that matches a routing key
+
+        :param routing_key: the routing key of a message
+        :type routing_key: str
+        :returns: a list of queue names, each listed once
+        '''
+        words = routing_key.split(".")
+        matched = {}
+        self._match(self._root, words, 0, matched, set())
+
+        out = {}
+        for node in matched:
+            out.update(node.queues)
+
+        return list(out)
+
+    def _match(self, node, words, i, matched, visited):
+        if (id(node), i) in visited:
+            return
+        visited.add((id(node), i))
+
+        children = node.children
+        if i == len(words):
+            if node.queues:
+                matched[node] = None
+        else:
+            child = children.get(words[i])
+            if child is not None:
+                self._match(child, words, i + 1, matched, visited)
+
+            child = children.get("*")
+            if child is not None:
+                self._match(child, words, i + 1, matched, visited)
+
+        child = children.get("#")
+        if child is not None:
+            for j in range(i, len(words) + 1):
+                self._match(child, words, j, matched, visited)
+
 
 class _InMemoryConsumerQueue(base.ConsumerQueue):
     '''
@@ -221,9 +498,22 @@ class _InMemoryConsumerQueue(base.ConsumerQueue):
         '''
 
         super().__init__(**kwargs)
-        self._q = queue.Queue()
+        self._q = deque()
+        self._listeners = []
         self.callback = None
 
+    def __len__(self):
+        return len(self._q)
+
+    def add_listener(self, func):
+        '''
+        Add a function to call whenever the queue goes from
+        empty to holding a message.
+
+        :param func: function taking no arguments
+        '''
+        self._listeners.append(func)
+
     def get_next_message(self):
         '''
         Get the next message from the consumer queue.
@@ -234,9 +524,8 @@ class _InMemoryConsumerQueue(base.ConsumerQueue):
         '''
 
         try:
-            msg_dict = self._q.get(block=False)
-            return msg_dict
-        except queue.Empty:
+            return self._q.popleft()
+        except IndexError:
             raise base.ConsumeTimeout
 
     def put(self, data):
@@ -247,7 +536,10 @@ class _InMemoryConsumerQueue(base.ConsumerQueue):
         :type data: str
         '''
 
-        self._q.put(data, block=False)
+        self._q.append(data)
+        if len(self._q) == 1:
+            for func in self._listeners:
+                func()
 
 
 class InMemoryConnection(base.Connection):
@@ -255,17 +547,23 @@ class InMemoryConnection(base.Connection):
     Implementation of an in memory connection to a broker
     '''
 
-    def __init__(self, **kwargs):
+    def __init__(self, *, prefetch_count=100, **kwargs):
         '''
         :param host: the hostname of the broker you wish to connect to
         :type host: str
         :param port: the port of the broker you wish to connect to
         :type port: int
+        :param prefetch_count: the maximum number of messages to take from
+            a consumer queue before moving on to the next ready queue
+        :type prefetch_count: int
 
         .. note:: must call :meth:`InMemoryConnection.connect` to actually connect to the broker
         '''
 
         super().__init__(**kwargs)
+        self.prefetch_count = prefetch_count
+        self._ready = {}
+        self._wakeup = asyncio.Event()
 
     async def connect(self):
         '''
@@ -276,14 +574,26 @@ class InMemoryConnection(base.Connection):
         self.broker_q = self.broker.broker_q
 
     # @base.lock_connection
-    async def create_channel(self):
+    async def create_channel(self, serializer=None, compression=None):
         '''
         create a channel for multiplexing the connection
+
+        :param serializer: the serializer for the channel, as a name or a
+            :class:`mooq.serializers.Serializer` object. A value of None uses
+            the connection's serializer.
+        :type serializer: str|:class:`mooq.serializers.Serializer`|None
+        :param compression: the compression for the channel, as a name or a
+            :class:`mooq.compression.Compressor` object. A value of None uses
+            the connection's compression.
+        :type compression: str|:class:`mooq.compression.Compressor`|None
         :returns: an :class:`InMemoryChannel` object
         '''
-        internal_chan = InMemoryChannelInternal(msg_q=self.msg_q, broker_q=self.broker_q)
+        internal_chan = InMemoryChannelInternal(msg_q=self.msg_q, broker_q=queue.Queue(),
+                                                subscribe=self._subscribe)
 
-        chan = InMemoryChannel(internal_chan=internal_chan, loop=self.loop)
+        chan = InMemoryChannel(internal_chan=internal_chan, loop=self.loop,
+                               serializer=serializer or self.serializer,
+                               compression=compression or self.compressor)
         self.channels.append(chan)
         return chan
 
@@ -298,30 +608,118 @@ class InMemoryConnection(base.Connection):
         Receive messages from the broker and schedule
         associated callback couroutines.
 
+        Each cycle takes up to ``prefetch_count`` messages from every
+        consumer queue that has messages waiting, visiting the queues in
+        round robin order.
+
         :param num_cycles: the number of times to run the
             event processing loop. A value of None
-            will cause events to be processed without a cycle limit.
+            will cause events to be processed without a cycle limit,
+            sleeping whenever there are no messages waiting.
         :type num_cycles: int|None
         '''
 
         while True:
-            for chan in self.channels:
-                for queue_name, callback in chan.callbacks.items():
-                    cq = self.broker._get_consumer_queue(queue_name)
-
-                    try:
-                        msg_dict = cq.get_next_message()
-                    except base.ConsumeTimeout:
-                        pass
-                    else:
-                        _, launched = base.create_task(callback(msg_dict), self.loop)
-                        await launched
+            if num_cycles is None:
+                self._wakeup.clear()
+                if not self._ready:
+                    await self._wakeup.wait()
+
+            await self._dispatch_ready()
 
             if num_cycles is not None:
                 num_cycles = num_cycles - 1
                 if num_cycles == 0:
                     break
 
+    async def _dispatch_ready(self):
+        ready = list(self._ready)
+        self._ready.clear()
+
+        num_started = 0
+        for sub in ready:
+            if sub.batch:
+                num_started += self._dispatch_batch(sub)
+            else:
+                num_started += self._dispatch_each(sub)
+
+            if len(sub.queue) and not sub.consumer.saturated:
+                self._set_ready(sub)
+
+        if num_started:
+            # yield once so every callback scheduled this cycle starts
+            await asyncio.sleep(0)
+
+    def _dispatch_each(self, sub):
+        batch_size = self.prefetch_count
+        capacity = sub.consumer.capacity
+        if capacity is not None:
+            batch_size = min(batch_size, capacity)
+
+        num_started = 0
+        for _ in range(batch_size):
+            try:
+                msg_dict = sub.queue.get_next_message()
+            except base.ConsumeTimeout:
+                break
+            else:
+                resp = self._resp_for(sub, msg_dict)
+                if resp is not None:
+                    sub.consumer.run(resp)
+                    num_started += 1
+
+        return num_started
+
+    def _dispatch_batch(self, sub):
+        resps = []
+        for _ in range(self.prefetch_count):
+            try:
+                msg_dict = sub.queue.get_next_message()
+            except base.ConsumeTimeout:
+                break
+            else:
+                resp = self._resp_for(sub, msg_dict)
+                if resp is not None:
+                    resps.append(resp)
+
+        if not resps:
+            return 0
+
+        sub.consumer.run(resps)
+        return 1
+
+    def _resp_for(self, sub, msg_dict):
+        '''
+        :returns: what the callback of the subscription is passed for a
+            message, or None if the message can't be decoded. The error is then
+            reported to the event loop's exception handler and the message
+            dropped, so that it doesn't stop the messages after it.
+        '''
+        try:
+            return sub.make_resp(msg_dict)
+        except Exception as e:
+            self.loop.call_exception_handler({
+                "message": "dropping message that couldn't be decoded",
+                "exception": e,
+            })
+            return None
+
+    def _subscribe(self, queue_name, consumer, make_resp, batch=False):
+        cq = self.broker._get_consumer_queue(queue_name)
+        sub = _Subscription(queue=cq, consumer=consumer, make_resp=make_resp, batch=batch)
+        set_ready = partial(self._set_ready_if_waiting, sub)
+        cq.add_listener(set_ready)
+        consumer.add_resume_listener(set_ready)
+        set_ready()
+
+    def _set_ready_if_waiting(self, sub):
+        if len(sub.queue) and not sub.consumer.saturated:
+            self._set_ready(sub)
+
+    def _set_ready(self, sub):
+        self._ready[sub] = None
+        self._wakeup.set()
+
 
 class InMemoryChannel(base.Channel):
     '''
@@ -350,17 +748,20 @@ class InMemoryChannel(base.Channel):
             "topic" or "fanout"
         :type exchange_type: str
         '''
-        self._chan.msg_q.put(
+        await self._send_command(
             {
                 "command": "register_producer",
                 "exchange_name": exchange_name,
                 "exchange_type": exchange_type,
-            }, block=False
+            }
         )
-        await self._handle_broker_responses()
+        self._handle_broker_responses()
 
     # @base.lock_channel
-    async def register_consumer(self, queue_name=None, routing_keys=[""], *, exchange_name, exchange_type, callback):
+    async def register_consumer(self, queue_name=None, routing_keys=[""], *, exchange_name, exchange_type,
+                                callback=None, max_concurrency=None, prefetch_count=None, prefetch_size=0,
+                                ack=False, requeue_on_error=False, raw=False, batch_callback=None,
+                                executor=None, ordered=False, order_key=None):
         '''
         Register a consumer on the channel.
 
@@ -372,36 +773,117 @@ class InMemoryChannel(base.Channel):
             meaning it will be deleted once the channel is closed.
         :param callback: The callback to run when a message is placed on the queue that
             matches one of the routing keys
+        :param batch_callback: A callback to use instead of ``callback``, that is
+            run with a list of the messages received together. A batch holds the
+            messages taken from the queue in one cycle of
+            :meth:`InMemoryConnection.process_events`.
         :param routing_keys: A list of keys to match against. A message will only be sent
             to a consumer if its routing key matches one or more of the routing keys listed
+        :param max_concurrency: The maximum number of callbacks that may run at once.
+            While the limit is reached, messages are left on the consumer queue.
+            A value of None means no limit.
+        :param prefetch_count: The maximum number of unacknowledged messages taken
+            for the consumer. Only applies if ``ack`` is True. A message taken from
+            the queue is unacknowledged until its callback finishes. A value of None
+            means no limit.
+        :param prefetch_size: ignored by the in memory broker
+        :param ack: If True, each message is acknowledged once its callback finishes.
+            If False, messages are acknowledged as soon as they are taken from the queue.
+        :param requeue_on_error: ignored, since the in memory broker doesn't
+            redeliver messages
+        :param raw: If True, the callback is passed a :class:`RawMessage` holding
+            the undecoded message body and its delivery details, instead of a
+            dictionary with the decoded message.
+        :param executor: If given, the callback is a plain function run in
+            this executor. See :meth:`mooq.base.Channel.register_consumer`.
+        :param ordered: If True, the callbacks of messages with the same key run
+            one at a time, in order, and messages with different keys in parallel.
+            See :meth:`mooq.base.Channel.register_consumer`.
+        :param order_key: the function giving the key of a message for ``ordered``.
+            A value of None uses the routing key.
 
         :type exchange_name: str
         :type exchange_type: str
         :type queue_name: str|None
         :type callback: coroutine
         :type routing_keys: [str,]
-
-        '''
+        :type max_concurrency: int|None
+        :type prefetch_count: int|None
+        :type prefetch_size: int
+        :type ack: bool
+        :type requeue_on_error: bool
+        :type raw: bool
+        :type batch_callback: coroutine
+        :type executor: :class:`concurrent.futures.Executor`|None
+        :type ordered: bool
+        :type order_key: function|None
+
+        '''
+        callback, batch = base.pick_callback(callback, batch_callback)
+        key = base.pick_order_key(ordered, order_key, batch)
+        if executor is not None:
+            callback, raw, max_concurrency = self._offload(callback, executor, raw=raw, batch=batch,
+                                                           max_concurrency=max_concurrency)
 
         if queue_name is None:
             queue_name = str(uuid.uuid4())
 
-        self._chan.msg_q.put(
+        reply = self._send_command(
             {
                 "command": "register_consumer",
                 "exchange_name": exchange_name,
                 "exchange_type": exchange_type,
                 "queue_name": queue_name,
                 "routing_keys": routing_keys
-            }, block=False
+            }
         )
 
         self.callbacks[queue_name] = callback
 
-        await self._handle_broker_responses()
-
-    async def _handle_broker_responses(self):
-        await asyncio.sleep(0.01)
+        await reply
+        if ack and prefetch_count is not None:
+            if max_concurrency is None or prefetch_count < max_concurrency:
+                max_concurrency = prefetch_count
+
+        consumer = base.Consumer(callback, loop=self.loop, max_concurrency=max_concurrency, key=key)
+        make_resp = self._make_raw if raw else self._make_resp
+        self._chan.subscribe(queue_name, consumer, make_resp, batch)
+        self._handle_broker_responses()
+
+    def _make_resp(self, msg_dict):
+        return {
+            "msg": self._decode(msg_dict["msg"], msg_dict.get("content_type"),
+                                msg_dict.get("content_encoding")),
+            "routing_key": msg_dict["routing_key"],
+        }
+
+    def _make_raw(self, msg_dict):
+        return base.RawMessage(body=msg_dict["msg"],
+                               exchange=msg_dict.get("exchange"),
+                               routing_key=msg_dict["routing_key"],
+                               delivery_tag=None,
+                               content_type=msg_dict.get("content_type"),
+                               content_encoding=msg_dict.get("content_encoding"))
+
+    def _send_command(self, command):
+        '''
+        Send a command to the broker
+
+        :param command: the command to send
+        :type command: dict
+        :returns: a future that the broker sets done once it has handled the
+            command. If the command fails, the future holds the exception.
+            Errors that can't be set on the future, for example because it
+            was cancelled, are put on the channel's own response queue and
+            raised by the channel's next command.
+        '''
+        reply = self.loop.create_future()
+        command["reply"] = reply
+        command["reply_q"] = self._chan.broker_q
+        self._chan.msg_q.put(command, block=False)
+        return reply
+
+    def _handle_broker_responses(self):
         while True:
             try:
                 resp = self._chan.broker_q.get(block=False)
@@ -411,26 +893,80 @@ class InMemoryChannel(base.Channel):
                 if resp['response'] == "error":
                     raise resp['error'](resp['msg'])
 
-            await asyncio.sleep(0.001)
-
     # @base.lock_channel
-    async def publish(self, *, exchange_name, msg, routing_key=''):
+    async def publish(self, *, exchange_name, msg, routing_key='', wait=True):
         '''
         Publish a message on the channel.
 
         :param exchange_name: The name of the exchange to send the message to
         :param msg: The message to send
         :param routing_key: The routing key to associated the message with
+        :param wait: If True, wait until the broker has routed the message.
+            If False, return as soon as the message is sent to the broker.
         :type exchange_name: str
         :type msg: str
         :type routing_key: str
+        :type wait: bool
+        :returns: None if ``wait`` is True, otherwise a confirmation future
+            that becomes done once the broker has routed the message.
+            Awaiting on it raises any routing error such as :class:`BadExchange`.
         '''
-        self._chan.msg_q.put(
+        body, content_encoding = self._encode(msg)
+        reply = self._send_command(
             {
                 "command": "publish",
                 "exchange_name": exchange_name,
-                "msg": msg,
+                "msg": body,
                 "routing_key": routing_key,
-            }, block=False
+                "content_type": self.serializer.content_type,
+                "content_encoding": content_encoding,
+            }
+        )
+        if not wait:
+            return reply
+
+        await reply
+        self._handle_broker_responses()
+
+    async def enable_confirms(self, *, max_in_flight=1000):
+        '''
+        Publisher confirm mode. The in memory broker always confirms
+        publishes once it has routed them, so this has no effect.
+
+        :param max_in_flight: ignored
+        :type max_in_flight: int
+        '''
+        pass
+
+    async def publish_many(self, *, exchange_name, messages, wait=True):
+        '''
+        Publish several messages on the channel with a single broker command.
+
+        :param exchange_name: The name of the exchange to send the messages to
+        :param messages: The messages to send, as ``(msg, routing_key)`` pairs
+        :param wait: If True, wait until the broker has routed the messages.
+            If False, return as soon as the messages are sent to the broker.
+        :type exchange_name: str
+        :type messages: iterable of (str, str)
+        :type wait: bool
+        :returns: None if ``wait`` is True, otherwise a confirmation future
+            that becomes done once the broker has routed the messages.
+        '''
+        msgs = []
+        for msg, routing_key in messages:
+            body, content_encoding = self._encode(msg)
+            msgs.append((body, routing_key, content_encoding))
+
+        reply = self._send_command(
+            {
+                "command": "publish_many",
+                "exchange_name": exchange_name,
+                "msgs": msgs,
+                "content_type": self.serializer.content_type,
+            }
         )
-        await self._handle_broker_responses()
+        if not wait:
+            return reply
+
+        await reply
+        self._handle_broker_responses()
@@ -0,0 +1,221 @@
+'''
+A connection that spreads its work across several connections to the same broker.
+
+'''
+
+import asyncio
+import bisect
+import itertools
+import zlib
+
+from . import base
+
+
+class PooledConnection(base.Connection):
+    '''
+    Connection made up of several connections to the same broker, each with
+    its own socket and I/O, to get past the throughput of a single connection.
+
+    Create one with :func:`mooq.connect` by giving a ``pool_size``.
+    '''
+
+    def __init__(self, connections, *, hash_routing=False, **kwargs):
+        '''
+        :param connections: the underlying connections, which must not be connected yet
+        :type connections: list of :class:`mooq.base.Connection`
+        :param hash_routing: If True, messages are published on a connection picked
+            by consistent hashing of their routing key, so messages with the same
+            routing key keep their order. If False, publishes are spread over the
+            connections in turn.
+        :type hash_routing: bool
+
+        .. note:: must call :meth:`connect` to actually connect to the broker
+        '''
+        super().__init__(**kwargs)
+        self.connections = connections
+        self.hash_routing = hash_routing
+        self._ring = _HashRing(len(connections))
+
+    async def connect(self):
+        '''
+        Connect every underlying connection to the broker
+        '''
+        await asyncio.gather(*[conn.connect() for conn in self.connections])
+        self.connected = True
+
+    async def create_channel(self, serializer=None, compression=None):
+        '''
+        create a channel for multiplexing the connection. The channel is
+        made up of one channel on each underlying connection.
+
+        :param serializer: the serializer for the channel, as a name or a
+            :class:`mooq.serializers.Serializer` object. A value of None uses
+            the connection's serializer.
+        :type serializer: str|:class:`mooq.serializers.Serializer`|None
+        :param compression: the compression for the channel, as a name or a
+            :class:`mooq.compression.Compressor` object. A value of None uses
+            the connection's compression.
+        :type compression: str|:class:`mooq.compression.Compressor`|None
+        :returns: a :class:`PooledChannel` object
+        '''
+        serializer = serializer or self.serializer
+        compression = compression or self.compressor
+        shards = await asyncio.gather(*[conn.create_channel(serializer, compression)
+                                        for conn in self.connections])
+
+        chan = PooledChannel(shards=list(shards), ring=self._ring if self.hash_routing else None,
+                             loop=self.loop, serializer=serializer, compression=compression)
+        self.channels.append(chan)
+        return chan
+
+    async def close(self):
+        '''
+        Stop processing events and close every underlying connection
+        '''
+        await asyncio.gather(*[conn.close() for conn in self.connections])
+        self.connected = False
+
+    async def process_events(self, num_cycles=None):
+        '''
+        Receive messages from the broker on every underlying connection and
+        schedule associated callback couroutines.
+
+        :param num_cycles: the number of times to run the
+            event processing loop of each connection. A value of None
+            will cause events to be processed without a cycle limit.
+        :type num_cycles: int|None
+        '''
+        await asyncio.gather(*[conn.process_events(num_cycles=num_cycles) for conn in self.connections])
+
+
+class PooledChannel(base.Channel):
+    '''
+    Channel of a :class:`PooledConnection`, made up of one channel, or shard,
+    on each underlying connection.
+    '''
+
+    def __init__(self, *, shards, ring, **kwargs):
+        '''
+        :param shards: a channel on each underlying connection
+        :type shards: list of :class:`mooq.base.Channel`
+        :param ring: picks the shard for a routing key, or None to use
+            the shards in turn
+        '''
+        super().__init__(internal_chan=None, **kwargs)
+        self.shards = shards
+        self._ring = ring
+        self._turns = itertools.cycle(shards)
+
+    async def register_producer(self, *, exchange_name, exchange_type):
+        '''
+        Register a producer on the channel by providing information to
+        the broker about the exchange the channel is going to use.
+
+        :param exchange_name: name of the exchange
+        :type exchange_name: str
+        :param exchange_type: Type of the exchange. Accepted values are "direct",
+            "topic" or "fanout"
+        :type exchange_type: str
+        '''
+        # exchanges belong to the broker, so declaring once is enough
+        await self.shards[0].register_producer(exchange_name=exchange_name, exchange_type=exchange_type)
+
+    async def register_consumer(self, queue_name=None, routing_keys=[""], *, exchange_name, exchange_type,
+                                **kwargs):
+        '''
+        Register a consumer on the next shard in turn, so that the
+        consumers of the channel are spread over the underlying connections.
+
+        Takes the same parameters as :meth:`mooq.base.Channel.register_consumer`.
+        '''
+        await next(self._turns).register_consumer(queue_name, routing_keys, exchange_name=exchange_name,
+                                                  exchange_type=exchange_type, **kwargs)
+
+    async def publish(self, *, exchange_name, msg, routing_key='', wait=True):
+        '''
+        Publish a message on one of the shards.
+
+        :param exchange_name: The name of the exchange to send the message to
+        :param msg: The message to send
+        :param routing_key: The routing key to associated the message with
+        :param wait: If True, wait until the shard's publish completes.
+            If False, return as soon as the message is sent.
+        :type exchange_name: str
+        :type msg: str
+        :type routing_key: str
+        :type wait: bool
+        :returns: None if ``wait`` is True, otherwise the confirmation future
+            of the shard the message was published on
+        '''
+        return await self._shard_for(routing_key).publish(exchange_name=exchange_name, msg=msg,
+                                                          routing_key=routing_key, wait=wait)
+
+    async def publish_many(self, *, exchange_name, messages, wait=True):
+        '''
+        Publish several messages in one go. If the connection uses hash
+        routing, the messages are split between the shards by routing key,
+        otherwise they are all published on the next shard in turn.
+
+        :param exchange_name: The name of the exchange to send the messages to
+        :param messages: The messages to send, as ``(msg, routing_key)`` pairs
+        :param wait: If True, wait until the publishes of every shard complete.
+            If False, return as soon as the messages are sent.
+        :type exchange_name: str
+        :type messages: iterable of (str, str)
+        :type wait: bool
+        :returns: None if ``wait`` is True, otherwise a confirmation future
+            that becomes done once the confirmations of every shard are done
+        '''
+        if self._ring is None:
+            return await next(self._turns).publish_many(exchange_name=exchange_name, messages=messages,
+                                                        wait=wait)
+
+        by_shard = {}
+        for msg, routing_key in messages:
+            by_shard.setdefault(self._shard_for(routing_key), []).append((msg, routing_key))
+
+        confirmations = await asyncio.gather(*[shard.publish_many(exchange_name=exchange_name,
+                                                                  messages=shard_messages, wait=wait)
+                                               for shard, shard_messages in by_shard.items()])
+        if not wait:
+            return asyncio.gather(*confirmations)
+
+    async def enable_confirms(self, *, max_in_flight=1000):
+        '''
+        Put every shard in publisher confirm mode. Publishes then complete
+        once the broker acknowledges the message.
+
+        :param max_in_flight: the maximum number of published messages that
+            may wait for the broker's acknowledgement at once on each shard.
+        :type max_in_flight: int
+        '''
+        await asyncio.gather(*[shard.enable_confirms(max_in_flight=max_in_flight) for shard in self.shards])
+
+    def _shard_for(self, routing_key):
+        if self._ring is None:
+            return next(self._turns)
+
+        return self.shards[self._ring.node_for(routing_key)]
+
+
+class _HashRing(object):
+    '''
+    Consistent hash ring mapping keys to node numbers.
+
+    Each node is placed on the ring many times so keys are spread evenly,
+    and resizing the ring only moves the keys of the nodes added or removed.
+    '''
+    def __init__(self, num_nodes, replicas=100):
+        points = sorted((_hash("{}-{}".format(node, i)), node)
+                        for node in range(num_nodes) for i in range(replicas))
+        self._hashes = [h for h, _ in points]
+        self._nodes = [node for _, node in points]
+
+    def node_for(self, key):
+        i = bisect.bisect(self._hashes, _hash(key)) % len(self._hashes)
+        return self._nodes[i]
+
+
+def _hash(key):
+    # stable across processes, unlike hash()
+    return zlib.crc32(key.encode("utf-8"))
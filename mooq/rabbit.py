@@ -1,11 +1,13 @@
 import subprocess
 import time
-import json
 import os
+import threading
+from collections import deque, OrderedDict
 from functools import wraps, partial
 import asyncio
 
 import pika
+from pika.adapters.asyncio_connection import AsyncioConnection
 
 from . import base
 
@@ -52,6 +54,10 @@ class RabbitMQBroker(base.Broker):
 class RabbitMQConnection(base.Connection):
     '''
     Implementation of a connection to a RabbitMQ broker.
+
+    The connection is owned by a dedicated I/O thread. Every operation
+    on the connection and its channels is queued to that thread, so no
+    executor threads are used.
     '''
     def __init__(self, **kwargs):
         '''
@@ -66,66 +72,251 @@ class RabbitMQConnection(base.Connection):
         super().__init__(**kwargs)
         self.channel_resource_constructor_func = RabbitMQChannel
 
-    def _connect(self):
-        cp = pika.ConnectionParameters(host=self.host, port=self.port)
-        self._conn = pika.BlockingConnection(cp)
-
     async def connect(self):
         '''
-        Connect to the RabbitMQ broker
+        Connect to the RabbitMQ broker and start the connection's I/O thread
         '''
-        await self.loop.run_in_executor(None, self._connect)
+        cp = pika.ConnectionParameters(host=self.host, port=self.port)
+        self._io = _IOThread(params=cp, loop=self.loop)
+        self._conn = await self._io.open()
+        self.connected = True
 
     @base.lock_connection
-    def _create_channel(self):
+    def _create_channel(self, serializer, compression):
         internal_chan = self._conn.channel()
 
-        chan = RabbitMQChannel(internal_chan=internal_chan, loop=self.loop)
+        chan = RabbitMQChannel(internal_chan=internal_chan, loop=self.loop, io_thread=self._io,
+                               serializer=serializer, compression=compression)
         self.channels.append(chan)
         return chan
 
-    async def create_channel(self):
+    async def create_channel(self, serializer=None, compression=None):
         '''
         create a channel for multiplexing the connection
 
+        :param serializer: the serializer for the channel, as a name or a
+            :class:`mooq.serializers.Serializer` object. A value of None uses
+            the connection's serializer.
+        :type serializer: str|:class:`mooq.serializers.Serializer`|None
+        :param compression: the compression for the channel, as a name or a
+            :class:`mooq.compression.Compressor` object. A value of None uses
+            the connection's compression.
+        :type compression: str|:class:`mooq.compression.Compressor`|None
         :returns: a :class:`RabbitMQChannel` object
         '''
-        loop = asyncio.get_event_loop()
-        return await loop.run_in_executor(None, self._create_channel)
+        return await self._io.submit(self._create_channel, serializer or self.serializer,
+                                     compression or self.compressor)
 
-    def close(self):
+    async def close(self):
         '''
         Stop processing events and close the connection to the broker
+        '''
+        self.connected = False
+        await self._io.close()
 
-        :raises NotImplementedError:
+    async def process_events(self, num_cycles=None):
+        '''
+        Wait while the connection's I/O thread receives messages from the
+        RabbitMQ broker and schedules associated callback couroutines.
+
+        :param num_cycles: the number of I/O thread cycles to wait for.
+            Each cycle processes events for up to 0.1 seconds. A value of None
+            will wait until the connection is closed.
+        :type num_cycles: int|None
         '''
-        raise NotImplementedError
+        if num_cycles is None:
+            await asyncio.shield(self._io.closed)
+        else:
+            await self._io.wait_cycles(num_cycles)
 
-    def _process_events(self, num_cycles=None):
-        while True:
-            with self.conn_lock:
-                self._conn.process_data_events(time_limit=0.1)
 
-            if num_cycles is not None:
-                num_cycles = num_cycles - 1
-                if num_cycles == 0:
-                    break
+class _IOThread(threading.Thread):
+    '''
+    Thread that owns a pika BlockingConnection.
 
-    async def process_events(self, num_cycles=None):
+    Commands are queued on a deque, which needs no lock, and the thread is
+    woken through the connection's ``add_callback_threadsafe``. Between
+    commands, the thread processes events from the broker.
+    '''
+
+    def __init__(self, *, params, loop):
+        '''
+        :param params: the parameters to open the connection with
+        :param loop: the event loop to return results to
+        :type params: :class:`pika.ConnectionParameters`
         '''
-        Receive messages from the RabbitMQ broker and schedule
-        associated callback couroutines.
+        super().__init__(name="mooq-io-{}".format(params.host), daemon=True)
+        self._params = params
+        self.loop = loop
+        self.conn = None
+        self._commands = deque()
+        self._deliveries = []
+        self._wake_requested = False
+        self._closing = False
+        self._cycles = 0
+        self._cycle_waiters = []
+        self._cycle_waiters_lock = threading.Lock()
+        self._opened = loop.create_future()
+        self.closed = loop.create_future()
 
-        Should be run as a task in your app and not awaited for.
+    async def open(self):
+        '''
+        Start the thread and open the connection
 
-        :param num_cycles: the number of times to run the
-            event processing loop. A value of None
-            will cause events to be processed without a cycle limit.
-        :type num_cycles: int|None
+        :returns: the :class:`pika.BlockingConnection`
         '''
-        loop = asyncio.get_event_loop()
-        func = partial(self._process_events, num_cycles=num_cycles)
-        await loop.run_in_executor(None, func)
+        self.start()
+        return await self._opened
+
+    async def close(self):
+        '''
+        Close the connection and wait for the thread to finish
+        '''
+        self._closing = True
+        self._wake()
+        await asyncio.shield(self.closed)
+        # closed is resolved by the thread's last call, so this is quick
+        self.join()
+
+    def submit(self, func, *args, **kwargs):
+        '''
+        Queue a function to run on the I/O thread
+
+        :returns: a future holding the result of the function
+
+        .. note:: must only be called from within the thread
+            where the event loop resides
+        '''
+        fut = self.loop.create_future()
+        if self.closed.done():
+            fut.set_exception(base.BrokerInternalError("connection is closed"))
+            return fut
+
+        self._commands.append((partial(func, *args, **kwargs), fut))
+        self._wake()
+        return fut
+
+    def deliver_soon(self, func, *args):
+        '''
+        Queue a function to run on the event loop. Functions queued while
+        the thread processes events are handed to the event loop together,
+        with a single :meth:`asyncio.AbstractEventLoop.call_soon_threadsafe`.
+
+        .. note:: must only be called from within the I/O thread
+        '''
+        self._deliveries.append((func, args))
+
+    def wait_cycles(self, num_cycles):
+        '''
+        :returns: a future that becomes done once the thread has processed
+            events ``num_cycles`` more times, or once the connection is closed
+        '''
+        fut = self.loop.create_future()
+        if self.closed.done():
+            fut.set_result(None)
+            return fut
+
+        with self._cycle_waiters_lock:
+            self._cycle_waiters.append((self._cycles + num_cycles, fut))
+
+        return fut
+
+    def _wake(self):
+        if not self._wake_requested:
+            self._wake_requested = True
+            self.conn.add_callback_threadsafe(_do_nothing)
+
+    def run(self):
+        try:
+            self.conn = pika.BlockingConnection(self._params)
+        except Exception as e:
+            self.loop.call_soon_threadsafe(_set_exception, self._opened,
+                                           base.BrokerInternalError(str(e)))
+            self.loop.call_soon_threadsafe(_set_result, self.closed, None)
+            return
+
+        self.loop.call_soon_threadsafe(_set_result, self._opened, self.conn)
+
+        error = None
+        try:
+            while True:
+                self._wake_requested = False
+                self._run_commands()
+                if self._closing:
+                    break
+
+                self.conn.process_data_events(time_limit=0.1)
+                self._flush_deliveries()
+                self._cycles += 1
+                self._notify_cycle_waiters()
+        except Exception as e:
+            error = e
+        finally:
+            try:
+                if self.conn.is_open:
+                    self.conn.close()
+            except Exception as e:
+                # the socket may already be dead or the broker may have
+                # forced the close. Either way the thread is done
+                if error is None:
+                    error = e
+            finally:
+                self.loop.call_soon_threadsafe(self._finish, error)
+
+    def _run_commands(self):
+        done = []
+        while self._commands:
+            func, fut = self._commands.popleft()
+            try:
+                done.append((fut, func(), None))
+            except Exception as e:
+                done.append((fut, None, e))
+
+        if done:
+            self.loop.call_soon_threadsafe(_resolve_all, done)
+
+    def _flush_deliveries(self):
+        if self._deliveries:
+            deliveries, self._deliveries = self._deliveries, []
+            self.loop.call_soon_threadsafe(self._run_all, deliveries)
+
+    def _run_all(self, deliveries):
+        for func, args in deliveries:
+            # one failing delivery mustn't stop the rest of the cycle's
+            try:
+                func(*args)
+            except Exception as e:
+                self.loop.call_exception_handler({
+                    "message": "error delivering a message received on the I/O thread",
+                    "exception": e,
+                })
+
+    def _notify_cycle_waiters(self):
+        with self._cycle_waiters_lock:
+            if not self._cycle_waiters:
+                return
+
+            ready = [fut for target, fut in self._cycle_waiters if target <= self._cycles]
+            self._cycle_waiters = [(target, fut) for target, fut in self._cycle_waiters
+                                   if target > self._cycles]
+
+        if ready:
+            self.loop.call_soon_threadsafe(_resolve_all, [(fut, None, None) for fut in ready])
+
+    def _finish(self, error):
+        if error is None:
+            error = base.BrokerInternalError("connection is closed")
+        else:
+            error = base.BrokerInternalError(str(error))
+
+        pending = [(fut, None, error) for func, fut in self._commands]
+        self._commands.clear()
+        with self._cycle_waiters_lock:
+            pending.extend((fut, None, None) for target, fut in self._cycle_waiters)
+            self._cycle_waiters = []
+
+        _resolve_all(pending)
+        _set_result(self.closed, None)
 
 
 class RabbitMQChannel(base.Channel):
@@ -133,10 +324,33 @@ class RabbitMQChannel(base.Channel):
     Implementation of a RabbitMQ Channel
     '''
 
+    def __init__(self, *, io_thread=None, **kwargs):
+        '''
+        :param internal_chan: the transport specific channel object to use
+        :param loop: the event loop
+        :param io_thread: the I/O thread of the channel's connection
+        :param serializer: the serializer for published messages
+        :param compression: how to compress large messages
+        '''
+        super().__init__(**kwargs)
+        self._io = io_thread
+        # properties for each content encoding the channel publishes with
+        self._properties = {
+            None: pika.BasicProperties(content_type=self.serializer.content_type),
+        }
+        if self.compressor is not None:
+            self._properties[self.compressor.name] = pika.BasicProperties(
+                content_type=self.serializer.content_type,
+                content_encoding=self.compressor.name)
+        self._confirms = None
+        # the (prefetch_size, prefetch_count) the channel gives new consumers
+        self._qos = (0, 0)
+        self._acks = _Acks(loop=self.loop, send_ack=self._send_ack, send_reject=self._send_reject)
+
     @base.lock_channel
     def _register_producer(self, *, exchange_name, exchange_type):
         self._chan.exchange_declare(exchange=exchange_name,
-                                    type=exchange_type)
+                                    exchange_type=exchange_type)
 
     async def register_producer(self, *, exchange_name, exchange_type):
         '''
@@ -151,16 +365,15 @@ class RabbitMQChannel(base.Channel):
         :returns: None
         '''
 
-        loop = asyncio.get_event_loop()
-        func = partial(self._register_producer, exchange_name=exchange_name,
-                       exchange_type=exchange_type)
-
-        await loop.run_in_executor(None, func)
+        await self._io.submit(self._register_producer, exchange_name=exchange_name,
+                              exchange_type=exchange_type)
 
     @base.lock_channel
-    def _register_consumer(self, *, exchange_name, exchange_type, queue_name, callback, routing_keys=[""]):
+    def _register_consumer(self, *, exchange_name, exchange_type, queue_name, callback, routing_keys=[""],
+                           max_concurrency=None, prefetch_count=None, prefetch_size=0, ack=False,
+                           requeue_on_error=False, raw=False, batch=False, key=None):
         self._chan.exchange_declare(exchange=exchange_name,
-                                    type=exchange_type)
+                                    exchange_type=exchange_type)
 
         exclusive = False
         if queue_name is None:
@@ -175,15 +388,27 @@ class RabbitMQChannel(base.Channel):
                                   queue=queue_name,
                                   routing_key=r)
 
-        pika_callback = self._wrap_callback(callback)
+        prefetch_count, early_ack = _flow_control(max_concurrency, prefetch_count, ack, batch)
+        qos = (prefetch_size, prefetch_count or 0)
+        if qos != self._qos:
+            self._chan.basic_qos(prefetch_size=prefetch_size,
+                                 prefetch_count=prefetch_count or 0,
+                                 all_channels=False)
+            self._qos = qos
+
+        consumer = base.Consumer(callback, loop=self.loop, max_concurrency=max_concurrency, key=key)
+        pika_callback = self._wrap_callback(consumer, ack, raw, batch, early_ack, requeue_on_error)
         self._chan.basic_consume(pika_callback,
                                  queue=queue_name,
-                                 no_ack=True,
+                                 no_ack=not (ack or early_ack),
                                  exclusive=exclusive,
                                  consumer_tag=None,
                                  arguments=None)
 
-    async def register_consumer(self, queue_name=None, routing_keys=[""], *, exchange_name, exchange_type, callback):
+    async def register_consumer(self, queue_name=None, routing_keys=[""], *, exchange_name, exchange_type,
+                                callback=None, max_concurrency=None, prefetch_count=None, prefetch_size=0,
+                                ack=False, requeue_on_error=False, raw=False, batch_callback=None,
+                                executor=None, ordered=False, order_key=None):
         '''
         Register a consumer on the RabbitMQ channel.
 
@@ -195,65 +420,912 @@ class RabbitMQChannel(base.Channel):
             meaning it will be deleted once the channel is closed.
         :param callback: The callback to run when a message is placed on the queue that
             matches one of the routing keys
+        :param batch_callback: A callback to use instead of ``callback``, that is
+            run with a list of the messages received together. A batch holds the
+            messages received in one event loop iteration, which for
+            :class:`RabbitMQConnection` is one I/O thread cycle.
         :param routing_keys: A list of keys to match against. A message will only be sent
             to a consumer if its routing key matches one or more of the routing keys listed
+        :param max_concurrency: The maximum number of callbacks that may run at once.
+            While the limit is reached, received messages wait in the channel until a
+            callback finishes. A value of None means no limit. The broker is kept from
+            sending more messages than can wait by consuming in ack mode with a
+            ``prefetch_count`` of at most ``max_concurrency``. If ``ack`` is False,
+            each message is then acked as soon as its callback starts. A batch
+            consumer with ``max_concurrency`` must give a ``prefetch_count``.
+        :param prefetch_count: The maximum number of unacknowledged messages the
+            broker sends the consumer. Only applies if ``ack`` is True or
+            ``max_concurrency`` is given. A value of None means no limit.
+            The limit is the consumer's own, so consumers sharing a channel
+            may each have a different one.
+        :param prefetch_size: The maximum total size in bytes of unacknowledged
+            messages the broker sends the consumer. 0 means no limit.
+            RabbitMQ itself only supports 0.
+        :param ack: If True, each message is acknowledged once its callback finishes,
+            or rejected if the callback raised. Messages whose callbacks haven't
+            finished are redelivered if the channel closes. If False, the broker
+            considers messages acknowledged as soon as it sends them.
+        :param requeue_on_error: If True, a message whose callback raised is
+            requeued rather than rejected outright, which without a dead letter
+            exchange discards it. Only applies if ``ack`` is True.
+        :param raw: If True, the callback is passed a :class:`RawMessage` holding
+            the undecoded message body and its delivery details, instead of a
+            dictionary with the decoded message.
+        :param executor: If given, the callback is a plain function run in
+            this executor. See :meth:`mooq.base.Channel.register_consumer`.
+        :param ordered: If True, the callbacks of messages with the same key run
+            one at a time, in order, and messages with different keys in parallel.
+            See :meth:`mooq.base.Channel.register_consumer`.
+        :param order_key: the function giving the key of a message for ``ordered``.
+            A value of None uses the routing key.
 
         :type exchange_name: str
         :type exchange_type: str
         :type queue_name: str|None
         :type callback: coroutine
         :type routing_keys: [str,]
-        '''
+        :type max_concurrency: int|None
+        :type prefetch_count: int|None
+        :type prefetch_size: int
+        :type ack: bool
+        :type requeue_on_error: bool
+        :type raw: bool
+        :type batch_callback: coroutine
+        :type executor: :class:`concurrent.futures.Executor`|None
+        :type ordered: bool
+        :type order_key: function|None
 
-        loop = asyncio.get_event_loop()
-        func = partial(self._register_consumer, exchange_name=exchange_name,
-                       exchange_type=exchange_type, queue_name=queue_name,
-                       callback=callback, routing_keys=routing_keys)
-
-        await loop.run_in_executor(None, func)
+        Acks are sent with ``multiple=True``, at most once per event loop
+        iteration, for the newest message whose callback and the callbacks of
+        all earlier messages on the channel have finished. A slow callback
+        therefore holds back the acks of the messages received after it.
+        '''
+        callback, batch = base.pick_callback(callback, batch_callback)
+        key = base.pick_order_key(ordered, order_key, batch)
+        if executor is not None:
+            callback, raw, max_concurrency = self._offload(callback, executor, raw=raw, batch=batch,
+                                                           max_concurrency=max_concurrency)
+        await self._io.submit(self._register_consumer, exchange_name=exchange_name,
+                              exchange_type=exchange_type, queue_name=queue_name,
+                              callback=callback, batch=batch, routing_keys=routing_keys,
+                              max_concurrency=max_concurrency, prefetch_count=prefetch_count,
+                              prefetch_size=prefetch_size, ack=ack, requeue_on_error=requeue_on_error,
+                              raw=raw, key=key)
 
-    def _wrap_callback(self, async_callback):
+    def _wrap_callback(self, consumer, ack=False, raw=False, batch=False, early_ack=False,
+                       requeue_on_error=False):
         '''
         Decorator to turn a pika callback running outside the
         main thread into a coroutine running in the main thread
         with simplified arguments.
 
-        TODO: return routing key as well in resp dictionary
+        Messages received in one I/O thread cycle reach the event
+        loop together.
         '''
 
+        main_loop_callback = self._make_on_message(consumer, ack, raw, batch, early_ack, requeue_on_error)
+
         def thread_callback(ch, meth, prop, body):
-            def main_loop_callback(ch, meth, prop, body):
-                resp = {
-                    "msg": json.loads(body),
-                }
+            self._io.deliver_soon(main_loop_callback, ch, meth, prop, body)
 
-                return base.create_task(async_callback(resp), self.loop)
+        return thread_callback
 
-            return self.loop.call_soon_threadsafe(main_loop_callback, ch, meth, prop, body)
+    def _make_on_message(self, consumer, ack, raw, batch, early_ack, requeue_on_error):
+        '''
+        :returns: a function to call from the event loop thread with the
+            arguments of each pika message callback. A message that can't be
+            decoded is reported to the event loop's exception handler and
+            dropped, after rejecting it if the consumer acks its messages.
+        '''
+        deliver = self._make_deliver(consumer, ack, batch, early_ack, requeue_on_error)
+        make_resp = self._make_raw if raw else self._make_resp
 
-        return thread_callback
+        def on_message(ch, meth, prop, body):
+            try:
+                resp = make_resp(meth, prop, body)
+            except Exception as e:
+                self.loop.call_exception_handler({
+                    "message": "dropping message that couldn't be decoded",
+                    "exception": e,
+                })
+                if ack or early_ack:
+                    self._send_reject(meth.delivery_tag, False)
+                return
+
+            deliver(resp, meth.delivery_tag)
+
+        return on_message
+
+    def _make_deliver(self, consumer, ack=False, batch=False, early_ack=False, requeue_on_error=False):
+        '''
+        :returns: a function to call from the event loop thread with each
+            message dictionary for the consumer and its delivery tag. Messages
+            received while the consumer is saturated are held until a callback
+            finishes. If ``ack`` is True, each message is acked once its
+            callback finishes, or rejected if the callback raised, and requeued
+            if ``requeue_on_error`` is True. If ``early_ack`` is True, each message is acked
+            once its callback starts. If ``batch`` is True, the messages delivered
+            in one event loop iteration are passed to the callback as a list.
+        '''
+        if batch:
+            return self._make_batch_deliver(consumer, ack, early_ack, requeue_on_error)
+
+        waiting = deque()
+
+        def start_waiting():
+            while waiting and not consumer.saturated:
+                resp, delivery_tag = waiting.popleft()
+                task = consumer.run(resp)
+                if early_ack:
+                    self._acks.done(delivery_tag)
+                elif ack:
+                    task.add_done_callback(partial(self._settle, [delivery_tag], requeue_on_error))
+
+        consumer.add_resume_listener(start_waiting)
+
+        def deliver(resp, delivery_tag):
+            if ack or early_ack:
+                self._acks.track(delivery_tag)
+            waiting.append((resp, delivery_tag))
+            start_waiting()
+
+        return deliver
+
+    def _make_batch_deliver(self, consumer, ack, early_ack, requeue_on_error):
+        resps = []
+        delivery_tags = []
+        scheduled = False
+
+        def start_batch():
+            nonlocal resps, delivery_tags, scheduled
+            scheduled = False
+            if not resps or consumer.saturated:
+                return
+
+            task = consumer.run(resps)
+            if early_ack:
+                self._acks.done_many(delivery_tags)
+            elif ack:
+                task.add_done_callback(partial(self._settle, delivery_tags, requeue_on_error))
+            resps = []
+            delivery_tags = []
+
+        consumer.add_resume_listener(start_batch)
+
+        def deliver(resp, delivery_tag):
+            nonlocal scheduled
+            if ack or early_ack:
+                self._acks.track(delivery_tag)
+            resps.append(resp)
+            delivery_tags.append(delivery_tag)
+            if not scheduled:
+                scheduled = True
+                self.loop.call_soon(start_batch)
+
+        return deliver
+
+    def _settle(self, delivery_tags, requeue, task):
+        '''
+        Done callback of the task running the callback for messages in ack
+        mode. Acks the messages if the callback finished, otherwise rejects
+        them and reports the callback's exception.
+        '''
+        if not task.cancelled() and task.exception() is None:
+            self._acks.done_many(delivery_tags)
+            return
+
+        if not task.cancelled():
+            self.loop.call_exception_handler({
+                "message": "consumer callback raised, rejecting its messages",
+                "exception": task.exception(),
+                "task": task,
+            })
+        self._acks.reject(delivery_tags, requeue)
 
     @base.lock_channel
-    def _publish(self, *, exchange_name, msg, routing_key=''):
-        to_send_json = json.dumps(msg)
-        self._chan.basic_publish(exchange=exchange_name,
-                                 routing_key=routing_key,
-                                 properties=None,
-                                 body=to_send_json)
+    def _basic_ack(self, delivery_tag):
+        self._chan.basic_ack(delivery_tag=delivery_tag, multiple=True)
+
+    def _send_ack(self, delivery_tag):
+        self._io.submit(self._basic_ack, delivery_tag).add_done_callback(self._report_settle_error)
+
+    @base.lock_channel
+    def _basic_reject(self, delivery_tag, requeue):
+        self._chan.basic_reject(delivery_tag=delivery_tag, requeue=requeue)
+
+    def _send_reject(self, delivery_tag, requeue):
+        self._io.submit(self._basic_reject, delivery_tag, requeue).add_done_callback(self._report_settle_error)
+
+    def _report_settle_error(self, fut):
+        '''
+        Done callback of an ack or reject sent from the I/O thread. Errors are
+        reported to the event loop's exception handler, except those of acks
+        and rejects still queued when the connection closed, whose messages
+        the broker redelivers anyway.
+        '''
+        if fut.cancelled() or fut.exception() is None or self._io.closed.done():
+            return
+
+        self.loop.call_exception_handler({
+            "message": "failed to ack or reject a message",
+            "exception": fut.exception(),
+        })
+
+    def _make_resp(self, meth, prop, body):
+        return {
+            "msg": self._decode(body, prop.content_type, prop.content_encoding),
+            "routing_key": meth.routing_key,
+        }
+
+    def _make_raw(self, meth, prop, body):
+        return base.RawMessage(body=body,
+                               exchange=meth.exchange,
+                               routing_key=meth.routing_key,
+                               delivery_tag=meth.delivery_tag,
+                               content_type=prop.content_type,
+                               content_encoding=prop.content_encoding)
+
+    @base.lock_channel
+    def _enable_confirms(self, confirms):
+        def on_confirm(method_frame):
+            self.loop.call_soon_threadsafe(confirms.on_confirm, method_frame.method)
+
+        def on_close(channel, reply_code, reply_text):
+            self.loop.call_soon_threadsafe(confirms.fail, _close_error(reply_code, reply_text))
+
+        # BlockingChannel.confirm_delivery makes each basic_publish wait for
+        # its ack. Turning confirms on for the underlying channel instead lets
+        # acks arrive while the I/O thread processes events, so many
+        # publishes can be waiting on the broker at once.
+        internal_chan = self._chan._impl
+        internal_chan.add_on_close_callback(on_close)
+        internal_chan.confirm_delivery(callback=on_confirm)
+
+    async def enable_confirms(self, *, max_in_flight=1000):
+        '''
+        Put the channel in publisher confirm mode. Publishes then complete
+        once the broker acks the message, or raise :class:`PublishNacked`
+        if the broker nacks it.
+
+        Acks are waited on asynchronously, so up to ``max_in_flight``
+        messages can be waiting on the broker at once without a round trip
+        per message.
+
+        :param max_in_flight: the maximum number of published messages that
+            may wait for the broker's acknowledgement at once. Further publishes
+            wait until an acknowledgement arrives.
+        :type max_in_flight: int
+        '''
+        confirms = _PublisherConfirms(loop=self.loop, max_in_flight=max_in_flight)
+        await self._io.submit(self._enable_confirms, confirms)
+        self._confirms = confirms
+
+    @base.lock_channel
+    def _publish_many(self, *, exchange_name, messages):
+        for body, content_encoding, routing_key in messages:
+            self._chan.basic_publish(exchange=exchange_name,
+                                     routing_key=routing_key,
+                                     properties=self._properties[content_encoding],
+                                     body=body)
+
+    async def _send(self, exchange_name, messages):
+        await self._io.submit(self._publish_many, exchange_name=exchange_name,
+                              messages=messages)
+
+    async def _publish_all(self, exchange_name, messages):
+        '''
+        :returns: a list of futures that become done once the messages are
+            confirmed by the broker. If confirms aren't enabled, a single
+            future that is already done.
+        '''
+        # encode every message before any is sent, so that a message that
+        # can't be encoded fails the publish without taking a delivery tag
+        messages = [self._encode(msg) + (routing_key,) for msg, routing_key in messages]
+        if self._confirms is None:
+            await self._send(exchange_name, messages)
+            sent = self.loop.create_future()
+            sent.set_result(None)
+            return [sent]
+
+        confirmations = []
+        while messages:
+            # reserve returns without yielding once it hands out delivery
+            # tags, so messages are sent in the order their tags were given
+            reserved = await self._confirms.reserve(len(messages))
+            chunk, messages = messages[:len(reserved)], messages[len(reserved):]
+            try:
+                await self._send(exchange_name, chunk)
+            except Exception as e:
+                # part of the chunk may have reached the broker, so its
+                # delivery tags no longer line up with the ones handed out
+                self._confirms.fail(e)
+                raise
+
+            confirmations.extend(reserved)
+
+        return confirmations
 
-    async def publish(self, *, exchange_name, msg, routing_key=''):
+    async def publish(self, *, exchange_name, msg, routing_key='', wait=True):
         '''
         Publish a message on the channel.
 
         :param exchange_name: The name of the exchange to send the message to
         :param msg: The message to send
         :param routing_key: The routing key to associated the message with
+        :param wait: If True, wait until the message is sent or, in publisher
+            confirm mode, until the broker acks it. If False, return as soon as
+            the message is sent.
         :type exchange_name: str
         :type msg: str
         :type routing_key: str
+        :type wait: bool
+        :returns: None if ``wait`` is True, otherwise a confirmation future
+            that becomes done once the broker acks the message.
+            Awaiting on it raises :class:`PublishNacked` if the broker nacks it.
+        :raises PublishNacked: if ``wait`` is True and the broker nacks the message
         '''
-        loop = asyncio.get_event_loop()
-        func = partial(self._publish, exchange_name=exchange_name,
-                       msg=msg, routing_key=routing_key)
+        confirmation, = await self._publish_all(exchange_name, [(msg, routing_key)])
+        if not wait:
+            return confirmation
+
+        await confirmation
+
+    async def publish_many(self, *, exchange_name, messages, wait=True):
+        '''
+        Publish several messages on the channel with as few trips to the
+        broker as possible.
+
+        In publisher confirm mode, messages are sent as soon as the
+        ``max_in_flight`` window has room for them.
+
+        :param exchange_name: The name of the exchange to send the messages to
+        :param messages: The messages to send, as ``(msg, routing_key)`` pairs
+        :param wait: If True, wait until the messages are sent or, in publisher
+            confirm mode, until the broker acks them. If False, return as soon
+            as the messages are sent.
+        :type exchange_name: str
+        :type messages: iterable of (str, str)
+        :type wait: bool
+        :returns: None if ``wait`` is True, otherwise a confirmation future
+            that becomes done once the broker acks every message.
+        :raises PublishNacked: if ``wait`` is True and the broker nacks a message
+        '''
+        confirmations = await self._publish_all(exchange_name, list(messages))
+        confirmation = asyncio.gather(*confirmations)
+        if not wait:
+            return confirmation
+
+        await confirmation
+
+
+class _PublisherConfirms(object):
+    '''
+    Tracks the messages a channel in publisher confirm mode has sent
+    and that the broker is yet to ack or nack.
+
+    Delivery tags are handed out in the order messages are sent on the
+    channel, starting at 1, which is how the broker numbers them.
+    '''
+
+    def __init__(self, *, loop, max_in_flight):
+        self.loop = loop
+        self.max_in_flight = max_in_flight
+        self._next_tag = 1
+        self._unconfirmed = OrderedDict()
+        self._waiters = deque()
+        self._error = None
+
+    async def reserve(self, num_messages):
+        '''
+        Wait until the in flight window has room, then take delivery tags
+        for up to ``num_messages`` messages.
+
+        :returns: a list of futures, one per delivery tag taken, that become
+            done once the broker acks the message
+        :raises PublishNacked: through a future if the broker nacks the message
+        '''
+        while self._error is None and len(self._unconfirmed) >= self.max_in_flight:
+            waiter = self.loop.create_future()
+            self._waiters.append(waiter)
+            await waiter
+
+        if self._error is not None:
+            raise self._error
+
+        num_free = self.max_in_flight - len(self._unconfirmed)
+        reserved = []
+        for _ in range(min(num_messages, num_free)):
+            fut = self.loop.create_future()
+            self._unconfirmed[self._next_tag] = fut
+            self._next_tag += 1
+            reserved.append(fut)
+
+        return reserved
+
+    def on_confirm(self, method):
+        '''
+        Resolve the futures covered by a Basic.Ack or Basic.Nack from the broker
+
+        :param method: the ack or nack method
+        :type method: :class:`pika.spec.Basic.Ack`|:class:`pika.spec.Basic.Nack`
+        '''
+        if method.multiple:
+            tags = []
+            for tag in self._unconfirmed:
+                if tag > method.delivery_tag:
+                    break
+                tags.append(tag)
+        else:
+            tags = [method.delivery_tag]
+
+        nacked = isinstance(method, pika.spec.Basic.Nack)
+        for tag in tags:
+            fut = self._unconfirmed.pop(tag, None)
+            if fut is None:
+                continue
+
+            if nacked:
+                _set_exception(fut, base.PublishNacked(
+                    "broker nacked message with delivery tag {}".format(tag)))
+            else:
+                _set_result(fut, None)
+
+        num_free = self.max_in_flight - len(self._unconfirmed)
+        while self._waiters and num_free > 0:
+            _set_result(self._waiters.popleft(), None)
+            num_free -= 1
+
+    def fail(self, error):
+        '''
+        Fail every unconfirmed message and waiting publish, for example
+        because the channel has closed.
+        '''
+        self._error = error
+        for fut in self._unconfirmed.values():
+            _set_exception(fut, error)
+        self._unconfirmed.clear()
+
+        while self._waiters:
+            _set_result(self._waiters.popleft(), None)
+
+
+class _Acks(object):
+    '''
+    Tracks the messages a channel has received for consumers in ack
+    mode, and acks them once their callbacks finish.
+
+    Callbacks can finish in any order, but an ack with ``multiple=True``
+    covers every earlier delivery tag on the channel. So each ack is for the
+    newest message whose callback, and the callbacks of every earlier
+    tracked message, have finished. Finished callbacks are collected until
+    the next event loop iteration, so a burst of them leads to a single ack.
+
+    Messages whose callbacks raised are rejected one at a time, straight away,
+    and stop being tracked, so they don't hold back the acks of other messages.
+    '''
+
+    def __init__(self, *, loop, send_ack, send_reject):
+        '''
+        :param loop: event loop
+        :param send_ack: function to call with a delivery tag to ack it and
+            every earlier message on the channel
+        :param send_reject: function to call with a delivery tag and whether
+            to requeue the message, to reject that message alone
+        '''
+        self.loop = loop
+        self._send_ack = send_ack
+        self._send_reject = send_reject
+        self._unacked = OrderedDict()
+        self._flush_scheduled = False
+
+    def track(self, delivery_tag):
+        '''
+        Start tracking a received message
+        '''
+        self._unacked[delivery_tag] = False
+
+    def done(self, delivery_tag, task=None):
+        '''
+        Mark the callback of a message as finished. Can be used as a
+        done callback of the task running the callback.
+        '''
+        if delivery_tag not in self._unacked:
+            return
+
+        self._unacked[delivery_tag] = True
+        self._schedule_flush()
+
+    def done_many(self, delivery_tags, task=None):
+        '''
+        Mark the callback of several messages as finished. Can be used as a
+        done callback of the task running a batch callback.
+        '''
+        for delivery_tag in delivery_tags:
+            if delivery_tag in self._unacked:
+                self._unacked[delivery_tag] = True
+
+        self._schedule_flush()
+
+    def reject(self, delivery_tags, requeue=False):
+        '''
+        Reject messages whose callback raised
+        '''
+        for delivery_tag in delivery_tags:
+            if self._unacked.pop(delivery_tag, None) is not None:
+                self._send_reject(delivery_tag, requeue)
+
+        self._schedule_flush()
+
+    def _schedule_flush(self):
+        if not self._flush_scheduled:
+            self._flush_scheduled = True
+            self.loop.call_soon(self._flush)
+
+    def _flush(self):
+        self._flush_scheduled = False
+        last_done = None
+        while self._unacked:
+            delivery_tag, finished = next(iter(self._unacked.items()))
+            if not finished:
+                break
+
+            self._unacked.popitem(last=False)
+            last_done = delivery_tag
+
+        if last_done is not None:
+            self._send_ack(last_done)
+
+
+class RabbitMQAsyncioConnection(base.Connection):
+    '''
+    Implementation of a connection to a RabbitMQ broker that runs
+    on the event loop, using pika's asyncio adapter.
+
+    Unlike :class:`RabbitMQConnection`, no executor threads or locks are used.
+    Messages are sent and received as part of the event loop.
+    '''
+
+    async def connect(self):
+        '''
+        Connect to the RabbitMQ broker
+
+        :raises BrokerInternalError: if the connection can't be opened
+        '''
+        opened = self.loop.create_future()
+        self._closed = self.loop.create_future()
+
+        def on_open(conn):
+            _set_result(opened, None)
+
+        def on_open_error(conn, error=None):
+            _set_exception(opened, base.BrokerInternalError(str(error)))
+
+        def on_close(conn, reply_code=None, reply_text=""):
+            self.connected = False
+            _set_exception(opened, base.BrokerInternalError(reply_text))
+            _set_result(self._closed, None)
+
+        cp = pika.ConnectionParameters(host=self.host, port=self.port)
+        self._conn = AsyncioConnection(cp,
+                                       on_open_callback=on_open,
+                                       on_open_error_callback=on_open_error,
+                                       on_close_callback=on_close,
+                                       custom_ioloop=self.loop)
+        await opened
+        self.connected = True
+
+    async def create_channel(self, serializer=None, compression=None):
+        '''
+        create a channel for multiplexing the connection
+
+        :param serializer: the serializer for the channel, as a name or a
+            :class:`mooq.serializers.Serializer` object. A value of None uses
+            the connection's serializer.
+        :type serializer: str|:class:`mooq.serializers.Serializer`|None
+        :param compression: the compression for the channel, as a name or a
+            :class:`mooq.compression.Compressor` object. A value of None uses
+            the connection's compression.
+        :type compression: str|:class:`mooq.compression.Compressor`|None
+        :returns: a :class:`RabbitMQAsyncioChannel` object
+        '''
+        opened = self.loop.create_future()
+        self._conn.channel(on_open_callback=partial(_set_result, opened))
+        internal_chan = await opened
+
+        chan = RabbitMQAsyncioChannel(internal_chan=internal_chan, loop=self.loop,
+                                      serializer=serializer or self.serializer,
+                                      compression=compression or self.compressor)
+        self.channels.append(chan)
+        return chan
+
+    async def close(self):
+        '''
+        Close the connection to the broker
+        '''
+        if self.connected:
+            self._conn.close()
+
+        await self._closed
+
+    async def process_events(self, num_cycles=None):
+        '''
+        Wait while the event loop receives messages from the RabbitMQ broker
+        and schedules the associated callback coroutines.
+
+        :param num_cycles: the number of 0.1 second cycles to wait for. A value
+            of None will wait until the connection is closed.
+        :type num_cycles: int|None
+        '''
+        if num_cycles is None:
+            await asyncio.shield(self._closed)
+        else:
+            for _ in range(num_cycles):
+                await asyncio.sleep(0.1)
+
+
+class RabbitMQAsyncioChannel(RabbitMQChannel):
+    '''
+    Implementation of a RabbitMQ channel that runs on the event loop
+    '''
+
+    def __init__(self, **kwargs):
+        '''
+        :param internal_chan: the pika channel object to use
+        :param loop: the event loop
+        :param serializer: the serializer for published messages
+        :param compression: how to compress large messages
+        '''
+        super().__init__(**kwargs)
+        self._pending = set()
+        self._close_error = None
+        self._chan.add_on_close_callback(self._on_close)
+
+    def _on_close(self, channel, reply_code, reply_text):
+        self._close_error = _close_error(reply_code, reply_text)
+
+        for fut in list(self._pending):
+            _set_exception(fut, self._close_error)
+
+        if self._confirms is not None:
+            self._confirms.fail(self._close_error)
+
+    def _check_open(self):
+        if self._close_error is not None:
+            raise self._close_error
+
+    async def _rpc(self, method, **kwargs):
+        '''
+        Call a pika channel method and wait for the broker to reply
+
+        :param method: the pika channel method
+        :param kwargs: arguments for the method, not including the callback
+        :returns: the method frame of the reply
+        :raises BadExchange: if the broker closes the channel because an
+            exchange doesn't exist or was declared with another type
+        '''
+        self._check_open()
+        fut = self.loop.create_future()
+        self._pending.add(fut)
+        try:
+            method(callback=partial(_set_result, fut), **kwargs)
+            return await fut
+        finally:
+            self._pending.discard(fut)
+
+    async def register_producer(self, *, exchange_name, exchange_type):
+        '''
+        Register a producer on the channel by providing information to
+        the broker about the exchange the channel is going to use.
+
+        :param exchange_name: name of the exchange
+        :type exchange_name: str
+        :param exchange_type: Type of the exchange. Accepted values are "direct",
+            "topic" or "fanout"
+        :type exchange_type: str
+        :returns: None
+        '''
+        await self._rpc(self._chan.exchange_declare, exchange=exchange_name,
+                        exchange_type=exchange_type)
+
+    async def register_consumer(self, queue_name=None, routing_keys=[""], *, exchange_name, exchange_type,
+                                callback=None, max_concurrency=None, prefetch_count=None, prefetch_size=0,
+                                ack=False, requeue_on_error=False, raw=False, batch_callback=None,
+                                executor=None, ordered=False, order_key=None):
+        '''
+        Register a consumer on the RabbitMQ channel.
+
+        :param exchange_name: name of the exchange
+        :param exchange_type: Type of the exchange. Accepted values are "direct",
+            "topic" or "fanout"
+        :param queue_name: name of the queue. If None, a name will be given
+            automatically and the queue will be declared exclusive to the channel,
+            meaning it will be deleted once the channel is closed.
+        :param callback: The callback to run when a message is placed on the queue that
+            matches one of the routing keys
+        :param batch_callback: A callback to use instead of ``callback``, that is
+            run with a list of the messages received together. A batch holds the
+            messages received in one event loop iteration, which for
+            :class:`RabbitMQConnection` is one I/O thread cycle.
+        :param routing_keys: A list of keys to match against. A message will only be sent
+            to a consumer if its routing key matches one or more of the routing keys listed
+        :param max_concurrency: The maximum number of callbacks that may run at once.
+            While the limit is reached, received messages wait in the channel until a
+            callback finishes. A value of None means no limit. The broker is kept from
+            sending more messages than can wait by consuming in ack mode with a
+            ``prefetch_count`` of at most ``max_concurrency``. If ``ack`` is False,
+            each message is then acked as soon as its callback starts. A batch
+            consumer with ``max_concurrency`` must give a ``prefetch_count``.
+        :param prefetch_count: The maximum number of unacknowledged messages the
+            broker sends the consumer. Only applies if ``ack`` is True or
+            ``max_concurrency`` is given. A value of None means no limit.
+            The limit is the consumer's own, so consumers sharing a channel
+            may each have a different one.
+        :param prefetch_size: The maximum total size in bytes of unacknowledged
+            messages the broker sends the consumer. 0 means no limit.
+            RabbitMQ itself only supports 0.
+        :param ack: If True, each message is acknowledged once its callback finishes,
+            or rejected if the callback raised. Messages whose callbacks haven't
+            finished are redelivered if the channel closes. If False, the broker
+            considers messages acknowledged as soon as it sends them.
+        :param requeue_on_error: If True, a message whose callback raised is
+            requeued rather than rejected outright, which without a dead letter
+            exchange discards it. Only applies if ``ack`` is True.
+        :param raw: If True, the callback is passed a :class:`RawMessage` holding
+            the undecoded message body and its delivery details, instead of a
+            dictionary with the decoded message.
+        :param executor: If given, the callback is a plain function run in
+            this executor. See :meth:`mooq.base.Channel.register_consumer`.
+        :param ordered: If True, the callbacks of messages with the same key run
+            one at a time, in order, and messages with different keys in parallel.
+            See :meth:`mooq.base.Channel.register_consumer`.
+        :param order_key: the function giving the key of a message for ``ordered``.
+            A value of None uses the routing key.
+
+        :type exchange_name: str
+        :type exchange_type: str
+        :type queue_name: str|None
+        :type callback: coroutine
+        :type routing_keys: [str,]
+        :type max_concurrency: int|None
+        :type prefetch_count: int|None
+        :type prefetch_size: int
+        :type ack: bool
+        :type requeue_on_error: bool
+        :type raw: bool
+        :type batch_callback: coroutine
+        :type executor: :class:`concurrent.futures.Executor`|None
+        :type ordered: bool
+        :type order_key: function|None
+
+        Acks are sent with ``multiple=True``, at most once per event loop
+        iteration, for the newest message whose callback and the callbacks of
+        all earlier messages on the channel have finished. A slow callback
+        therefore holds back the acks of the messages received after it.
+        '''
+        callback, batch = base.pick_callback(callback, batch_callback)
+        key = base.pick_order_key(ordered, order_key, batch)
+        if executor is not None:
+            callback, raw, max_concurrency = self._offload(callback, executor, raw=raw, batch=batch,
+                                                           max_concurrency=max_concurrency)
+        prefetch_count, early_ack = _flow_control(max_concurrency, prefetch_count, ack, batch)
+        await self.register_producer(exchange_name=exchange_name,
+                                     exchange_type=exchange_type)
+
+        exclusive = False
+        if queue_name is None:
+            exclusive = True
+            method_frame = await self._rpc(self._chan.queue_declare, queue='', exclusive=True)
+            queue_name = method_frame.method.queue
+        else:
+            await self._rpc(self._chan.queue_declare, queue=queue_name)
+
+        for r in routing_keys:
+            await self._rpc(self._chan.queue_bind, exchange=exchange_name,
+                            queue=queue_name, routing_key=r)
+
+        qos = (prefetch_size, prefetch_count or 0)
+        if qos != self._qos:
+            await self._rpc(self._chan.basic_qos, prefetch_size=prefetch_size,
+                            prefetch_count=prefetch_count or 0, all_channels=False)
+            self._qos = qos
+
+        consumer = base.Consumer(callback, loop=self.loop, max_concurrency=max_concurrency, key=key)
+        self._chan.basic_consume(self._wrap_callback(consumer, ack, raw, batch, early_ack, requeue_on_error),
+                                 queue=queue_name,
+                                 no_ack=not (ack or early_ack),
+                                 exclusive=exclusive,
+                                 consumer_tag=None,
+                                 arguments=None)
+
+    def _wrap_callback(self, consumer, ack=False, raw=False, batch=False, early_ack=False,
+                       requeue_on_error=False):
+        '''
+        Turn a pika callback into a coroutine with simplified arguments.
+        '''
+        return self._make_on_message(consumer, ack, raw, batch, early_ack, requeue_on_error)
+
+    def _send_ack(self, delivery_tag):
+        if self._close_error is None:
+            self._chan.basic_ack(delivery_tag=delivery_tag, multiple=True)
+
+    def _send_reject(self, delivery_tag, requeue):
+        if self._close_error is None:
+            self._chan.basic_reject(delivery_tag=delivery_tag, requeue=requeue)
+
+    async def enable_confirms(self, *, max_in_flight=1000):
+        '''
+        Put the channel in publisher confirm mode. Publishes then complete
+        once the broker acks the message, or raise :class:`PublishNacked`
+        if the broker nacks it.
+
+        :param max_in_flight: the maximum number of published messages that
+            may wait for the broker's acknowledgement at once. Further publishes
+            wait until an acknowledgement arrives.
+        :type max_in_flight: int
+        '''
+        self._check_open()
+        confirms = _PublisherConfirms(loop=self.loop, max_in_flight=max_in_flight)
+        self._chan.confirm_delivery(callback=lambda method_frame: confirms.on_confirm(method_frame.method))
+        self._confirms = confirms
+
+    async def _send(self, exchange_name, messages):
+        self._check_open()
+        for body, content_encoding, routing_key in messages:
+            self._chan.basic_publish(exchange=exchange_name,
+                                     routing_key=routing_key,
+                                     properties=self._properties[content_encoding],
+                                     body=body)
+
+
+def _flow_control(max_concurrency, prefetch_count, ack, batch):
+    '''
+    RabbitMQ keeps sending a consumer messages until it reaches its prefetch
+    limit on unacknowledged messages. So that the messages of a saturated
+    consumer don't pile up in the channel, a consumer with ``max_concurrency``
+    is given a prefetch limit and consumes in ack mode. If ``ack`` is False,
+    each message is then acked as soon as its callback starts.
+
+    :returns: a two element tuple of the prefetch count to set and whether
+        messages are acked when their callbacks start
+    :raises ValueError: if a batch consumer has ``max_concurrency`` but no
+        ``prefetch_count``, since the size of its batches is unknown
+    '''
+    if max_concurrency is None:
+        return prefetch_count, False
+
+    if batch:
+        if prefetch_count is None:
+            raise ValueError("a batch consumer with max_concurrency needs a prefetch_count")
+    elif prefetch_count is None or prefetch_count > max_concurrency:
+        prefetch_count = max_concurrency
+
+    return prefetch_count, not ack
+
+
+def _close_error(reply_code, reply_text):
+    if reply_code in (404, 406):
+        return base.BadExchange(reply_text)
+
+    return base.BrokerInternalError(reply_text)
+
+
+def _resolve_all(done):
+    for fut, result, e in done:
+        if e is None:
+            _set_result(fut, result)
+        else:
+            _set_exception(fut, e)
+
+
+def _do_nothing():
+    pass
+
+
+def _set_result(fut, result):
+    if not fut.done():
+        fut.set_result(result)
+
 
-        await loop.run_in_executor(None, func)
+def _set_exception(fut, e):
+    if not fut.done():
+        fut.set_exception(e)
@@ -0,0 +1,199 @@
+'''
+Serializers turn messages into bytes for publishing and back again when consuming.
+
+A serializer is selected per connection or per channel, either by name
+(``"json"``, ``"raw"``, ``"pickle"``, ``"msgpack"`` or ``"orjson"``) or by
+passing a :class:`Serializer` object. ``"msgpack"`` and ``"orjson"`` are only
+available if the msgpack and orjson packages are installed.
+
+The serializer's content type is recorded with each message, so a consumer
+decodes messages with the serializer they were encoded with, whatever its
+own serializer is.
+
+'''
+
+import json
+import pickle
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class Serializer(object):
+    '''
+    Base class for a serializer. Not to be used directly.
+    '''
+
+    #: the name used to select the serializer
+    name = None
+
+    #: the content type recorded with each message
+    content_type = None
+
+    #: whether a consumer may pick this serializer from the content type
+    #: of a received message. If False, messages with this content type
+    #: are only decoded by channels that use this serializer themselves.
+    auto_decode = True
+
+    def encode(self, msg):
+        '''
+        :param msg: the message to encode
+        :returns: the encoded message
+        :rtype: bytes
+        '''
+        raise NotImplementedError
+
+    def decode(self, body):
+        '''
+        :param body: an encoded message
+        :type body: bytes
+        :returns: the decoded message
+        '''
+        raise NotImplementedError
+
+
+class JSONSerializer(Serializer):
+    '''
+    Encodes messages with the standard library's json module
+    '''
+    name = "json"
+    content_type = "application/json"
+
+    def encode(self, msg):
+        return json.dumps(msg).encode("utf-8")
+
+    def decode(self, body):
+        return json.loads(body)
+
+
+class RawSerializer(Serializer):
+    '''
+    Passes bytes through untouched. Messages must be bytes-like.
+    '''
+    name = "raw"
+    content_type = "application/octet-stream"
+
+    def encode(self, msg):
+        if isinstance(msg, bytes):
+            return msg
+
+        if isinstance(msg, (bytearray, memoryview)):
+            return bytes(msg)
+
+        raise TypeError("raw serializer needs a bytes-like message, not {}".format(type(msg).__name__))
+
+    def decode(self, body):
+        return body
+
+
+class PickleSerializer(Serializer):
+    '''
+    Encodes messages with the pickle module.
+
+    Unpickling can run arbitrary code, so messages are only decoded by
+    channels that use this serializer themselves.
+    '''
+    name = "pickle"
+    content_type = "application/x-python-serialize"
+    auto_decode = False
+
+    def encode(self, msg):
+        return pickle.dumps(msg, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def decode(self, body):
+        return pickle.loads(body)
+
+
+class MsgpackSerializer(Serializer):
+    '''
+    Encodes messages with msgpack. Requires the msgpack package.
+    '''
+    name = "msgpack"
+    content_type = "application/msgpack"
+
+    def encode(self, msg):
+        return msgpack.packb(msg, use_bin_type=True)
+
+    def decode(self, body):
+        return msgpack.unpackb(body, raw=False)
+
+
+class OrjsonSerializer(Serializer):
+    '''
+    Encodes messages as JSON with orjson. Requires the orjson package.
+    '''
+    name = "orjson"
+    content_type = "application/json"
+
+    def encode(self, msg):
+        return orjson.dumps(msg)
+
+    def decode(self, body):
+        return orjson.loads(body)
+
+
+_by_name = {}
+_by_content_type = {}
+
+
+def register(serializer):
+    '''
+    Make a serializer selectable by name, and available for decoding
+    received messages with its content type.
+
+    :param serializer: the serializer to register
+    :type serializer: :class:`Serializer`
+    '''
+    _by_name[serializer.name] = serializer
+    if serializer.auto_decode:
+        _by_content_type.setdefault(serializer.content_type, serializer)
+
+
+def get(serializer):
+    '''
+    :param serializer: the name of a registered serializer, or a serializer object
+    :type serializer: str|:class:`Serializer`
+    :returns: a :class:`Serializer` object
+    :raises ValueError: if no serializer is registered with the name
+    '''
+    if isinstance(serializer, Serializer):
+        return serializer
+
+    try:
+        return _by_name[serializer]
+    except KeyError:
+        raise ValueError("unknown serializer {!r}. Is the package it needs installed?".format(serializer))
+
+
+def for_content_type(content_type, default):
+    '''
+    :param content_type: the content type of a received message, or None
+    :param default: the serializer of the receiving channel
+    :type content_type: str|None
+    :type default: :class:`Serializer`
+    :returns: the serializer to decode the message with. This is ``default``
+        unless the message has a different content type that a registered
+        serializer can decode.
+    '''
+    if content_type is None or content_type == default.content_type:
+        return default
+
+    return _by_content_type.get(content_type, default)
+
+
+register(JSONSerializer())
+register(RawSerializer())
+register(PickleSerializer())
+
+if msgpack is not None:
+    register(MsgpackSerializer())
+
+if orjson is not None:
+    register(OrjsonSerializer())
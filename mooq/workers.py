@@ -0,0 +1,382 @@
+'''
+Consume a queue from several worker processes, so that CPU heavy
+callbacks aren't limited to one event loop and one GIL.
+
+Each worker opens its own connection and registers a consumer on the same
+named queue, and the broker shares the messages between them. The in memory
+broker can't be reached from other processes, so for ``broker="in_memory"``
+the supervisor consumes the queue itself and hands the messages to the
+workers through a multiprocessing queue, which lets the pool be tested
+without RabbitMQ. Each worker has its own queue, which only holds as many
+messages as the worker can run at once, so the supervisor doesn't take
+messages faster than the workers handle them.
+
+'''
+
+import asyncio
+import multiprocessing
+import os
+import queue
+import time
+from collections import namedtuple
+
+from . import base, serializers
+from .connect import connect
+
+
+#: Throughput of a worker process, as returned by :meth:`WorkerPool.stats`.
+#: ``processed`` and ``failed`` count the callbacks that finished and raised
+#: since the process started, and ``rate`` is the average number of messages
+#: processed per second. ``restarts`` counts the times the supervisor has
+#: replaced the worker after its process died.
+WorkerStats = namedtuple("WorkerStats", ["worker_id", "pid", "processed", "failed", "rate",
+                                         "alive", "restarts"])
+
+
+class WorkerPool(object):
+    '''
+    Supervisor for worker processes consuming the same queue. Workers whose
+    process dies are restarted.
+    '''
+
+    def __init__(self, callback, *, num_workers, queue_name, exchange_name, exchange_type, routing_keys=[""],
+                 host="localhost", port=5672, broker="rabbit", transport="blocking", serializer="json",
+                 compression=None, consumer_options=None, stats_interval=1.0, mp_context=None):
+        '''
+        :param callback: The callback each worker runs for a message. It must be
+            a module level coroutine function so that it can be passed to the
+            worker processes.
+        :param num_workers: the number of worker processes
+        :param queue_name: name of the queue the workers share
+        :param consumer_options: other keyword arguments for
+            :meth:`mooq.base.Channel.register_consumer`, such as
+            ``max_concurrency`` or ``ack``, which apply to each worker. Only
+            ``max_concurrency`` and ``raw`` are used with the in memory broker.
+        :param stats_interval: how often, in seconds, workers report their
+            stats and the supervisor checks on them
+        :param mp_context: the multiprocessing start method, such as "spawn".
+            A value of None uses the platform's default.
+        :type callback: coroutine
+        :type num_workers: int
+        :type queue_name: str
+        :type consumer_options: dict|None
+        :type stats_interval: float
+        :type mp_context: str|None
+
+        See :func:`mooq.connect` and :meth:`mooq.base.Channel.register_consumer`
+        for the other parameters.
+
+        .. note:: must call :meth:`start` to actually start the workers
+        '''
+        if num_workers < 1:
+            raise ValueError("num_workers must be at least 1")
+
+        self.num_workers = num_workers
+        self.stats_interval = stats_interval
+        self.loop = asyncio.get_event_loop()
+        self._ctx = multiprocessing.get_context(mp_context)
+        self._spec = {
+            "callback": callback,
+            "queue_name": queue_name,
+            "exchange_name": exchange_name,
+            "exchange_type": exchange_type,
+            "routing_keys": routing_keys,
+            "connect": dict(host=host, port=port, broker=broker, transport=transport,
+                            serializer=serializer, compression=compression),
+            "consumer_options": consumer_options or {},
+            "stats_interval": stats_interval,
+        }
+        self._procs = {}
+        self._restarts = {}
+        self._reports = {}
+        self._stop = None
+        self._stats_q = None
+        self._inboxes = None
+        self._inbox_size = None
+        self._next_inbox = 0
+        self._outbox = None
+        self._conn = None
+        self._events = None
+        self._feeder = None
+        self._supervisor = None
+        self._closing = False
+
+    async def start(self):
+        '''
+        Start the worker processes
+        '''
+        self._stop = self._ctx.Event()
+        self._stats_q = self._ctx.Queue()
+        if self._spec["connect"]["broker"] == "in_memory":
+            await self._start_forwarding()
+
+        for worker_id in range(self.num_workers):
+            self._restarts[worker_id] = 0
+            self._spawn(worker_id)
+
+        if self._inboxes is not None:
+            self._feeder = base.start_task(self._feed_inbox(), self.loop)
+        self._supervisor = base.start_task(self._supervise(), self.loop)
+
+    def stats(self):
+        '''
+        :returns: the latest stats reported by each worker
+        :rtype: list of :data:`WorkerStats`
+        '''
+        self._collect_reports()
+        out = []
+        for worker_id, proc in sorted(self._procs.items()):
+            processed, failed, elapsed = self._reports.get(worker_id, (0, 0, 0))
+            out.append(WorkerStats(worker_id=worker_id, pid=proc.pid, processed=processed, failed=failed,
+                                   rate=processed / elapsed if elapsed else 0.0,
+                                   alive=proc.is_alive(), restarts=self._restarts[worker_id]))
+
+        return out
+
+    async def close(self, timeout=5):
+        '''
+        Stop the workers, letting them finish the messages they have taken.
+
+        :param timeout: how long, in seconds, to wait for each worker to
+            finish before it is terminated
+        :type timeout: float
+        '''
+        self._closing = True
+        if self._supervisor is not None:
+            self._supervisor.cancel()
+        if self._events is not None:
+            self._events.cancel()
+        if self._conn is not None:
+            await self._conn.close()
+        if self._feeder is not None:
+            self._feeder.cancel()
+            while not self._outbox.empty():
+                _, forwarded = self._outbox.get_nowait()
+                _set_result(forwarded, None)
+
+        if self._stop is not None:
+            self._stop.set()
+        if self._inboxes is not None:
+            await self.loop.run_in_executor(None, self._put_sentinels, timeout)
+
+        await self.loop.run_in_executor(None, self._join, timeout)
+        self._collect_reports()
+
+    async def _start_forwarding(self):
+        # each inbox holds as many messages as its worker can run at once,
+        # and the forwarding consumer stops taking messages while they are full
+        spec = self._spec
+        self._inbox_size = spec["consumer_options"].get("max_concurrency") or 1
+        max_in_flight = self.num_workers * self._inbox_size
+        self._inboxes = {}
+        self._outbox = asyncio.Queue()
+        self._conn = await connect(**spec["connect"])
+        chan = await self._conn.create_channel()
+        await chan.register_consumer(spec["queue_name"], spec["routing_keys"],
+                                     exchange_name=spec["exchange_name"],
+                                     exchange_type=spec["exchange_type"],
+                                     callback=self._forward, raw=True,
+                                     max_concurrency=max_in_flight)
+        self._events = base.start_task(self._conn.process_events(), self.loop)
+
+    async def _forward(self, raw):
+        # the callback only finishes once the message is in an inbox, which
+        # keeps the forwarding consumer from taking more messages meanwhile
+        forwarded = self.loop.create_future()
+        self._outbox.put_nowait((raw, forwarded))
+        await forwarded
+
+    async def _feed_inbox(self):
+        # a single executor thread waits for room in the inboxes, however
+        # many messages are being forwarded
+        while True:
+            raw, forwarded = await self._outbox.get()
+            try:
+                await self.loop.run_in_executor(None, self._put_in_inbox, raw)
+            finally:
+                _set_result(forwarded, None)
+
+    def _put_in_inbox(self, raw):
+        # offers the message to each worker in turn until one has room.
+        # Gives up once the pool is closing, as the workers may have
+        # stopped taking messages
+        while not self._closing:
+            inboxes = list(self._inboxes.values())
+            for _ in inboxes:
+                inbox = inboxes[self._next_inbox % len(inboxes)]
+                self._next_inbox += 1
+                try:
+                    inbox.put_nowait(raw)
+                    return
+                except queue.Full:
+                    pass
+
+            time.sleep(0.01)
+
+    def _put_sentinels(self, timeout):
+        for inbox in self._inboxes.values():
+            try:
+                inbox.put(None, timeout=timeout)
+            except queue.Full:
+                # the worker died without taking its sentinel. _join
+                # terminates the workers that are left
+                pass
+
+    def _spawn(self, worker_id):
+        inbox = None
+        if self._inboxes is not None:
+            # a worker killed while reading its inbox leaves the inbox's
+            # read lock held, so a restarted worker gets a new inbox
+            dead = self._inboxes.get(worker_id)
+            if dead is not None:
+                dead.cancel_join_thread()
+            inbox = self._inboxes[worker_id] = self._ctx.Queue(maxsize=self._inbox_size)
+
+        proc = self._ctx.Process(target=_run_worker,
+                                 args=(self._spec, worker_id, self._stop, self._stats_q, inbox),
+                                 daemon=True)
+        proc.start()
+        self._procs[worker_id] = proc
+
+    async def _supervise(self):
+        while True:
+            await asyncio.sleep(self.stats_interval)
+            self._collect_reports()
+            for worker_id, proc in list(self._procs.items()):
+                if not proc.is_alive() and not self._closing:
+                    self._restarts[worker_id] += 1
+                    self._reports.pop(worker_id, None)
+                    self._spawn(worker_id)
+
+    def _collect_reports(self):
+        if self._stats_q is None:
+            return
+
+        while True:
+            try:
+                worker_id, pid, processed, failed, elapsed = self._stats_q.get_nowait()
+            except queue.Empty:
+                return
+
+            # ignore late reports from a process that has been replaced
+            if self._procs[worker_id].pid == pid:
+                self._reports[worker_id] = (processed, failed, elapsed)
+
+    def _join(self, timeout):
+        for proc in self._procs.values():
+            proc.join(timeout)
+            if proc.is_alive():
+                proc.terminate()
+                proc.join()
+
+
+def _set_result(fut, result):
+    if not fut.done():
+        fut.set_result(result)
+
+
+def _run_worker(spec, worker_id, stop, stats_q, inbox):
+    '''
+    Entry point of a worker process
+    '''
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        loop.run_until_complete(_Worker(spec, worker_id, stop, stats_q, inbox, loop).run())
+    finally:
+        loop.close()
+
+
+class _Worker(object):
+    '''
+    Runs the callback for messages in a worker process and reports stats
+    '''
+    def __init__(self, spec, worker_id, stop, stats_q, inbox, loop):
+        self.spec = spec
+        self.worker_id = worker_id
+        self.stop = stop
+        self.stats_q = stats_q
+        self.inbox = inbox
+        self.loop = loop
+        self.callback = spec["callback"]
+        self.processed = 0
+        self.failed = 0
+        self.started = None
+        self._in_flight = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+    async def run(self):
+        self.started = time.monotonic()
+        reporter = base.start_task(self._report_periodically(), self.loop)
+        try:
+            if self.inbox is None:
+                await self._consume_broker()
+            else:
+                await self._consume_inbox()
+
+            await self._idle.wait()
+        finally:
+            reporter.cancel()
+            self._report()
+
+    async def _consume_broker(self):
+        spec = self.spec
+        conn = await connect(**spec["connect"])
+        chan = await conn.create_channel()
+        await chan.register_consumer(spec["queue_name"], spec["routing_keys"],
+                                     exchange_name=spec["exchange_name"],
+                                     exchange_type=spec["exchange_type"],
+                                     callback=self._run_callback, **spec["consumer_options"])
+        events = base.start_task(conn.process_events(), self.loop)
+        await self.loop.run_in_executor(None, self.stop.wait)
+        # let the callbacks in flight finish, so their acks are sent
+        await self._idle.wait()
+        events.cancel()
+        await conn.close()
+
+    async def _consume_inbox(self):
+        options = self.spec["consumer_options"]
+        serializer = serializers.get(self.spec["connect"]["serializer"])
+        consumer = base.Consumer(self._run_callback, loop=self.loop,
+                                 max_concurrency=options.get("max_concurrency"))
+        resumed = asyncio.Event()
+        consumer.add_resume_listener(resumed.set)
+
+        while True:
+            if consumer.saturated:
+                resumed.clear()
+                await resumed.wait()
+
+            raw = await self.loop.run_in_executor(None, self.inbox.get)
+            if raw is None:
+                return
+
+            if options.get("raw"):
+                consumer.run(raw)
+            else:
+                consumer.run(base.resp_from_raw(raw, serializer))
+
+    async def _run_callback(self, resp):
+        self._in_flight += 1
+        self._idle.clear()
+        try:
+            await self.callback(resp)
+        except Exception:
+            self.failed += 1
+            raise
+        else:
+            self.processed += 1
+        finally:
+            self._in_flight -= 1
+            if self._in_flight == 0:
+                self._idle.set()
+
+    async def _report_periodically(self):
+        while True:
+            await asyncio.sleep(self.spec["stats_interval"])
+            self._report()
+
+    def _report(self):
+        self.stats_q.put((self.worker_id, os.getpid(), self.processed, self.failed,
+                          time.monotonic() - self.started))
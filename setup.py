@@ -24,8 +24,14 @@ setup(
     long_description='\n\n'.join((read('README.rst'), read('CHANGELOG.rst'))),
     include_package_data=True,
     install_requires=[
-        'pika',
+        'pika>=0.12,<1.0',
     ],
+    extras_require={
+        'msgpack': ['msgpack'],
+        'orjson': ['orjson'],
+        'lz4': ['lz4'],
+        'zstd': ['zstandard'],
+    },
     zip_safe=False,
     author="Jeremy Arr",
     author_email="jeremyarr@gmail.com",
@@ -21,8 +21,8 @@ class TransportTestCase(unittest.TestCase):
     async def async_tearDown(self):
         pass
 
-    async def GIVEN_InMemoryBrokerStarted(self,host,port):
-        self.broker = mooq.InMemoryBroker(host=host,port=port)
+    async def GIVEN_InMemoryBrokerStarted(self,host,port,**kwargs):
+        self.broker = mooq.InMemoryBroker(host=host,port=port,**kwargs)
         _, launched = self.create_task(self.broker.run())
         await launched
 
@@ -40,13 +40,14 @@ class TransportTestCase(unittest.TestCase):
             loop.close()
         
 
-    async def GIVEN_ConnectionResourceCreated(self,host,port,broker_type):
+    async def GIVEN_ConnectionResourceCreated(self,host,port,broker_type,**kwargs):
         self.conn = await mooq.connect(broker=broker_type,
                                         host=host,
-                                        port=port)
+                                        port=port,
+                                        **kwargs)
 
-    async def GIVEN_ChannelResourceCreated(self):
-        self.chan = await self.conn.create_channel()
+    async def GIVEN_ChannelResourceCreated(self,**kwargs):
+        self.chan = await self.conn.create_channel(**kwargs)
 
     async def GIVEN_ProducerRegistered(self,*,exchange_name,exchange_type):
         await self.chan.register_producer(exchange_name=exchange_name,
@@ -68,13 +69,14 @@ class TransportTestCase(unittest.TestCase):
 
 
     async def GIVEN_ConsumerRegistered(self,*,queue_name,exchange_name,exchange_type,
-                                 routing_keys,callback):
+                                 routing_keys,callback,**kwargs):
 
         await self.chan.register_consumer( queue_name=queue_name,
                                 exchange_name=exchange_name,
                                 exchange_type=exchange_type,
                                 routing_keys=routing_keys,
-                                callback = callback)
+                                callback = callback,
+                                **kwargs)
         #wait for broker to receive messages
         await asyncio.sleep(0.005)
 
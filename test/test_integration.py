@@ -42,6 +42,70 @@ class RabbitMQDirectProduceConsumeTest(common.TransportTestCase):
 
         self.THEN_CallbackReceivesMessage("fake_message")
 
+    # @unittest.skip("skipped")
+    @asyncio_test
+    async def test_publish_many_runs_callback(self):
+        await self.GIVEN_ProducerRegistered(exchange_name="fake_direct_exch",
+                                      exchange_type="direct")
+
+        await self.GIVEN_ConsumerRegistered(queue_name="fake_direct_consumer_queue",
+                                      exchange_name="fake_direct_exch",
+                                      exchange_type="direct",
+                                      routing_keys=["fake_routing_key"],
+                                      callback = self.fake_callback)
+
+        await self.chan.publish_many(exchange_name="fake_direct_exch",
+                                     messages=[("fake_message","another_routing_key"),
+                                               ("fake_message","fake_routing_key")])
+
+        await self.WHEN_ProcessEventsOnce()
+
+        self.THEN_CallbackReceivesMessage("fake_message")
+
+    # @unittest.skip("skipped")
+    @asyncio_test
+    async def test_confirmed_publish_runs_callback(self):
+        await self.GIVEN_ProducerRegistered(exchange_name="fake_direct_exch",
+                                      exchange_type="direct")
+
+        await self.GIVEN_ConsumerRegistered(queue_name="fake_direct_consumer_queue",
+                                      exchange_name="fake_direct_exch",
+                                      exchange_type="direct",
+                                      routing_keys=["fake_routing_key"],
+                                      callback = self.fake_callback)
+
+        await self.chan.enable_confirms(max_in_flight=2)
+        confirmation = await self.chan.publish_many(exchange_name="fake_direct_exch",
+                                                    messages=[("fake_message","fake_routing_key")]*5,
+                                                    wait=False)
+        await asyncio.wait_for(confirmation,timeout=5)
+
+        await self.WHEN_ProcessEventsOnce()
+
+        self.THEN_CallbackReceivesMessage("fake_message")
+
+    # @unittest.skip("skipped")
+    @asyncio_test
+    async def test_ack_mode_runs_callback(self):
+        await self.GIVEN_ProducerRegistered(exchange_name="fake_direct_exch",
+                                      exchange_type="direct")
+
+        await self.GIVEN_ConsumerRegistered(queue_name="fake_direct_consumer_queue",
+                                      exchange_name="fake_direct_exch",
+                                      exchange_type="direct",
+                                      routing_keys=["fake_routing_key"],
+                                      callback = self.fake_callback,
+                                      prefetch_count=10,
+                                      ack=True)
+
+        await self.GIVEN_MessagePublished(exchange_name="fake_direct_exch",
+                                    msg="fake_message",
+                                    routing_key="fake_routing_key")
+
+        await self.WHEN_ProcessEventsOnce()
+
+        self.THEN_CallbackReceivesMessage("fake_message")
+
     # @unittest.skip("skipped")
     @asyncio_test
     async def test_topic_runs_callback(self):
@@ -91,6 +155,29 @@ class RabbitMQDirectProduceConsumeTest(common.TransportTestCase):
 
 
 
+# @unittest.skip("skipped")
+class RabbitMQAsyncioDirectProduceConsumeTest(RabbitMQDirectProduceConsumeTest):
+    async def async_setUp(self):
+        await self.GIVEN_ConnectionResourceCreated("localhost",5672,"rabbit",
+                                                   transport="asyncio")
+        await self.GIVEN_ChannelResourceCreated()
+
+    async def async_tearDown(self):
+        await self.conn.close()
+
+    # @unittest.skip("skipped")
+    @asyncio_test
+    async def test_bad_exchange(self):
+        await self.GIVEN_ProducerRegistered(exchange_name="fake_bad_exch",
+                                      exchange_type="direct")
+
+        with self.assertRaises(mooq.BadExchange):
+            await self.WHEN_ProducerRegistered(exchange_name="fake_bad_exch",
+                                               exchange_type="fanout")
+
+
+
+
 
 if __name__ == '__main__':
     unittest.main(
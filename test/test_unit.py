@@ -1,11 +1,17 @@
 # import unittest
 import unittest
-from unittest.mock import Mock, MagicMock
+from unittest.mock import Mock, MagicMock, patch
 import os
 import sys
 import asyncio
+import json
+import time
+import threading
+import concurrent.futures
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 
 import xmlrunner
+import pika
 
 
 from test import common
@@ -49,6 +55,49 @@ class InMemoryDirectProduceConsumeTest(common.TransportTestCase):
 
 
 
+    # @unittest.skip("skipped")
+    @asyncio_test
+    async def test_publish_nowait(self):
+        fake_callback = AsyncMock()
+        await self.GIVEN_ConsumerRegistered(queue_name="fake_consumer_queue",
+                                      exchange_name="fake_exch",
+                                      exchange_type="direct",
+                                      routing_keys=["fake_routing_key"],
+                                      callback = fake_callback)
+
+        confirmations = []
+        for _ in range(3):
+            c = await self.chan.publish(exchange_name="fake_exch",
+                                        msg="fake_message",
+                                        routing_key="fake_routing_key",
+                                        wait=False)
+            confirmations.append(c)
+
+        await asyncio.gather(*confirmations)
+        await self.WHEN_ProcessEventsNTimes(3)
+
+        self.THEN_CallbackIsRun(fake_callback,num_times=3)
+
+    # @unittest.skip("skipped")
+    @asyncio_test
+    async def test_publish_many(self):
+        fake_callback = AsyncMock()
+        await self.GIVEN_ConsumerRegistered(queue_name="fake_consumer_queue",
+                                      exchange_name="fake_exch",
+                                      exchange_type="direct",
+                                      routing_keys=["fake_routing_key"],
+                                      callback = fake_callback)
+
+        await self.chan.publish_many(exchange_name="fake_exch",
+                                     messages=[("fake_message1","fake_routing_key"),
+                                               ("fake_message2","another_routing_key"),
+                                               ("fake_message3","fake_routing_key")])
+        await self.WHEN_ProcessEventsOnce()
+
+        self.THEN_CallbackIsRun(fake_callback,num_times=2)
+        self.assertEqual(["fake_message1","fake_message3"],
+                         [c[0][0]["msg"] for c in fake_callback.mock.call_args_list])
+
     # @unittest.skip("skipped")
     @asyncio_test
     async def test_callback_is_not_run_if_routing_key_mismatch(self):
@@ -86,6 +135,24 @@ class InMemoryDirectProduceConsumeTest(common.TransportTestCase):
         self.THEN_CallbackReceivesMessage("fake_message")
 
 
+    # @unittest.skip("skipped")
+    @asyncio_test
+    async def test_callback_run_once_if_routing_key_bound_twice(self):
+        fake_callback = AsyncMock()
+        await self.GIVEN_ConsumerRegistered(queue_name="fake_consumer_queue",
+                                      exchange_name="fake_exch",
+                                      exchange_type="direct",
+                                      routing_keys=["fake_routing_key","fake_routing_key"],
+                                      callback = fake_callback)
+
+        await self.GIVEN_MessagePublished(exchange_name="fake_exch",
+                                        msg="fake_message",
+                                        routing_key="fake_routing_key")
+
+        await self.WHEN_ProcessEventsNTimes(3)
+
+        self.THEN_CallbackIsRun(fake_callback,num_times=1)
+
     # @unittest.skip("skipped")
     @asyncio_test
     async def test_callback_run_if_two_exclusive_queues_registered(self):
@@ -214,6 +281,52 @@ class InMemoryTopicBallColourTest(TopicTestCase):
         await self.GWT_BallColour(routing_key=routing_key,callback_run=False)
 
 
+# @unittest.skip("skipped") 
+class InMemoryTopicHashWildcardTest(InMemoryTopicBallColourTest):
+    async def async_setUp(self):
+        await TopicTestCase.async_setUp(self)
+        await self.GIVEN_ConsumerRegistered(queue_name="fake_consumer_queue",
+                                      exchange_name="fake_exch",
+                                      exchange_type="topic",
+                                      routing_keys=["ball.#.red","apple"],
+                                      callback = self.fake_callback)
+
+    # @unittest.skip("skipped")
+    @asyncio_test
+    async def test_ball_red(self):
+        await self.GWT_BallColour_RunsCallback("ball.red")
+
+    # @unittest.skip("skipped")
+    @asyncio_test
+    async def test_ball_big_shiny_red(self):
+        await self.GWT_BallColour_RunsCallback("ball.big.shiny.red")
+
+    # @unittest.skip("skipped")
+    @asyncio_test
+    async def test_ball_red_big(self):
+        await self.GWT_BallColour_DoesntRunCallback("ball.red.big")
+
+    # @unittest.skip("skipped")
+    @asyncio_test
+    async def test_apple_is_anchored(self):
+        await self.GWT_BallColour_DoesntRunCallback("apples")
+
+    # @unittest.skip("skipped")
+    @asyncio_test
+    async def test_ball_yellow(self):
+        await self.GWT_BallColour_DoesntRunCallback("ball.yellow")
+
+    # @unittest.skip("skipped")
+    @asyncio_test
+    async def test_apple_red(self):
+        await self.GWT_BallColour_DoesntRunCallback("apple.red")
+
+    # @unittest.skip("skipped")
+    @asyncio_test
+    async def test_apple(self):
+        await self.GWT_BallColour_RunsCallback("apple")
+
+
 # @unittest.skip("skipped") 
 class InMemoryTopicAllWildcardsTest(TopicTestCase):
     async def async_setUp(self):
@@ -253,14 +366,30 @@ class InMemoryTopicRunTwiceTest(TopicTestCase):
 
     # @unittest.skip("skipped")
     @asyncio_test
-    async def test_runs_callback_twice(self):
+    async def test_runs_callback_once_for_several_matching_keys(self):
         await self.GIVEN_MessagePublished(exchange_name="fake_exch",
                                     msg="fake_msg",
                                     routing_key="ball.red")
 
         await self.WHEN_ProcessEventsNTimes(3)
 
-        self.THEN_CallbackIsRun(self.fake_callback,num_times=2)
+        self.THEN_CallbackIsRun(self.fake_callback,num_times=1)
+
+    # @unittest.skip("skipped")
+    @asyncio_test
+    async def test_binding_same_key_twice_runs_callback_once(self):
+        await self.GIVEN_ConsumerRegistered(queue_name="fake_consumer_queue",
+                                      exchange_name="fake_exch",
+                                      exchange_type="topic",
+                                      routing_keys=["ball.red"],
+                                      callback = self.fake_callback)
+        await self.GIVEN_MessagePublished(exchange_name="fake_exch",
+                                    msg="fake_msg",
+                                    routing_key="ball.red")
+
+        await self.WHEN_ProcessEventsNTimes(3)
+
+        self.THEN_CallbackIsRun(self.fake_callback,num_times=1)
 
 # @unittest.skip("skipped") 
 class FanoutTestCase(common.TransportTestCase):
@@ -320,13 +449,1963 @@ class ExchangeDoesntExistTest(common.TransportTestCase):
                                         msg="fake_message",
                                         routing_key="fake_routing_key")
 
+    # @unittest.skip("skipped")
+    @asyncio_test
+    async def test_error_only_raised_on_sending_channel(self):
+        other_chan = await self.conn.create_channel()
+        await other_chan.register_producer(exchange_name="another_exch",
+                                           exchange_type="direct")
+
+        confirmation = await self.chan.publish(exchange_name="fake_exch",
+                                               msg="fake_message",
+                                               routing_key="fake_routing_key",
+                                               wait=False)
+        confirmation.cancel()
+
+        await other_chan.publish(exchange_name="another_exch",
+                                 msg="fake_message",
+                                 routing_key="fake_routing_key")
+
+        with self.assertRaises(mooq.BadExchange):
+            await self.chan.register_producer(exchange_name="another_exch",
+                                              exchange_type="direct")
+
+    # @unittest.skip("skipped")
+    @asyncio_test
+    async def test_publish_many_to_exchange_that_doesnt_exist(self):
+        with self.assertRaises(mooq.BadExchange):
+            await self.chan.publish_many(exchange_name="fake_exch",
+                                         messages=[("fake_message","fake_routing_key")]*2)
+
+        await self.chan.register_producer(exchange_name="another_exch",
+                                          exchange_type="direct")
+
+    # @unittest.skip("skipped")
+    @asyncio_test
+    async def test_publish_nowait_confirmation_raises(self):
+        confirmation = await self.chan.publish(exchange_name="fake_exch",
+                                               msg="fake_message",
+                                               routing_key="fake_routing_key",
+                                               wait=False)
+
+        with self.assertRaises(mooq.BadExchange):
+            await confirmation
+
+
+
+# @unittest.skip("skipped")
+class InMemoryBrokerWakeupTest(common.TransportTestCase):
+    async def async_setUp(self):
+        await self.GIVEN_InMemoryBrokerStarted("localhost",1234)
+
+    async def async_tearDown(self):
+        await self.CloseBroker()
+
+    # @unittest.skip("skipped")
+    @asyncio_test
+    async def test_drains_all_pending_commands_in_one_wakeup(self):
+        for i in range(50):
+            self.broker.msg_q.put({"command": "register_producer",
+                                   "exchange_name": "fake_exch{}".format(i),
+                                   "exchange_type": "direct"})
+
+        await asyncio.sleep(0)
+
+        self.assertEqual(50,len(self.broker.exchanges))
+        self.assertEqual(0,len(self.broker.msg_q))
+
+    # @unittest.skip("skipped")
+    @asyncio_test
+    async def test_registries_lookup_by_name(self):
+        self.broker.msg_q.put({"command": "register_consumer",
+                               "exchange_name": "fake_exch",
+                               "exchange_type": "direct",
+                               "queue_name": "fake_consumer_queue",
+                               "routing_keys": ["fake_routing_key"]})
+
+        await asyncio.sleep(0)
+
+        self.assertEqual("fake_exch",self.broker._get_exchange("fake_exch").name)
+        self.assertTrue(self.broker._consumer_queue_exists("fake_consumer_queue"))
+        self.assertFalse(self.broker._consumer_queue_exists("another_queue"))
+        self.assertEqual(["fake_consumer_queue"],
+                         [cq.name for cq in self.broker.consumer_queues])
+        with self.assertRaises(mooq.ExchangeNotFound):
+            self.broker._get_exchange("another_exch")
+
+    # @unittest.skip("skipped")
+    @asyncio_test
+    async def test_sleeps_when_idle(self):
+        await asyncio.sleep(0)
+
+        self.assertFalse(self.broker._wakeup.is_set())
+
+
+
+
+
+
+
 
 
 
+# @unittest.skip("skipped")
+class InMemoryProcessEventsTest(common.TransportTestCase):
+    async def async_setUp(self):
+        await self.GIVEN_InMemoryBrokerStarted("localhost",1234)
+        self.conn = mooq.InMemoryConnection(host="localhost",port=1234,prefetch_count=2)
+        await self.conn.connect()
+        await self.GIVEN_ChannelResourceCreated()
+        await self.GIVEN_ProducerRegistered(exchange_name="fake_exch",
+                                            exchange_type="direct")
+        self.fake_callback = AsyncMock()
+        self.fake_callback2 = AsyncMock()
+        await self.GIVEN_ConsumerRegistered(queue_name="fake_consumer_queue1",
+                                      exchange_name="fake_exch",
+                                      exchange_type="direct",
+                                      routing_keys=["fake_routing_key1"],
+                                      callback = self.fake_callback)
+        await self.GIVEN_ConsumerRegistered(queue_name="fake_consumer_queue2",
+                                      exchange_name="fake_exch",
+                                      exchange_type="direct",
+                                      routing_keys=["fake_routing_key2"],
+                                      callback = self.fake_callback2)
+
+    async def async_tearDown(self):
+        await self.CloseBroker()
+
+    async def GIVEN_MessagesPublished(self,n,routing_key):
+        for _ in range(n):
+            await self.GIVEN_MessagePublished(exchange_name="fake_exch",
+                                              msg="fake_message",
+                                              routing_key=routing_key)
+
+    # @unittest.skip("skipped")
+    @asyncio_test
+    async def test_takes_prefetch_count_from_each_queue_per_cycle(self):
+        await self.GIVEN_MessagesPublished(5,"fake_routing_key1")
+        await self.GIVEN_MessagesPublished(5,"fake_routing_key2")
+
+        await self.WHEN_ProcessEventsOnce()
+
+        self.THEN_CallbackIsRun(self.fake_callback,num_times=2)
+        self.THEN_CallbackIsRun(self.fake_callback2,num_times=2)
+
+    # @unittest.skip("skipped")
+    @asyncio_test
+    async def test_wakes_when_message_arrives(self):
+        task = self.conn.loop.create_task(self.conn.process_events())
+        await asyncio.sleep(0.01)
+        self.assertFalse(task.done())
+
+        await self.GIVEN_MessagesPublished(1,"fake_routing_key1")
+        await asyncio.sleep(0)
+
+        self.THEN_CallbackIsRun(self.fake_callback,num_times=1)
+        self.THEN_CallbackIsNotRun(self.fake_callback2.mock)
+        task.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await task
+
+
+# @unittest.skip("skipped")
+class InMemoryMaxConcurrencyTest(common.TransportTestCase):
+    async def async_setUp(self):
+        await self.GIVEN_InMemoryBrokerStarted("localhost",1234)
+        await self.GIVEN_ConnectionResourceCreated("localhost",1234,"in_memory")
+        await self.GIVEN_ChannelResourceCreated()
+        await self.GIVEN_ProducerRegistered(exchange_name="fake_exch",
+                                            exchange_type="direct")
+        self.running = 0
+        self.max_running = 0
+        self.num_done = 0
+        self.release = asyncio.Event()
+        await self.GIVEN_ConsumerRegistered(queue_name="fake_consumer_queue",
+                                      exchange_name="fake_exch",
+                                      exchange_type="direct",
+                                      routing_keys=["fake_routing_key"],
+                                      callback = self.blocking_callback,
+                                      max_concurrency=2)
+        for _ in range(5):
+            await self.GIVEN_MessagePublished(exchange_name="fake_exch",
+                                              msg="fake_message",
+                                              routing_key="fake_routing_key")
+
+    async def async_tearDown(self):
+        self.release.set()
+        await asyncio.sleep(0)
+        await self.CloseBroker()
+
+    async def blocking_callback(self,resp):
+        self.running += 1
+        self.max_running = max(self.max_running,self.running)
+        await self.release.wait()
+        self.running -= 1
+        self.num_done += 1
+
+    async def WHEN_CallbacksReleased(self,num_done):
+        self.release.set()
+        while self.num_done < num_done:
+            await asyncio.sleep(0.01)
+
+    # @unittest.skip("skipped")
+    @asyncio_test
+    async def test_stops_taking_messages_when_saturated(self):
+        await self.WHEN_ProcessEventsNTimes(3)
+
+        self.assertEqual(2,self.running)
+        cq = self.conn.broker._get_consumer_queue("fake_consumer_queue")
+        self.assertEqual(3,len(cq))
+
+    # @unittest.skip("skipped")
+    @asyncio_test
+    async def test_resumes_when_callbacks_finish(self):
+        task = self.conn.loop.create_task(self.conn.process_events())
+        await asyncio.sleep(0.01)
+        await asyncio.wait_for(self.WHEN_CallbacksReleased(5),1)
+
+        self.assertEqual(5,self.num_done)
+        self.assertEqual(2,self.max_running)
+        task.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await task
+
+
+def executor_callback(resp):
+    if resp["msg"] == "fail":
+        raise ValueError("fake_error")
+
+    return resp["msg"].upper()
+
+
+# @unittest.skip("skipped")
+class InMemoryExecutorTest(common.TransportTestCase):
+    async def async_setUp(self):
+        await self.GIVEN_InMemoryBrokerStarted("localhost",1234)
+        await self.GIVEN_ConnectionResourceCreated("localhost",1234,"in_memory")
+        await self.GIVEN_ChannelResourceCreated()
+        await self.GIVEN_ProducerRegistered(exchange_name="fake_exch",
+                                            exchange_type="direct")
+        self.executor = ThreadPoolExecutor(2)
+        self.calls = []
+        self.release = threading.Event()
+
+    async def async_tearDown(self):
+        self.release.set()
+        self.executor.shutdown()
+        await self.CloseBroker()
+
+    async def GIVEN_ExecutorConsumerRegistered(self,callback,**kwargs):
+        await self.GIVEN_ConsumerRegistered(queue_name="fake_consumer_queue",
+                                      exchange_name="fake_exch",
+                                      exchange_type="direct",
+                                      routing_keys=["fake_routing_key"],
+                                      callback=callback,
+                                      executor=self.executor,
+                                      **kwargs)
+
+    async def GIVEN_MessagesPublished(self,msgs):
+        await self.chan.publish_many(exchange_name="fake_exch",
+                                     messages=[(msg,"fake_routing_key") for msg in msgs])
+
+    async def WHEN_CallbacksRun(self,n=1):
+        for _ in range(100):
+            if len(self.calls) >= n:
+                return
+            await asyncio.sleep(0.01)
+
+    def GIVEN_RawMessage(self,msg):
+        return mooq.RawMessage(body=json.dumps(msg).encode(),exchange="fake_exch",
+                               routing_key="fake_routing_key",delivery_tag=None,
+                               content_type="application/json",content_encoding=None)
+
+    def recording_callback(self,resp):
+        self.calls.append((threading.get_ident(),resp))
+
+    def blocking_callback(self,resp):
+        self.calls.append(resp)
+        self.release.wait(1)
+
+    # @unittest.skip("skipped")
+    @asyncio_test
+    async def test_runs_callback_in_executor(self):
+        await self.GIVEN_ExecutorConsumerRegistered(self.recording_callback)
+        await self.GIVEN_MessagesPublished(["fake_message"])
+
+        await self.WHEN_ProcessEventsOnce()
+        await self.WHEN_CallbacksRun()
+
+        thread_id, resp = self.calls[0]
+        self.assertNotEqual(threading.get_ident(),thread_id)
+        self.assertEqual({"msg":"fake_message","routing_key":"fake_routing_key"},resp)
+
+    # @unittest.skip("skipped")
+    @asyncio_test
+    async def test_passes_back_results_and_exceptions(self):
+        callback, raw, max_concurrency = self.chan._offload(executor_callback,self.executor,raw=False,
+                                                            batch=False,max_concurrency=None)
+
+        result = await callback(self.GIVEN_RawMessage("fake_message"))
+
+        self.assertEqual("FAKE_MESSAGE",result)
+        self.assertTrue(raw)
+        self.assertEqual(2,max_concurrency)
+        with self.assertRaises(ValueError):
+            await callback(self.GIVEN_RawMessage("fail"))
+
+    # @unittest.skip("skipped")
+    @asyncio_test
+    async def test_other_executors_are_unbounded_unless_told(self):
+        executor = Mock(spec=concurrent.futures.Executor)
+
+        _, _, unbounded = self.chan._offload(executor_callback,executor,raw=False,
+                                             batch=False,max_concurrency=None)
+        _, _, bounded = self.chan._offload(executor_callback,executor,raw=False,
+                                           batch=False,max_concurrency=4)
+
+        self.assertIsNone(unbounded)
+        self.assertEqual(4,bounded)
+
+    # @unittest.skip("skipped")
+    @asyncio_test
+    async def test_bounds_in_flight_to_executor_workers(self):
+        await self.GIVEN_ExecutorConsumerRegistered(self.blocking_callback)
+        await self.GIVEN_MessagesPublished(["fake_message"]*5)
+
+        await self.WHEN_ProcessEventsNTimes(3)
+
+        cq = self.conn.broker._get_consumer_queue("fake_consumer_queue")
+        self.assertEqual(3,len(cq))
+
+    # @unittest.skip("skipped")
+    @asyncio_test
+    async def test_batch_callback_in_executor(self):
+        await self.GIVEN_ConsumerRegistered(queue_name="fake_consumer_queue",
+                                      exchange_name="fake_exch",
+                                      exchange_type="direct",
+                                      routing_keys=["fake_routing_key"],
+                                      callback=None,
+                                      batch_callback=self.recording_callback,
+                                      executor=self.executor)
+        await self.GIVEN_MessagesPublished([1,2,3])
+
+        await self.WHEN_ProcessEventsOnce()
+        await self.WHEN_CallbacksRun()
+
+        _, resps = self.calls[0]
+        self.assertEqual([1,2,3],[resp["msg"] for resp in resps])
+
+    # @unittest.skip("skipped")
+    @asyncio_test
+    async def test_process_pool_executor(self):
+        self.executor = ProcessPoolExecutor(1)
+        callback, _, _ = self.chan._offload(executor_callback,self.executor,raw=False,
+                                            batch=False,max_concurrency=None)
+
+        result = await callback(self.GIVEN_RawMessage("fake_message"))
+
+        self.assertEqual("FAKE_MESSAGE",result)
+
+    # @unittest.skip("skipped")
+    @asyncio_test
+    async def test_rejects_coroutine_callback(self):
+        with self.assertRaises(ValueError):
+            await self.GIVEN_ExecutorConsumerRegistered(self.fake_callback)
 
 
+# @unittest.skip("skipped")
+class InMemoryOrderedTest(common.TransportTestCase):
+    async def async_setUp(self):
+        await self.GIVEN_InMemoryBrokerStarted("localhost",1234)
+        await self.GIVEN_ConnectionResourceCreated("localhost",1234,"in_memory")
+        await self.GIVEN_ChannelResourceCreated()
+        await self.GIVEN_ProducerRegistered(exchange_name="fake_exch",
+                                            exchange_type="direct")
+        self.running = {}
+        self.max_running = {}
+        self.max_running_total = 0
+        self.done = []
+
+    async def async_tearDown(self):
+        await self.CloseBroker()
+
+    async def GIVEN_OrderedConsumerRegistered(self,**kwargs):
+        await self.GIVEN_ConsumerRegistered(queue_name="fake_consumer_queue",
+                                      exchange_name="fake_exch",
+                                      exchange_type="direct",
+                                      routing_keys=["a","b"],
+                                      callback=self.slow_callback,
+                                      ordered=True,
+                                      **kwargs)
+
+    async def GIVEN_MessagesPublished(self,messages):
+        await self.chan.publish_many(exchange_name="fake_exch",messages=messages)
+
+    async def WHEN_CallbacksFinish(self,n):
+        for _ in range(100):
+            await self.WHEN_ProcessEventsOnce()
+            if len(self.done) >= n:
+                return
+            await asyncio.sleep(0.005)
+
+    async def slow_callback(self,resp):
+        key = resp["routing_key"]
+        self.running[key] = self.running.get(key,0) + 1
+        self.max_running[key] = max(self.max_running.get(key,0),self.running[key])
+        self.max_running_total = max(self.max_running_total,sum(self.running.values()))
+        await asyncio.sleep(0.01 if resp["msg"] % 2 else 0)
+        self.running[key] -= 1
+        self.done.append((key,resp["msg"]))
+
+    def THEN_DoneInOrderPerKey(self,key_of=lambda key, msg: key):
+        for key in set(key_of(k,m) for k, m in self.done):
+            msgs = [m for k, m in self.done if key_of(k,m) == key]
+            self.assertEqual(sorted(msgs),msgs)
+
+    # @unittest.skip("skipped")
+    @asyncio_test
+    async def test_same_key_runs_serially_in_order(self):
+        await self.GIVEN_OrderedConsumerRegistered()
+        await self.GIVEN_MessagesPublished([(i,"ab"[i % 2]) for i in range(10)])
+
+        await self.WHEN_CallbacksFinish(10)
+
+        self.assertEqual(10,len(self.done))
+        self.assertEqual({"a":1,"b":1},self.max_running)
+        self.assertEqual(2,self.max_running_total)
+        self.THEN_DoneInOrderPerKey()
+
+    # @unittest.skip("skipped")
+    @asyncio_test
+    async def test_custom_order_key(self):
+        await self.GIVEN_OrderedConsumerRegistered(order_key=lambda resp: resp["msg"] % 3)
+        await self.GIVEN_MessagesPublished([(i,"a") for i in range(9)])
+
+        await self.WHEN_CallbacksFinish(9)
+
+        self.assertEqual(9,len(self.done))
+        self.assertEqual(3,self.max_running_total)
+        self.THEN_DoneInOrderPerKey(key_of=lambda key, msg: msg % 3)
+
+    # @unittest.skip("skipped")
+    @asyncio_test
+    async def test_waiting_messages_are_bounded_by_max_concurrency(self):
+        await self.GIVEN_OrderedConsumerRegistered(max_concurrency=2)
+        await self.GIVEN_MessagesPublished([(i,"a") for i in range(5)])
+
+        await self.WHEN_ProcessEventsNTimes(2)
+
+        cq = self.conn.broker._get_consumer_queue("fake_consumer_queue")
+        self.assertEqual(2,len(cq))
+        await self.WHEN_CallbacksFinish(5)
+        self.THEN_DoneInOrderPerKey()
+
+    # @unittest.skip("skipped")
+    @asyncio_test
+    async def test_waiting_messages_leave_slots_for_other_keys(self):
+        await self.GIVEN_OrderedConsumerRegistered(max_concurrency=2)
+        await self.GIVEN_MessagesPublished([(1,"a"),(3,"a"),(5,"b")])
+
+        await self.WHEN_ProcessEventsNTimes(2)
+
+        self.assertEqual({"a":1,"b":1},self.running)
+        await self.WHEN_CallbacksFinish(3)
+        self.THEN_DoneInOrderPerKey()
+
+    # @unittest.skip("skipped")
+    @asyncio_test
+    async def test_message_without_key_is_dropped(self):
+        errors = []
+        self.loop.set_exception_handler(lambda loop,context: errors.append(context["exception"]))
+        await self.GIVEN_OrderedConsumerRegistered(order_key=lambda resp: {"a":"a"}[resp["routing_key"]])
+        await self.GIVEN_MessagesPublished([(0,"b"),(1,"a"),(2,"a")])
+
+        await self.WHEN_CallbacksFinish(2)
+
+        self.assertEqual([("a",1),("a",2)],self.done)
+        self.assertIsInstance(errors[0],KeyError)
+
+    # @unittest.skip("skipped")
+    @asyncio_test
+    async def test_needs_per_message_callback(self):
+        with self.assertRaises(ValueError):
+            await self.GIVEN_ConsumerRegistered(queue_name="fake_consumer_queue",
+                                          exchange_name="fake_exch",
+                                          exchange_type="direct",
+                                          routing_keys=["a"],
+                                          callback=None,
+                                          batch_callback=self.slow_callback,
+                                          ordered=True)
+
+
+# @unittest.skip("skipped")
+class InMemoryPrefetchTest(InMemoryMaxConcurrencyTest):
+    async def async_setUp(self):
+        await self.GIVEN_InMemoryBrokerStarted("localhost",1234)
+        await self.GIVEN_ConnectionResourceCreated("localhost",1234,"in_memory")
+        await self.GIVEN_ChannelResourceCreated()
+        await self.GIVEN_ProducerRegistered(exchange_name="fake_exch",
+                                            exchange_type="direct")
+        self.running = 0
+        self.max_running = 0
+        self.num_done = 0
+        self.release = asyncio.Event()
+
+    async def GIVEN_MessagesPublished(self,n):
+        for _ in range(n):
+            await self.GIVEN_MessagePublished(exchange_name="fake_exch",
+                                              msg="fake_message",
+                                              routing_key="fake_routing_key")
+
+    async def GIVEN_PrefetchConsumerRegistered(self,**kwargs):
+        await self.GIVEN_ConsumerRegistered(queue_name="fake_consumer_queue",
+                                      exchange_name="fake_exch",
+                                      exchange_type="direct",
+                                      routing_keys=["fake_routing_key"],
+                                      callback = self.blocking_callback,
+                                      prefetch_count=2,
+                                      **kwargs)
+
+    # @unittest.skip("skipped")
+    @asyncio_test
+    async def test_stops_taking_messages_when_saturated(self):
+        await self.GIVEN_PrefetchConsumerRegistered(ack=True)
+        await self.GIVEN_MessagesPublished(5)
+
+        await self.WHEN_ProcessEventsNTimes(3)
+
+        self.assertEqual(2,self.running)
+        cq = self.conn.broker._get_consumer_queue("fake_consumer_queue")
+        self.assertEqual(3,len(cq))
+
+    # @unittest.skip("skipped")
+    @asyncio_test
+    async def test_resumes_when_callbacks_finish(self):
+        await self.GIVEN_PrefetchConsumerRegistered(ack=True)
+        await self.GIVEN_MessagesPublished(5)
+
+        task = self.conn.loop.create_task(self.conn.process_events())
+        await asyncio.sleep(0.01)
+        await asyncio.wait_for(self.WHEN_CallbacksReleased(5),1)
+
+        self.assertEqual(5,self.num_done)
+        self.assertEqual(2,self.max_running)
+        task.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await task
+
+    # @unittest.skip("skipped")
+    @asyncio_test
+    async def test_prefetch_ignored_without_ack(self):
+        await self.GIVEN_PrefetchConsumerRegistered()
+        await self.GIVEN_MessagesPublished(5)
+
+        await self.WHEN_ProcessEventsNTimes(3)
+
+        self.assertEqual(5,self.running)
+
+
+# @unittest.skip("skipped")
+class InMemoryBatchCallbackTest(common.TransportTestCase):
+    async def async_setUp(self):
+        await self.GIVEN_InMemoryBrokerStarted("localhost",1234)
+        await self.GIVEN_ConnectionResourceCreated("localhost",1234,"in_memory",)
+        await self.GIVEN_ChannelResourceCreated()
+        await self.GIVEN_ProducerRegistered(exchange_name="fake_exch",
+                                            exchange_type="direct")
+        self.batches = []
+
+    async def async_tearDown(self):
+        await self.CloseBroker()
+
+    async def batch_callback(self,resps):
+        self.batches.append([resp["msg"] for resp in resps])
+
+    # @unittest.skip("skipped")
+    @asyncio_test
+    async def test_runs_callback_with_messages_of_one_cycle(self):
+        await self.GIVEN_ConsumerRegistered(queue_name="fake_consumer_queue",
+                                      exchange_name="fake_exch",
+                                      exchange_type="direct",
+                                      routing_keys=["fake_routing_key"],
+                                      callback=None,
+                                      batch_callback=self.batch_callback)
+        await self.chan.publish_many(exchange_name="fake_exch",
+                                     messages=[(i,"fake_routing_key") for i in range(5)])
+
+        await self.WHEN_ProcessEventsOnce()
+
+        self.assertEqual([[0,1,2,3,4]],self.batches)
+
+    # @unittest.skip("skipped")
+    @asyncio_test
+    async def test_needs_exactly_one_callback(self):
+        with self.assertRaises(ValueError):
+            await self.GIVEN_ConsumerRegistered(queue_name="fake_consumer_queue",
+                                          exchange_name="fake_exch",
+                                          exchange_type="direct",
+                                          routing_keys=["fake_routing_key"],
+                                          callback=self.fake_callback,
+                                          batch_callback=self.batch_callback)
+
+
+# @unittest.skip("skipped")
+class RabbitMQIOThreadRunTest(unittest.TestCase):
+    async def async_setUp(self):
+        self.patcher = patch("mooq.rabbit.pika.BlockingConnection")
+        self.fake_conn = self.patcher.start().return_value
+        self.fake_conn.process_data_events.side_effect = lambda time_limit: time.sleep(0.001)
+        self.fake_conn.is_open = True
+        self.conn = mooq.RabbitMQConnection(host="fake_host",port=1234)
+        await self.conn.connect()
+        self.io = self.conn._io
+
+    async def async_tearDown(self):
+        await self.conn.close()
+        self.patcher.stop()
+
+    def raise_error(self):
+        raise ValueError("fake_error")
+
+    # @unittest.skip("skipped")
+    @asyncio_test
+    async def test_submit_runs_on_io_thread(self):
+        thread = await self.io.submit(threading.current_thread)
+
+        self.assertIs(self.io,thread)
+
+    # @unittest.skip("skipped")
+    @asyncio_test
+    async def test_submit_passes_back_exception(self):
+        with self.assertRaises(ValueError):
+            await self.io.submit(self.raise_error)
+
+    # @unittest.skip("skipped")
+    @asyncio_test
+    async def test_close_closes_connection(self):
+        await self.conn.close()
+
+        self.fake_conn.close.assert_called_once()
+        self.assertTrue(self.io.closed.done())
+        self.assertFalse(self.io.is_alive())
+
+    # @unittest.skip("skipped")
+    @asyncio_test
+    async def test_reports_failed_ack(self):
+        errors = []
+        self.loop.set_exception_handler(lambda loop,context: errors.append(context["exception"]))
+        chan = await self.conn.create_channel()
+        chan._chan.basic_ack.side_effect = ConnectionError("fake_error")
+
+        chan._send_ack(1)
+        await self.io.wait_cycles(2)
+        await asyncio.sleep(0)
+
+        self.assertIsInstance(errors[0],ConnectionError)
+
+    # @unittest.skip("skipped")
+    @asyncio_test
+    async def test_close_finishes_when_connection_close_fails(self):
+        self.fake_conn.close.side_effect = ConnectionError("fake_error")
+
+        await asyncio.wait_for(self.conn.close(),timeout=1)
+
+        self.assertTrue(self.io.closed.done())
+        self.assertFalse(self.io.is_alive())
+
+    # @unittest.skip("skipped")
+    @asyncio_test
+    async def test_submit_after_close_fails(self):
+        await self.conn.close()
+
+        with self.assertRaises(mooq.BrokerInternalError):
+            await self.io.submit(threading.current_thread)
+
+    # @unittest.skip("skipped")
+    @asyncio_test
+    async def test_process_events_waits_for_cycles(self):
+        before = self.fake_conn.process_data_events.call_count
+
+        await asyncio.wait_for(self.conn.process_events(num_cycles=3),1)
+
+        self.assertGreaterEqual(self.fake_conn.process_data_events.call_count,before + 3)
+
+    # @unittest.skip("skipped")
+    @asyncio_test
+    async def test_process_events_returns_once_closed(self):
+        await self.conn.close()
+
+        await asyncio.wait_for(self.conn.process_events(num_cycles=3),1)
+
+    # @unittest.skip("skipped")
+    @asyncio_test
+    async def test_connection_error_closes_thread(self):
+        self.fake_conn.process_data_events.side_effect = ConnectionError("fake_error")
+
+        await asyncio.wait_for(asyncio.shield(self.io.closed),1)
+
+        with self.assertRaises(mooq.BrokerInternalError):
+            await self.io.submit(threading.current_thread)
+
+
+# @unittest.skip("skipped")
+class RabbitMQIOThreadFinishTest(unittest.TestCase):
+    async def async_setUp(self):
+        self.io = mooq.rabbit._IOThread(params=Mock(host="fake_host"),loop=self.loop)
+        self.io.conn = Mock()
+
+    async def async_tearDown(self):
+        pass
+
+    # @unittest.skip("skipped")
+    @asyncio_test
+    async def test_fails_pending_commands(self):
+        fut = self.io.submit(threading.current_thread)
+        waiter = self.io.wait_cycles(5)
+
+        self.io._finish(ConnectionError("fake_error"))
+
+        with self.assertRaisesRegex(mooq.BrokerInternalError,"fake_error"):
+            await fut
+        await waiter
+        self.assertTrue(self.io.closed.done())
+
+    # @unittest.skip("skipped")
+    @asyncio_test
+    async def test_acks_queued_at_close_are_not_reported(self):
+        errors = []
+        self.loop.set_exception_handler(lambda loop,context: errors.append(context))
+        chan = mooq.RabbitMQChannel(internal_chan=Mock(),loop=self.loop,io_thread=self.io)
+        chan._send_ack(1)
+        chan._send_reject(2,False)
+
+        self.io._finish(None)
+        await asyncio.sleep(0)
+
+        self.assertEqual([],errors)
+
+
+# @unittest.skip("skipped")
+class RabbitMQIOThreadTest(unittest.TestCase):
+    # @unittest.skip("skipped")
+    def test_hands_deliveries_to_loop_in_one_call(self):
+        loop = Mock()
+        io = mooq.rabbit._IOThread(params=Mock(host="fake_host"),loop=loop)
+        func = Mock()
+
+        for i in range(3):
+            io.deliver_soon(func,i)
+        io._flush_deliveries()
+        io._flush_deliveries()
+
+        loop.call_soon_threadsafe.assert_called_once()
+        run_all, deliveries = loop.call_soon_threadsafe.call_args[0]
+        run_all(deliveries)
+        self.assertEqual([((0,),),((1,),),((2,),)],[c[0:1] for c in func.call_args_list])
+
+    # @unittest.skip("skipped")
+    def test_failing_delivery_doesnt_stop_the_rest(self):
+        loop = Mock()
+        io = mooq.rabbit._IOThread(params=Mock(host="fake_host"),loop=loop)
+        func = Mock(side_effect=[ValueError("fake_error"),None,None])
+
+        for i in range(3):
+            io.deliver_soon(func,i)
+        io._flush_deliveries()
+        run_all, deliveries = loop.call_soon_threadsafe.call_args[0]
+        run_all(deliveries)
+
+        self.assertEqual(3,func.call_count)
+        loop.call_exception_handler.assert_called_once()
+
+
+# @unittest.skip("skipped")
+class InMemoryBrokerBatchTest(common.TransportTestCase):
+    async def async_tearDown(self):
+        await self.CloseBroker()
+
+    def GIVEN_PublishCommandsQueued(self,n,exchange_name="fake_exch"):
+        for i in range(n):
+            self.broker.msg_q.put({"command": "publish",
+                                   "exchange_name": exchange_name,
+                                   "msg": i,
+                                   "routing_key": "fake_routing_key"})
+
+    def THEN_ConsumerQueueHolds(self,queue_name,expected_msgs):
+        cq = self.broker._get_consumer_queue(queue_name)
+        actual = []
+        while True:
+            try:
+                actual.append(cq.get_next_message()["msg"])
+            except mooq.ConsumeTimeout:
+                break
+
+        self.assertEqual(expected_msgs,actual)
+
+    async def GIVEN_QueueBound(self):
+        self.broker.msg_q.put({"command": "register_consumer",
+                               "exchange_name": "fake_exch",
+                               "exchange_type": "direct",
+                               "queue_name": "fake_consumer_queue",
+                               "routing_keys": ["fake_routing_key"]})
+        await asyncio.sleep(0)
+
+    # @unittest.skip("skipped")
+    @asyncio_test
+    async def test_max_batch_size_limits_commands_per_wakeup(self):
+        await self.GIVEN_InMemoryBrokerStarted("localhost",1234,max_batch_size=10)
+        await self.GIVEN_QueueBound()
+        self.GIVEN_PublishCommandsQueued(25)
+
+        await asyncio.sleep(0)
+
+        self.assertEqual(15,len(self.broker.msg_q))
+
+    # @unittest.skip("skipped")
+    @asyncio_test
+    async def test_routes_batch_in_order(self):
+        await self.GIVEN_InMemoryBrokerStarted("localhost",1234,max_batch_size=10)
+        await self.GIVEN_QueueBound()
+        self.GIVEN_PublishCommandsQueued(25)
+
+        for _ in range(3):
+            await asyncio.sleep(0)
+
+        self.THEN_ConsumerQueueHolds("fake_consumer_queue",list(range(25)))
+
+    # @unittest.skip("skipped")
+    @asyncio_test
+    async def test_lingers_for_full_batch(self):
+        await self.GIVEN_InMemoryBrokerStarted("localhost",1234,max_batch_size=10,
+                                               max_batch_latency=10)
+        await self.GIVEN_QueueBound()
+        self.GIVEN_PublishCommandsQueued(4)
+        await asyncio.sleep(0)
+        self.assertEqual(5,len(self.broker.msg_q))
+
+        self.GIVEN_PublishCommandsQueued(5)
+        for _ in range(3):
+            await asyncio.sleep(0)
+
+        self.THEN_ConsumerQueueHolds("fake_consumer_queue",list(range(4))+list(range(5)))
+
+
+# @unittest.skip("skipped")
+class InMemoryChannelPoolTest(common.TransportTestCase):
+    async def async_setUp(self):
+        await self.GIVEN_InMemoryBrokerStarted("localhost",1234)
+        await self.GIVEN_ConnectionResourceCreated("localhost",1234,"in_memory")
+        await self.GIVEN_ChannelResourceCreated()
+        await self.GIVEN_ProducerRegistered(exchange_name="fake_exch",
+                                            exchange_type="direct")
+        await self.GIVEN_ConsumerRegistered(queue_name="fake_consumer_queue",
+                                      exchange_name="fake_exch",
+                                      exchange_type="direct",
+                                      routing_keys=["fake_routing_key"],
+                                      callback = self.fake_callback)
+
+    async def async_tearDown(self):
+        await self.CloseBroker()
+
+    async def GIVEN_ChannelsBorrowed(self,pool,n):
+        return [await pool.acquire() for _ in range(n)]
+
+    # @unittest.skip("skipped")
+    @asyncio_test
+    async def test_reuses_returned_channel(self):
+        pool = self.conn.create_channel_pool(max_size=3)
+        chan = await pool.acquire()
+        pool.release(chan)
+
+        chan2 = await pool.acquire()
+
+        self.assertIs(chan,chan2)
+        self.assertEqual(1,len(pool.channels))
+
+    # @unittest.skip("skipped")
+    @asyncio_test
+    async def test_grows_while_channels_busy(self):
+        pool = self.conn.create_channel_pool(max_size=3)
+
+        chans = await self.GIVEN_ChannelsBorrowed(pool,3)
+
+        self.assertEqual(3,len(set(chans)))
+
+    # @unittest.skip("skipped")
+    @asyncio_test
+    async def test_round_robin_once_full(self):
+        pool = self.conn.create_channel_pool(max_size=2)
+        chans = await self.GIVEN_ChannelsBorrowed(pool,2)
+
+        more = await self.GIVEN_ChannelsBorrowed(pool,4)
+
+        self.assertEqual(chans*2,more)
+
+    # @unittest.skip("skipped")
+    @asyncio_test
+    async def test_least_in_flight_once_full(self):
+        pool = self.conn.create_channel_pool(max_size=2,strategy="least_in_flight")
+        chan1, chan2 = await self.GIVEN_ChannelsBorrowed(pool,2)
+        await pool.acquire()
+        pool.release(chan2)
+
+        chan = await pool.acquire()
+
+        self.assertIs(chan2,chan)
+        self.assertEqual(2,pool.in_flight(chan1))
+
+    # @unittest.skip("skipped")
+    @asyncio_test
+    async def test_concurrent_acquires_respect_max_size(self):
+        pool = self.conn.create_channel_pool(max_size=2)
+
+        await asyncio.gather(*[pool.acquire() for _ in range(5)])
+
+        self.assertEqual(2,len(pool.channels))
+
+    # @unittest.skip("skipped")
+    @asyncio_test
+    async def test_publish_returns_channel(self):
+        pool = self.conn.create_channel_pool()
+
+        await pool.publish(exchange_name="fake_exch",msg="fake_message",
+                           routing_key="fake_routing_key")
+        await self.WHEN_ProcessEventsOnce()
+
+        self.THEN_CallbackReceivesMessage("fake_message")
+        self.assertEqual(0,pool.in_flight(pool.channels[0]))
+
+    # @unittest.skip("skipped")
+    @asyncio_test
+    async def test_unknown_strategy(self):
+        with self.assertRaises(ValueError):
+            self.conn.create_channel_pool(strategy="fake_strategy")
+
+
+# @unittest.skip("skipped")
+class InMemoryPooledConnectionTest(common.TransportTestCase):
+    async def async_setUp(self):
+        await self.GIVEN_InMemoryBrokerStarted("localhost",1234)
+
+    async def async_tearDown(self):
+        await self.CloseBroker()
+
+    async def GIVEN_PooledChannelCreated(self,**kwargs):
+        await self.GIVEN_ConnectionResourceCreated("localhost",1234,"in_memory",pool_size=3,**kwargs)
+        await self.GIVEN_ChannelResourceCreated()
+        await self.GIVEN_ProducerRegistered(exchange_name="fake_exch",
+                                            exchange_type="direct")
+        await self.GIVEN_ConsumerRegistered(queue_name="fake_consumer_queue",
+                                      exchange_name="fake_exch",
+                                      exchange_type="direct",
+                                      routing_keys=["fake_routing_key","fake_routing_key2"],
+                                      callback = self.fake_callback)
+        self.published = []
+        for i, shard in enumerate(self.chan.shards):
+            shard.publish = self.recording_publish(i,shard.publish)
+
+    def recording_publish(self,shard_num,publish):
+        async def wrapper(**kwargs):
+            self.published.append((shard_num,kwargs["routing_key"]))
+            return await publish(**kwargs)
+
+        return wrapper
+
+    def shards_used(self,routing_key):
+        return {shard for shard, key in self.published if key == routing_key}
+
+    # @unittest.skip("skipped")
+    @asyncio_test
+    async def test_opens_pool_size_connections(self):
+        await self.GIVEN_PooledChannelCreated()
+
+        self.assertEqual(3,len(self.conn.connections))
+        self.assertEqual(3,len(self.chan.shards))
+
+    # @unittest.skip("skipped")
+    @asyncio_test
+    async def test_consumer_receives_message(self):
+        self.fake_callback = AsyncMock()
+        await self.GIVEN_PooledChannelCreated()
+
+        for _ in range(3):
+            await self.WHEN_MessagePublished(exchange_name="fake_exch",
+                                             msg="fake_message",
+                                             routing_key="fake_routing_key")
+        await self.WHEN_ProcessEventsOnce()
+
+        self.THEN_CallbackIsRun(self.fake_callback,num_times=3)
+
+    # @unittest.skip("skipped")
+    @asyncio_test
+    async def test_without_hash_routing_spreads_publishes(self):
+        await self.GIVEN_PooledChannelCreated()
+
+        for _ in range(3):
+            await self.WHEN_MessagePublished(exchange_name="fake_exch",
+                                             msg="fake_message",
+                                             routing_key="fake_routing_key")
+
+        self.assertEqual({0,1,2},self.shards_used("fake_routing_key"))
+
+    # @unittest.skip("skipped")
+    @asyncio_test
+    async def test_hash_routing_keeps_routing_key_on_one_connection(self):
+        await self.GIVEN_PooledChannelCreated(hash_routing=True)
+
+        for _ in range(5):
+            await self.WHEN_MessagePublished(exchange_name="fake_exch",
+                                             msg="fake_message",
+                                             routing_key="fake_routing_key")
+
+        self.assertEqual(1,len(self.shards_used("fake_routing_key")))
+
+    # @unittest.skip("skipped")
+    @asyncio_test
+    async def test_hash_routing_publish_many_keeps_order_per_key(self):
+        await self.GIVEN_PooledChannelCreated(hash_routing=True)
+        msgs = []
+        self.fake_callback = AsyncMock(side_effect=lambda resp: msgs.append((resp["routing_key"],resp["msg"])))
+        await self.chan.register_consumer(queue_name="fake_consumer_queue2",
+                                          exchange_name="fake_exch",
+                                          exchange_type="direct",
+                                          routing_keys=["fake_routing_key","fake_routing_key2"],
+                                          callback=self.fake_callback)
+        keys = ["fake_routing_key","fake_routing_key2"]
+
+        await self.chan.publish_many(exchange_name="fake_exch",
+                                     messages=[(i,keys[i % 2]) for i in range(10)])
+        await self.WHEN_ProcessEventsNTimes(2)
+
+        for key in keys:
+            self.assertEqual([i for i in range(10) if keys[i % 2] == key],
+                             [msg for k, msg in msgs if k == key])
+
+    # @unittest.skip("skipped")
+    @asyncio_test
+    async def test_publish_without_waiting_returns_confirmation(self):
+        await self.GIVEN_PooledChannelCreated(hash_routing=True)
+
+        confirmation = await self.chan.publish(exchange_name="fake_exch",
+                                               msg="fake_message",
+                                               routing_key="fake_routing_key",
+                                               wait=False)
+        await confirmation
+        await self.WHEN_ProcessEventsOnce()
+
+        self.THEN_CallbackReceivesMessage("fake_message")
+
+    # @unittest.skip("skipped")
+    @asyncio_test
+    async def test_publish_many_without_waiting_gathers_shard_confirmations(self):
+        await self.GIVEN_PooledChannelCreated(hash_routing=True)
+        keys = ["fake_routing_key","fake_routing_key2"]
+
+        confirmation = await self.chan.publish_many(exchange_name="fake_exch",
+                                                     messages=[("fake_message",key) for key in keys],
+                                                     wait=False)
+        await confirmation
+
+        cq = self.conn.connections[0].broker._get_consumer_queue("fake_consumer_queue")
+        self.assertEqual(2,len(cq))
+
+    # @unittest.skip("skipped")
+    @asyncio_test
+    async def test_publish_many_without_waiting_raises_on_bad_exchange(self):
+        await self.GIVEN_PooledChannelCreated()
+
+        confirmation = await self.chan.publish_many(exchange_name="fake_bad_exch",
+                                                    messages=[("fake_message","fake_routing_key")],
+                                                    wait=False)
+
+        with self.assertRaises(mooq.BadExchange):
+            await confirmation
+
+    # @unittest.skip("skipped")
+    @asyncio_test
+    async def test_bad_pool_size(self):
+        with self.assertRaises(ValueError):
+            await self.GIVEN_ConnectionResourceCreated("localhost",1234,"in_memory",pool_size=0)
+
+    # @unittest.skip("skipped")
+    @asyncio_test
+    async def test_hash_routing_without_pool_size(self):
+        with self.assertRaises(ValueError):
+            await self.GIVEN_ConnectionResourceCreated("localhost",1234,"in_memory",hash_routing=True)
+
+
+async def worker_callback(resp):
+    if resp["msg"] == "fail":
+        raise ValueError("fake_error")
+
+
+async def slow_worker_callback(resp):
+    await asyncio.sleep(0.1)
+
+
+# @unittest.skip("skipped")
+class InMemoryWorkerPoolTest(common.TransportTestCase):
+    async def async_setUp(self):
+        await self.GIVEN_InMemoryBrokerStarted("localhost",1234)
+        await self.GIVEN_ConnectionResourceCreated("localhost",1234,"in_memory")
+        await self.GIVEN_ChannelResourceCreated()
+        await self.GIVEN_ProducerRegistered(exchange_name="fake_exch",
+                                            exchange_type="direct")
+        self.pool = mooq.WorkerPool(worker_callback,
+                                    num_workers=2,
+                                    queue_name="fake_consumer_queue",
+                                    exchange_name="fake_exch",
+                                    exchange_type="direct",
+                                    routing_keys=["fake_routing_key"],
+                                    host="localhost",
+                                    port=1234,
+                                    broker="in_memory",
+                                    stats_interval=0.05)
+        await self.pool.start()
+
+    async def async_tearDown(self):
+        await self.CloseBroker()
+
+    async def GIVEN_MessagesPublished(self,msgs):
+        await self.chan.publish_many(exchange_name="fake_exch",
+                                     messages=[(msg,"fake_routing_key") for msg in msgs])
+
+    # @unittest.skip("skipped")
+    @asyncio_test
+    async def test_workers_process_all_messages(self):
+        await self.GIVEN_MessagesPublished(["fake_message"]*20 + ["fail"])
+
+        await asyncio.sleep(0.2)
+        await self.pool.close()
+
+        stats = self.pool.stats()
+        self.assertEqual([0,1],[s.worker_id for s in stats])
+        self.assertEqual(20,sum(s.processed for s in stats))
+        self.assertEqual(1,sum(s.failed for s in stats))
+        self.assertFalse(any(s.alive for s in stats))
+
+    # @unittest.skip("skipped")
+    @asyncio_test
+    async def test_restarts_dead_worker(self):
+        pid = self.pool.stats()[0].pid
+        os.kill(pid,9)
+
+        await asyncio.sleep(0.3)
+
+        stats = self.pool.stats()
+        self.assertEqual(1,stats[0].restarts)
+        self.assertNotEqual(pid,stats[0].pid)
+        self.assertTrue(stats[0].alive)
+        await self.GIVEN_MessagesPublished(["fake_message"]*10)
+        await asyncio.sleep(0.2)
+        await self.pool.close()
+        self.assertEqual(10,sum(s.processed for s in self.pool.stats()))
+
+
+# @unittest.skip("skipped")
+class InMemorySlowWorkerPoolTest(common.TransportTestCase):
+    async def async_setUp(self):
+        await self.GIVEN_InMemoryBrokerStarted("localhost",1234)
+        await self.GIVEN_ConnectionResourceCreated("localhost",1234,"in_memory")
+        await self.GIVEN_ChannelResourceCreated()
+        await self.GIVEN_ProducerRegistered(exchange_name="fake_exch",
+                                            exchange_type="direct")
+        self.pool = mooq.WorkerPool(slow_worker_callback,
+                                    num_workers=1,
+                                    queue_name="fake_consumer_queue",
+                                    exchange_name="fake_exch",
+                                    exchange_type="direct",
+                                    routing_keys=["fake_routing_key"],
+                                    host="localhost",
+                                    port=1234,
+                                    broker="in_memory",
+                                    consumer_options={"max_concurrency": 1},
+                                    stats_interval=0.05)
+
+    async def async_tearDown(self):
+        await self.CloseBroker()
+
+    # @unittest.skip("skipped")
+    @asyncio_test
+    async def test_slow_worker_throttles_forwarding(self):
+        await self.pool.start()
+        await self.chan.publish_many(exchange_name="fake_exch",
+                                     messages=[("fake_message","fake_routing_key")]*10)
+
+        await asyncio.sleep(0.2)
+
+        cq = self.conn.broker._get_consumer_queue("fake_consumer_queue")
+        self.assertGreaterEqual(len(cq),5)
+        await self.pool.close()
+
+    # @unittest.skip("skipped")
+    @asyncio_test
+    async def test_close_before_start(self):
+        await self.pool.close()
+
+        self.assertEqual([],self.pool.stats())
+
+
+# @unittest.skip("skipped")
+class InMemoryBufferedPublisherTest(common.TransportTestCase):
+    async def async_setUp(self):
+        await self.GIVEN_InMemoryBrokerStarted("localhost",1234)
+        await self.GIVEN_ConnectionResourceCreated("localhost",1234,"in_memory")
+        await self.GIVEN_ChannelResourceCreated()
+        await self.GIVEN_ProducerRegistered(exchange_name="fake_exch",
+                                            exchange_type="direct")
+        await self.GIVEN_ConsumerRegistered(queue_name="fake_consumer_queue",
+                                      exchange_name="fake_exch",
+                                      exchange_type="direct",
+                                      routing_keys=["fake_routing_key"],
+                                      callback = self.fake_callback)
+        self.batch_sizes = []
+        self.chan.publish_many = self.recording_publish_many(self.chan.publish_many)
+
+    async def async_tearDown(self):
+        await self.CloseBroker()
+
+    def GIVEN_MessagesBuffered(self,publisher,n,exchange_name="fake_exch"):
+        return [publisher.publish(exchange_name=exchange_name,
+                                  msg="fake_message{}".format(i),
+                                  routing_key="fake_routing_key")
+                for i in range(n)]
+
+    def THEN_BatchesSent(self,expected_sizes):
+        self.assertEqual(expected_sizes,self.batch_sizes)
+
+    def recording_publish_many(self,publish_many):
+        async def wrapper(**kwargs):
+            self.batch_sizes.append(len(kwargs["messages"]))
+            await publish_many(**kwargs)
+
+        return wrapper
+
+    # @unittest.skip("skipped")
+    @asyncio_test
+    async def test_publish_returns_before_sending(self):
+        publisher = self.chan.create_buffered_publisher(linger=10)
+        futs = self.GIVEN_MessagesBuffered(publisher,3)
+
+        await asyncio.sleep(0)
+
+        self.assertFalse(any(f.done() for f in futs))
+        self.THEN_BatchesSent([])
+        await publisher.close()
+
+    # @unittest.skip("skipped")
+    @asyncio_test
+    async def test_sends_when_count_reached(self):
+        publisher = self.chan.create_buffered_publisher(linger=10,max_batch_count=2)
+        futs = self.GIVEN_MessagesBuffered(publisher,5)
+
+        await asyncio.wait(futs[:4])
+
+        self.THEN_BatchesSent([2,2])
+        self.assertFalse(futs[4].done())
+        await publisher.close()
+
+    # @unittest.skip("skipped")
+    @asyncio_test
+    async def test_sends_when_bytes_reached(self):
+        publisher = self.chan.create_buffered_publisher(linger=10,max_batch_bytes=26)
+        futs = self.GIVEN_MessagesBuffered(publisher,3)
+
+        await asyncio.wait(futs[:2])
+
+        self.THEN_BatchesSent([2])
+        await publisher.close()
+
+    # @unittest.skip("skipped")
+    @asyncio_test
+    async def test_bytes_limit_encodes_each_message_once(self):
+        encode = self.chan.serializer.encode
+        with patch.object(self.chan.serializer,"encode",wraps=encode) as counted:
+            publisher = self.chan.create_buffered_publisher(linger=10,max_batch_bytes=1000)
+            for i in range(3):
+                publisher.publish(exchange_name="fake_exch",
+                                  msg={"fake_field": i},
+                                  routing_key="fake_routing_key")
+            await publisher.close()
+
+        await self.WHEN_ProcessEventsOnce()
+
+        self.assertEqual(3,counted.call_count)
+        self.assertEqual([{"fake_field": i} for i in range(3)],
+                         self.received)
+
+    # @unittest.skip("skipped")
+    @asyncio_test
+    async def test_sends_after_linger(self):
+        publisher = self.chan.create_buffered_publisher(linger=0.01)
+        futs = self.GIVEN_MessagesBuffered(publisher,3)
+
+        await asyncio.wait(futs,timeout=1)
+
+        self.THEN_BatchesSent([3])
+        self.assertTrue(all(f.done() for f in futs))
+
+    # @unittest.skip("skipped")
+    @asyncio_test
+    async def test_close_sends_remaining_in_order(self):
+        publisher = self.chan.create_buffered_publisher(linger=10,max_batch_count=2)
+        self.GIVEN_MessagesBuffered(publisher,3)
+
+        await publisher.close()
+        await self.WHEN_ProcessEventsOnce()
+
+        self.THEN_BatchesSent([2,1])
+        self.assertEqual(["fake_message0","fake_message1","fake_message2"],
+                         self.received)
+
+    # @unittest.skip("skipped")
+    @asyncio_test
+    async def test_error_set_on_futures(self):
+        publisher = self.chan.create_buffered_publisher(linger=10)
+        futs = self.GIVEN_MessagesBuffered(publisher,2,exchange_name="another_exch")
+
+        await publisher.close()
+
+        for fut in futs:
+            with self.assertRaises(mooq.BadExchange):
+                await fut
+
+    # @unittest.skip("skipped")
+    @asyncio_test
+    async def test_publish_after_close_raises(self):
+        publisher = self.chan.create_buffered_publisher(linger=10)
+        await publisher.close()
+
+        with self.assertRaises(mooq.PublisherClosed):
+            self.GIVEN_MessagesBuffered(publisher,1)
+
+        self.THEN_BatchesSent([])
+
+    async def fake_callback(self,resp):
+        self.received.append(resp["msg"])
+
+    def setUp(self):
+        self.received = []
+        super().setUp()
+
+
+class TwoChannelTestCase(common.TransportTestCase):
+    async def async_setUp(self):
+        await self.GIVEN_InMemoryBrokerStarted("localhost",1234)
+
+    async def async_tearDown(self):
+        await self.CloseBroker()
+
+    async def GIVEN_ConsumerChannelCreated(self,**kwargs):
+        self.consumer_chan = await self.conn.create_channel(**kwargs)
+        await self.consumer_chan.register_consumer(queue_name="fake_consumer_queue",
+                                                   exchange_name="fake_exch",
+                                                   exchange_type="direct",
+                                                   routing_keys=["fake_routing_key"],
+                                                   callback=self.fake_callback)
+
+    async def WHEN_MessageSentAndConsumed(self,msg):
+        await self.chan.register_producer(exchange_name="fake_exch",
+                                          exchange_type="direct")
+        await self.chan.publish(exchange_name="fake_exch",
+                                msg=msg,
+                                routing_key="fake_routing_key")
+        await self.WHEN_ProcessEventsOnce()
+
+
+# @unittest.skip("skipped")
+class InMemorySerializerTest(TwoChannelTestCase):
+    # @unittest.skip("skipped")
+    @asyncio_test
+    async def test_json_by_default(self):
+        await self.GIVEN_ConnectionResourceCreated("localhost",1234,"in_memory")
+        await self.GIVEN_ChannelResourceCreated()
+        await self.GIVEN_ConsumerChannelCreated()
+        self.conn.process_events = AsyncMock()
+
+        await self.WHEN_MessageSentAndConsumed({"fake_key": [1,2]})
+
+        cq = self.conn.broker._get_consumer_queue("fake_consumer_queue")
+        msg_dict = cq.get_next_message()
+        self.assertEqual(b'{"fake_key": [1, 2]}',msg_dict["msg"])
+        self.assertEqual("application/json",msg_dict["content_type"])
+
+    # @unittest.skip("skipped")
+    @asyncio_test
+    async def test_connection_serializer(self):
+        await self.GIVEN_ConnectionResourceCreated("localhost",1234,"in_memory",
+                                                   serializer="pickle")
+        await self.GIVEN_ChannelResourceCreated()
+        await self.GIVEN_ConsumerChannelCreated()
+
+        await self.WHEN_MessageSentAndConsumed({"fake_key": (1,2)})
+
+        self.THEN_CallbackReceivesMessage({"fake_key": (1,2)})
+
+    # @unittest.skip("skipped")
+    @asyncio_test
+    async def test_consumer_decodes_by_content_type(self):
+        await self.GIVEN_ConnectionResourceCreated("localhost",1234,"in_memory")
+        await self.GIVEN_ChannelResourceCreated(serializer="raw")
+        await self.GIVEN_ConsumerChannelCreated()
+
+        await self.WHEN_MessageSentAndConsumed(b"\x00fake_message")
+
+        self.THEN_CallbackReceivesMessage(b"\x00fake_message")
+
+    # @unittest.skip("skipped")
+    @asyncio_test
+    async def test_raw_needs_bytes(self):
+        await self.GIVEN_ConnectionResourceCreated("localhost",1234,"in_memory")
+        await self.GIVEN_ChannelResourceCreated(serializer="raw")
+
+        with self.assertRaises(TypeError):
+            await self.WHEN_MessageSentAndConsumed("fake_message")
+
+    # @unittest.skip("skipped")
+    @asyncio_test
+    async def test_unknown_serializer(self):
+        with self.assertRaises(ValueError):
+            await self.GIVEN_ConnectionResourceCreated("localhost",1234,"in_memory",
+                                                       serializer="fake_serializer")
+
+    # @unittest.skip("skipped")
+    @asyncio_test
+    async def test_raw_consumer_skips_decoding(self):
+        await self.GIVEN_ConnectionResourceCreated("localhost",1234,"in_memory")
+        await self.GIVEN_ChannelResourceCreated()
+        self.consumer_chan = await self.conn.create_channel()
+        await self.consumer_chan.register_consumer(queue_name="fake_consumer_queue",
+                                                   exchange_name="fake_exch",
+                                                   exchange_type="direct",
+                                                   routing_keys=["fake_routing_key"],
+                                                   callback=self.raw_callback,
+                                                   raw=True)
+
+        await self.WHEN_MessageSentAndConsumed({"fake_key": 1})
+
+        self.assertEqual(mooq.RawMessage(body=b'{"fake_key": 1}',
+                                         exchange="fake_exch",
+                                         routing_key="fake_routing_key",
+                                         delivery_tag=None,
+                                         content_type="application/json",
+                                         content_encoding=None),
+                         self.actual)
+
+    async def raw_callback(self,resp):
+        self.actual = resp
+
+    # @unittest.skip("skipped")
+    @asyncio_test
+    async def test_undecodable_message_doesnt_stop_other_queues(self):
+        errors = []
+        self.loop.set_exception_handler(lambda loop,context: errors.append(context["exception"]))
+        await self.GIVEN_ConnectionResourceCreated("localhost",1234,"in_memory")
+        await self.GIVEN_ChannelResourceCreated(serializer="pickle")
+        await self.GIVEN_ConsumerChannelCreated()
+        await self.consumer_chan.register_consumer(queue_name="fake_consumer_queue2",
+                                                   exchange_name="fake_exch",
+                                                   exchange_type="direct",
+                                                   routing_keys=["fake_routing_key2"],
+                                                   callback=self.fake_callback2)
+        await self.consumer_chan.register_producer(exchange_name="fake_exch",
+                                                   exchange_type="direct")
+        await self.chan.register_producer(exchange_name="fake_exch",
+                                          exchange_type="direct")
+
+        await self.chan.publish(exchange_name="fake_exch",
+                                msg="fake_message",
+                                routing_key="fake_routing_key")
+        await self.consumer_chan.publish(exchange_name="fake_exch",
+                                         msg="fake_message2",
+                                         routing_key="fake_routing_key2")
+        await self.WHEN_ProcessEventsOnce()
+
+        self.THEN_Callback2ReceivesMessage("fake_message2")
+        self.assertEqual(1,len(errors))
+
+    # @unittest.skip("skipped")
+    @asyncio_test
+    async def test_pickle_not_decoded_by_other_serializers(self):
+        json_serializer = mooq.serializers.get("json")
+
+        serializer = mooq.serializers.for_content_type("application/x-python-serialize",
+                                                       json_serializer)
+
+        self.assertIs(json_serializer,serializer)
+
+
+# @unittest.skip("skipped")
+class InMemoryCompressionTest(TwoChannelTestCase):
+    async def WHEN_MessageSent(self,msg):
+        self.conn.process_events = AsyncMock()
+        await self.WHEN_MessageSentAndConsumed(msg)
+        cq = self.conn.broker._get_consumer_queue("fake_consumer_queue")
+        return cq.get_next_message()
+
+    # @unittest.skip("skipped")
+    @asyncio_test
+    async def test_compresses_large_messages(self):
+        await self.GIVEN_ConnectionResourceCreated("localhost",1234,"in_memory",
+                                                   compression="zlib")
+        await self.GIVEN_ChannelResourceCreated()
+        await self.GIVEN_ConsumerChannelCreated()
+
+        msg_dict = await self.WHEN_MessageSent("a" * 2000)
+
+        self.assertEqual("zlib",msg_dict["content_encoding"])
+        self.assertLess(len(msg_dict["msg"]),100)
+
+    # @unittest.skip("skipped")
+    @asyncio_test
+    async def test_leaves_small_messages(self):
+        await self.GIVEN_ConnectionResourceCreated("localhost",1234,"in_memory",
+                                                   compression="zlib")
+        await self.GIVEN_ChannelResourceCreated()
+        await self.GIVEN_ConsumerChannelCreated()
+
+        msg_dict = await self.WHEN_MessageSent("fake_message")
+
+        self.assertIsNone(msg_dict["content_encoding"])
+        self.assertEqual(b'"fake_message"',msg_dict["msg"])
+
+    # @unittest.skip("skipped")
+    @asyncio_test
+    async def test_consumer_decompresses(self):
+        await self.GIVEN_ConnectionResourceCreated("localhost",1234,"in_memory")
+        await self.GIVEN_ChannelResourceCreated(
+            compression=mooq.compression.ZlibCompressor(min_size=10,level=9))
+        await self.GIVEN_ConsumerChannelCreated()
+
+        await self.WHEN_MessageSentAndConsumed({"fake_key": "fake_message" * 10})
+
+        self.THEN_CallbackReceivesMessage({"fake_key": "fake_message" * 10})
+
+    # @unittest.skip("skipped")
+    @asyncio_test
+    async def test_unknown_compression(self):
+        with self.assertRaises(ValueError):
+            await self.GIVEN_ConnectionResourceCreated("localhost",1234,"in_memory",
+                                                       compression="fake_compression")
+
+    # @unittest.skip("skipped")
+    def test_other_content_encodings_not_decompressed(self):
+        msg = mooq.base.decode(b'{"fake_key": 1}',mooq.serializers.get("json"),
+                               "application/json","utf-8")
+
+        self.assertEqual({"fake_key": 1},msg)
+
+
+# @unittest.skip("skipped")
+class RabbitMQAsyncioConfirmsTest(unittest.TestCase):
+    async def async_setUp(self):
+        self.internal_chan = Mock()
+        self.chan = mooq.RabbitMQAsyncioChannel(internal_chan=self.internal_chan,
+                                                loop=self.loop)
+        await self.chan.enable_confirms(max_in_flight=3)
+        self.on_confirm = self.internal_chan.confirm_delivery.call_args[1]["callback"]
+        self.on_close = self.internal_chan.add_on_close_callback.call_args[0][0]
+
+    async def async_tearDown(self):
+        pass
+
+    async def GIVEN_MessagesPublished(self,n):
+        return [await self.chan.publish(exchange_name="fake_exch",
+                                        msg="fake_message",
+                                        routing_key="fake_routing_key",
+                                        wait=False)
+                for _ in range(n)]
+
+    def WHEN_BrokerConfirms(self,delivery_tag,multiple=False,method_type=pika.spec.Basic.Ack):
+        self.on_confirm(Mock(method=method_type(delivery_tag=delivery_tag,multiple=multiple)))
+
+    # @unittest.skip("skipped")
+    @asyncio_test
+    async def test_ack_resolves_confirmation(self):
+        confirmations = await self.GIVEN_MessagesPublished(2)
+
+        self.WHEN_BrokerConfirms(2)
+
+        self.assertFalse(confirmations[0].done())
+        self.assertIsNone(confirmations[1].result())
+
+    # @unittest.skip("skipped")
+    @asyncio_test
+    async def test_multiple_ack_resolves_earlier_confirmations(self):
+        confirmations = await self.GIVEN_MessagesPublished(3)
+
+        self.WHEN_BrokerConfirms(2,multiple=True)
+
+        self.assertEqual([True,True,False],[c.done() for c in confirmations])
+
+    # @unittest.skip("skipped")
+    @asyncio_test
+    async def test_nack_raises(self):
+        confirmation, = await self.GIVEN_MessagesPublished(1)
+
+        self.WHEN_BrokerConfirms(1,method_type=pika.spec.Basic.Nack)
+
+        with self.assertRaises(mooq.PublishNacked):
+            await confirmation
+
+    # @unittest.skip("skipped")
+    @asyncio_test
+    async def test_publish_waits_for_room_in_window(self):
+        await self.GIVEN_MessagesPublished(3)
+        task = self.loop.create_task(self.GIVEN_MessagesPublished(1))
+        await asyncio.sleep(0)
+        self.assertEqual(3,self.internal_chan.basic_publish.call_count)
+
+        self.WHEN_BrokerConfirms(1)
+        await task
+
+        self.assertEqual(4,self.internal_chan.basic_publish.call_count)
+
+    # @unittest.skip("skipped")
+    @asyncio_test
+    async def test_publish_many_sends_as_window_allows(self):
+        task = self.loop.create_task(
+            self.chan.publish_many(exchange_name="fake_exch",
+                                   messages=[("fake_message","fake_routing_key")]*5))
+        await asyncio.sleep(0)
+        self.assertEqual(3,self.internal_chan.basic_publish.call_count)
+
+        self.WHEN_BrokerConfirms(3,multiple=True)
+        await asyncio.sleep(0)
+        self.WHEN_BrokerConfirms(5,multiple=True)
+        await task
+
+        self.assertEqual(5,self.internal_chan.basic_publish.call_count)
+
+    # @unittest.skip("skipped")
+    @asyncio_test
+    async def test_unencodable_message_takes_no_delivery_tag(self):
+        with self.assertRaises(TypeError):
+            await self.chan.publish_many(exchange_name="fake_exch",
+                                         messages=[("fake_message","fake_routing_key"),
+                                                   (object(),"fake_routing_key")])
+        self.assertEqual(0,self.internal_chan.basic_publish.call_count)
+
+        confirmation, = await self.GIVEN_MessagesPublished(1)
+        self.WHEN_BrokerConfirms(1)
+
+        self.assertIsNone(confirmation.result())
+
+    # @unittest.skip("skipped")
+    @asyncio_test
+    async def test_send_failure_fails_unconfirmed(self):
+        confirmation, = await self.GIVEN_MessagesPublished(1)
+        self.internal_chan.basic_publish.side_effect = ConnectionError("fake_error")
+
+        with self.assertRaises(ConnectionError):
+            await self.GIVEN_MessagesPublished(1)
+
+        with self.assertRaises(ConnectionError):
+            await confirmation
+
+    # @unittest.skip("skipped")
+    @asyncio_test
+    async def test_channel_close_fails_unconfirmed(self):
+        confirmation, = await self.GIVEN_MessagesPublished(1)
+
+        self.on_close(self.internal_chan,404,"NOT_FOUND - no exchange 'fake_exch'")
+
+        with self.assertRaises(mooq.BadExchange):
+            await confirmation
+
+
+# @unittest.skip("skipped")
+class RabbitMQAsyncioChannelPoolTest(unittest.TestCase):
+    async def async_setUp(self):
+        self.internal_chans = []
+        conn = Mock()
+        conn.create_channel = self.create_channel
+        self.pool = mooq.ChannelPool(conn,max_size=2,strategy="round_robin",
+                                     serializer=None,compression=None,max_in_flight=1)
+
+    async def async_tearDown(self):
+        pass
+
+    async def create_channel(self,serializer,compression):
+        internal_chan = Mock()
+        self.internal_chans.append(internal_chan)
+        return mooq.RabbitMQAsyncioChannel(internal_chan=internal_chan,loop=self.loop)
+
+    def WHEN_BrokerConfirms(self,internal_chan,delivery_tag):
+        on_confirm = internal_chan.confirm_delivery.call_args[1]["callback"]
+        on_confirm(Mock(method=pika.spec.Basic.Ack(delivery_tag=delivery_tag)))
+
+    # @unittest.skip("skipped")
+    @asyncio_test
+    async def test_channels_have_their_own_confirm_window(self):
+        publishes = asyncio.gather(*[self.pool.publish(exchange_name="fake_exch",
+                                                       msg="fake_message",
+                                                       routing_key="fake_routing_key")
+                                     for _ in range(2)])
+        for _ in range(3):
+            await asyncio.sleep(0)
+
+        self.assertEqual(2,len(self.internal_chans))
+        for internal_chan in self.internal_chans:
+            self.assertEqual(1,internal_chan.basic_publish.call_count)
+            self.WHEN_BrokerConfirms(internal_chan,1)
+        await publishes
+
+
+# @unittest.skip("skipped")
+class RabbitMQAsyncioAckTest(unittest.TestCase):
+    async def async_setUp(self):
+        self.internal_chan = Mock()
+        for method in ["exchange_declare","queue_declare","queue_bind","basic_qos"]:
+            getattr(self.internal_chan,method).side_effect = self.reply
+        self.chan = mooq.RabbitMQAsyncioChannel(internal_chan=self.internal_chan,
+                                                loop=self.loop)
+        self.releases = {}
+
+    async def async_tearDown(self):
+        for release in self.releases.values():
+            release.set()
+        await asyncio.sleep(0)
+
+    def reply(self,callback,**kwargs):
+        callback(Mock())
+
+    async def blocking_callback(self,resp):
+        self.releases[resp["msg"]] = asyncio.Event()
+        await self.releases[resp["msg"]].wait()
+
+    async def GIVEN_AckConsumerRegistered(self):
+        await self.chan.register_consumer(queue_name="fake_consumer_queue",
+                                          exchange_name="fake_exch",
+                                          exchange_type="direct",
+                                          routing_keys=["fake_routing_key"],
+                                          callback=self.blocking_callback,
+                                          prefetch_count=10,
+                                          ack=True)
+        self.on_message = self.internal_chan.basic_consume.call_args[0][0]
+
+    async def GIVEN_MessagesReceived(self,n):
+        for tag in range(1,n+1):
+            self.on_message(self.internal_chan,Mock(delivery_tag=tag),
+                            Mock(content_type="application/json",content_encoding=None),
+                            json.dumps(tag))
+        await asyncio.sleep(0)
+
+    async def WHEN_CallbacksFinish(self,*msgs):
+        for msg in msgs:
+            self.releases[msg].set()
+        for _ in range(3):
+            await asyncio.sleep(0)
+
+    def THEN_AcksSent(self,expected_tags):
+        actual = [c[1]["delivery_tag"] for c in self.internal_chan.basic_ack.call_args_list]
+        self.assertEqual(expected_tags,actual)
+        for c in self.internal_chan.basic_ack.call_args_list:
+            self.assertTrue(c[1]["multiple"])
+
+    # @unittest.skip("skipped")
+    @asyncio_test
+    async def test_sets_qos_and_consumes_with_acks(self):
+        await self.GIVEN_AckConsumerRegistered()
+
+        self.assertEqual(10,self.internal_chan.basic_qos.call_args[1]["prefetch_count"])
+        self.assertFalse(self.internal_chan.basic_consume.call_args[1]["no_ack"])
+
+    # @unittest.skip("skipped")
+    @asyncio_test
+    async def test_raw_consumer_gets_body_untouched(self):
+        received = []
+
+        async def callback(resp):
+            received.append(resp)
+
+        await self.chan.register_consumer(queue_name="fake_consumer_queue",
+                                          exchange_name="fake_exch",
+                                          exchange_type="direct",
+                                          routing_keys=["fake_routing_key"],
+                                          callback=callback,
+                                          raw=True)
+        on_message = self.internal_chan.basic_consume.call_args[0][0]
+        body = b"\x00" * 1024
+
+        on_message(self.internal_chan,
+                   Mock(delivery_tag=1,exchange="fake_exch",routing_key="fake_routing_key"),
+                   Mock(content_type="application/octet-stream",content_encoding=None),
+                   body)
+        await asyncio.sleep(0)
+
+        self.assertIs(body,received[0].body)
+        self.assertEqual("fake_routing_key",received[0].routing_key)
+        self.assertEqual(1,received[0].delivery_tag)
+
+    # @unittest.skip("skipped")
+    @asyncio_test
+    async def test_batch_callback_acks_whole_batch(self):
+        batches = []
+
+        async def batch_callback(resps):
+            batches.append([resp["msg"] for resp in resps])
+
+        await self.chan.register_consumer(queue_name="fake_consumer_queue",
+                                          exchange_name="fake_exch",
+                                          exchange_type="direct",
+                                          routing_keys=["fake_routing_key"],
+                                          batch_callback=batch_callback,
+                                          ack=True)
+        self.on_message = self.internal_chan.basic_consume.call_args[0][0]
+
+        await self.GIVEN_MessagesReceived(3)
+        for _ in range(3):
+            await asyncio.sleep(0)
+
+        self.assertEqual([[1,2,3]],batches)
+        self.THEN_AcksSent([3])
+
+    # @unittest.skip("skipped")
+    @asyncio_test
+    async def test_acks_finished_callbacks_in_one_batch(self):
+        await self.GIVEN_AckConsumerRegistered()
+        await self.GIVEN_MessagesReceived(3)
+
+        await self.WHEN_CallbacksFinish(1,2,3)
+
+        self.THEN_AcksSent([3])
+
+    async def GIVEN_FailingConsumerRegistered(self,**kwargs):
+        self.errors = []
+        self.loop.set_exception_handler(lambda loop,context: self.errors.append(context["exception"]))
+
+        async def callback(resp):
+            if resp["msg"] == 2:
+                raise ValueError("fake_error")
+
+        await self.chan.register_consumer(queue_name="fake_consumer_queue",
+                                          exchange_name="fake_exch",
+                                          exchange_type="direct",
+                                          routing_keys=["fake_routing_key"],
+                                          callback=callback,
+                                          ack=True,
+                                          **kwargs)
+        self.on_message = self.internal_chan.basic_consume.call_args[0][0]
+
+    # @unittest.skip("skipped")
+    @asyncio_test
+    async def test_rejects_message_whose_callback_raised(self):
+        await self.GIVEN_FailingConsumerRegistered()
+
+        await self.GIVEN_MessagesReceived(3)
+        for _ in range(3):
+            await asyncio.sleep(0)
+
+        self.internal_chan.basic_reject.assert_called_once_with(delivery_tag=2,requeue=False)
+        self.THEN_AcksSent([3])
+        self.assertIsInstance(self.errors[0],ValueError)
+
+    # @unittest.skip("skipped")
+    @asyncio_test
+    async def test_requeues_last_message_without_acking_it(self):
+        await self.GIVEN_FailingConsumerRegistered(requeue_on_error=True)
+
+        await self.GIVEN_MessagesReceived(2)
+        for _ in range(3):
+            await asyncio.sleep(0)
+
+        self.internal_chan.basic_reject.assert_called_once_with(delivery_tag=2,requeue=True)
+        self.THEN_AcksSent([1])
+
+    # @unittest.skip("skipped")
+    @asyncio_test
+    async def test_rejects_undecodable_message(self):
+        errors = []
+        self.loop.set_exception_handler(lambda loop,context: errors.append(context["exception"]))
+        await self.GIVEN_AckConsumerRegistered()
+
+        self.on_message(self.internal_chan,Mock(delivery_tag=1),
+                        Mock(content_type="application/json",content_encoding=None),
+                        b"\x00fake_message")
+        self.on_message(self.internal_chan,Mock(delivery_tag=2),
+                        Mock(content_type="application/json",content_encoding=None),
+                        json.dumps(2))
+        await asyncio.sleep(0)
+        await self.WHEN_CallbacksFinish(2)
+
+        self.internal_chan.basic_reject.assert_called_once_with(delivery_tag=1,requeue=False)
+        self.THEN_AcksSent([2])
+        self.assertEqual(1,len(errors))
+
+    # @unittest.skip("skipped")
+    @asyncio_test
+    async def test_max_concurrency_limits_prefetch(self):
+        await self.chan.register_consumer(queue_name="fake_consumer_queue",
+                                          exchange_name="fake_exch",
+                                          exchange_type="direct",
+                                          routing_keys=["fake_routing_key"],
+                                          callback=self.blocking_callback,
+                                          max_concurrency=2)
+
+        self.assertEqual(2,self.internal_chan.basic_qos.call_args[1]["prefetch_count"])
+        self.assertFalse(self.internal_chan.basic_consume.call_args[1]["no_ack"])
+
+    # @unittest.skip("skipped")
+    @asyncio_test
+    async def test_sets_each_consumers_own_prefetch(self):
+        for queue_name,prefetch_count in [("fake_queue_1",2),("fake_queue_2",5),("fake_queue_3",None)]:
+            await self.chan.register_consumer(queue_name=queue_name,
+                                              exchange_name="fake_exch",
+                                              exchange_type="direct",
+                                              routing_keys=["fake_routing_key"],
+                                              callback=self.blocking_callback,
+                                              prefetch_count=prefetch_count,
+                                              ack=True)
+
+        calls = self.internal_chan.basic_qos.call_args_list
+        self.assertEqual([2,5,0],[c[1]["prefetch_count"] for c in calls])
+        for c in calls:
+            self.assertFalse(c[1]["all_channels"])
+
+    # @unittest.skip("skipped")
+    @asyncio_test
+    async def test_max_concurrency_without_ack_acks_when_started(self):
+        await self.chan.register_consumer(queue_name="fake_consumer_queue",
+                                          exchange_name="fake_exch",
+                                          exchange_type="direct",
+                                          routing_keys=["fake_routing_key"],
+                                          callback=self.blocking_callback,
+                                          max_concurrency=2)
+        self.on_message = self.internal_chan.basic_consume.call_args[0][0]
+
+        await self.GIVEN_MessagesReceived(3)
+        await asyncio.sleep(0)
+        self.THEN_AcksSent([2])
+
+        await self.WHEN_CallbacksFinish(1)
+        self.THEN_AcksSent([2,3])
+
+    # @unittest.skip("skipped")
+    @asyncio_test
+    async def test_batch_max_concurrency_needs_prefetch_count(self):
+        async def batch_callback(resps):
+            pass
+
+        with self.assertRaises(ValueError):
+            await self.chan.register_consumer(queue_name="fake_consumer_queue",
+                                              exchange_name="fake_exch",
+                                              exchange_type="direct",
+                                              routing_keys=["fake_routing_key"],
+                                              batch_callback=batch_callback,
+                                              max_concurrency=2)
+
+    # @unittest.skip("skipped")
+    @asyncio_test
+    async def test_ack_waits_for_earlier_callbacks(self):
+        await self.GIVEN_AckConsumerRegistered()
+        await self.GIVEN_MessagesReceived(3)
 
+        await self.WHEN_CallbacksFinish(2,3)
+        self.THEN_AcksSent([])
 
+        await self.WHEN_CallbacksFinish(1)
+        self.THEN_AcksSent([3])
 
 
 